@@ -1,5 +1,16 @@
 from django.contrib import admin
-from .models import DistributionCenter, Order
+from .models import ApiKey, CenterDailyRollup, CenterStockSlot, DistributionCenter, Order
 
 admin.site.register(DistributionCenter)
-admin.site.register(Order)
\ No newline at end of file
+admin.site.register(Order)
+admin.site.register(CenterDailyRollup)
+admin.site.register(CenterStockSlot)
+
+@admin.register(ApiKey)
+class ApiKeyAdmin(admin.ModelAdmin):
+    # Keys are issued with the issue_api_key command; the hash is never editable
+    list_display = ('prefix', 'user', 'name', 'created_at', 'revoked_at')
+    readonly_fields = ('prefix', 'key_hash', 'created_at')
+
+    def has_add_permission(self, request):
+        return False
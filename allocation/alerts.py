@@ -0,0 +1,180 @@
+import atexit
+import logging
+import threading
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.utils import timezone
+
+from . import metrics, sinks
+from .models import DistributionCenter
+
+logger = logging.getLogger('allocation.alerts')
+
+# Low-stock alert engine. Each center carries its alert level (0 = ok, then
+# one per ALERT_LEVELS entry) and the time it was last alerted on its row, so
+# every worker sees the same state. observe() runs after each stock change and
+# only writes when the level changes or a reminder is due; the transition is
+# claimed with a conditional UPDATE, so exactly one worker reports it.
+# Reported transitions are queued in-process and published as one batch per
+# ALERT_FLUSH_INTERVAL, which is where duplicates and round trips are dropped.
+
+MESSAGES = {
+    'ok': "Stock recovered.",
+    'low': "Low stock! Replenish immediately.",
+    'critical': "Critical stock! Replenish immediately.",
+}
+
+_pending = {}
+_lock = threading.Lock()
+_flusher = None
+
+def level_for(stock, initial_stock, current=0):
+    # Level `i` is entered below ALERT_LEVELS[i - 1]'s ratio and only left at
+    # ratio + ALERT_HYSTERESIS, so stock hovering at a threshold stays put
+    if initial_stock <= 0:
+        return 0
+    ratio = stock / initial_stock
+    thresholds = [threshold for _, threshold in settings.ALERT_LEVELS]
+    level = current
+    while level < len(thresholds) and ratio < thresholds[level]:
+        level += 1
+    while level > 0 and ratio >= thresholds[level - 1] + settings.ALERT_HYSTERESIS:
+        level -= 1
+    return level
+
+def level_name(level):
+    return settings.ALERT_LEVELS[level - 1][0] if level else 'ok'
+
+def _due(center, now):
+    # New level for the center, or None when nothing needs reporting
+    level = level_for(center.total_stock, center.initial_stock, center.alert_level)
+    if level != center.alert_level:
+        return level
+    if level and (center.alert_sent_at is None
+                  or now - center.alert_sent_at >= timedelta(seconds=settings.ALERT_REALERT_INTERVAL)):
+        return level
+    return None
+
+def _claim(center):
+    return DistributionCenter.objects.filter(
+        pk=center.pk, alert_level=center.alert_level, alert_sent_at=center.alert_sent_at
+    )
+
+def observe(center):
+    # Called with the center's current stock after it changed. Returns True
+    # when a transition (or reminder) was queued.
+    now = timezone.now()
+    level = _due(center, now)
+    if level is None:
+        return False
+    if not _claim(center).update(alert_level=level, alert_sent_at=now):
+        # Another worker (or a stale copy of the row) got there first
+        return False
+    _queue(center, center.alert_level, level, now)
+    return True
+
+async def aobserve(center):
+    now = timezone.now()
+    level = _due(center, now)
+    if level is None:
+        return False
+    if not await _claim(center).aupdate(alert_level=level, alert_sent_at=now):
+        return False
+    _queue(center, center.alert_level, level, now)
+    return True
+
+def transitions(centers):
+    # For callers holding the centers' row locks: sets the new alert_level /
+    # alert_sent_at on the instances for the caller to save with its own
+    # write, and returns what publish() needs once that write committed
+    now = timezone.now()
+    changed = []
+    for center in centers:
+        level = _due(center, now)
+        if level is not None:
+            changed.append((center, center.alert_level))
+            center.alert_level, center.alert_sent_at = level, now
+    return changed
+
+def publish(changed):
+    for center, previous in changed:
+        _queue(center, previous, center.alert_level, center.alert_sent_at)
+
+def _queue(center, previous, level, now):
+    center.alert_level, center.alert_sent_at = level, now
+    entry = {
+        "center_id": center.center_id,
+        "stock_remaining": center.total_stock,
+        "initial_stock": center.initial_stock,
+        "timestamp": now.isoformat(),
+        "level": level,
+    }
+    with _lock:
+        queued = _pending.get(center.pk)
+        entry["from"] = queued["from"] if queued else previous
+        if queued and level != previous and level == queued["from"]:
+            # Back where the last published alert left it: nothing to say
+            del _pending[center.pk]
+        else:
+            _pending[center.pk] = entry
+    _start_flusher()
+
+def _event(entry):
+    if entry["from"] == entry["level"]:
+        return 'reminder'
+    if entry["from"] == 0:
+        return 'raised'
+    if entry["level"] == 0:
+        return 'resolved'
+    return 'escalated' if entry["level"] > entry["from"] else 'deescalated'
+
+def flush():
+    # Publishes everything queued since the last flush as one batch
+    global _pending
+    with _lock:
+        batch, _pending = _pending, {}
+    if not batch:
+        return 0
+    records = []
+    for entry in batch.values():
+        name = level_name(entry["level"])
+        records.append({
+            "center_id": entry["center_id"],
+            "stock_remaining": entry["stock_remaining"],
+            "initial_stock": entry["initial_stock"],
+            "timestamp": entry["timestamp"],
+            "level": name,
+            "event": _event(entry),
+            "message": MESSAGES.get(name, MESSAGES['low']),
+        })
+    log = sinks.alert_log()
+    for record in records:
+        log.emit(record)
+        if record["level"] != 'ok':
+            metrics.count_low_stock_alert()
+    return len(records)
+
+def _start_flusher():
+    global _flusher
+    if _flusher is not None:
+        return
+    with _lock:
+        if _flusher is not None:
+            return
+
+        def run():
+            # A batch that fails to publish is logged and dropped; the next
+            # interval's batch still goes out
+            while True:
+                time.sleep(settings.ALERT_FLUSH_INTERVAL)
+                try:
+                    flush()
+                except Exception:
+                    logger.exception('alert flush failed')
+
+        _flusher = threading.Thread(target=run, name='alerts-flush', daemon=True)
+        _flusher.start()
+
+atexit.register(flush)
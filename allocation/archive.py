@@ -0,0 +1,250 @@
+import hashlib
+import json
+import math
+import os
+import tempfile
+from datetime import datetime, timedelta, timezone as dt_timezone
+
+import numpy as np
+from django.conf import settings
+from django.utils import timezone
+
+# Archived orders. The archive_orders command moves allocated orders older
+# than ORDER_RETENTION_DAYS out of the orders table into per-month segment
+# files under ARCHIVE_DIR:
+#
+#   <name>.npz        compressed columns (order_id, quantity, zip_code,
+#                     center, created_at in microseconds, sorted by it) plus
+#                     per-(center, UTC hour) order and quantity totals
+#   <name>.bloom.npy  bloom filter over the segment's order_ids
+#   manifest.json     one entry per segment: month, row count, first/last
+#                     created_at and the bloom filter's parameters
+#
+# Readers only open a segment when the manifest says its time range matters
+# or its bloom filter reports a possible order_id match. The command is the
+# only writer; the manifest is replaced atomically.
+
+EPOCH = datetime(1970, 1, 1, tzinfo=dt_timezone.utc)
+HOUR_US = 3600 * 10 ** 6
+MANIFEST = 'manifest.json'
+
+def _micros(value):
+    return (value - EPOCH) // timedelta(microseconds=1)
+
+def _hashes(order_ids):
+    # Two 64-bit hashes per order_id from one 128-bit digest
+    digests = b''.join(hashlib.blake2b(order_id.encode(), digest_size=16).digest() for order_id in order_ids)
+    pairs = np.frombuffer(digests, dtype='<u8').reshape(-1, 2)
+    return pairs[:, 0], pairs[:, 1] | np.uint64(1)
+
+def _bloom_positions(h1, h2, bits, hashes):
+    # Double hashing (h1 + i * h2, wrapping at 2**64): an (n, hashes) array
+    steps = np.arange(hashes, dtype=np.uint64)
+    return (h1[:, None] + steps * h2[:, None]) % np.uint64(bits)
+
+def _build_bloom(order_ids, fp_rate):
+    n = max(len(order_ids), 1)
+    bits = max(64, math.ceil(-n * math.log(fp_rate) / math.log(2) ** 2))
+    hashes = max(1, round(bits / n * math.log(2)))
+    positions = _bloom_positions(*_hashes(order_ids), bits, hashes).ravel()
+    array = np.zeros((bits + 7) // 8, dtype=np.uint8)
+    np.bitwise_or.at(array, positions >> np.uint64(3), np.left_shift(1, positions & np.uint64(7)).astype(np.uint8))
+    return array, bits, hashes
+
+class Segment:
+    def __init__(self, entry, directory):
+        self.name = entry['name']
+        self.month = entry['month']
+        self.rows = entry['rows']
+        self.first = datetime.fromisoformat(entry['first'])
+        self.last = datetime.fromisoformat(entry['last'])
+        self.bloom_bits = entry['bloom_bits']
+        self.bloom_hashes = entry['bloom_hashes']
+        self.path = os.path.join(directory, f'{self.name}.npz')
+        self.bloom = np.load(os.path.join(directory, f'{self.name}.bloom.npy'), mmap_mode='r')
+
+    def might_contain(self, h1, h2):
+        # Bloom filter test for hashed order_ids; False means not archived here
+        positions = _bloom_positions(h1, h2, self.bloom_bits, self.bloom_hashes)
+        bytes_ = np.asarray(self.bloom)[positions >> np.uint64(3)]
+        return (np.right_shift(bytes_, positions & np.uint64(7)) & 1).all(axis=1)
+
+    def open(self):
+        # Lazy: only the columns that are read get decompressed
+        return np.load(self.path)
+
+_manifest = (None, [])
+
+def segments():
+    # Reloaded when archive_orders replaces the manifest
+    global _manifest
+    directory = settings.ARCHIVE_DIR
+    path = os.path.join(directory, MANIFEST)
+    try:
+        stat = os.stat(path)
+        key = (path, stat.st_ino, stat.st_mtime_ns)
+    except OSError:
+        key = None
+    loaded_key, loaded = _manifest
+    if key != loaded_key:
+        loaded = []
+        if key:
+            with open(path) as f:
+                loaded = [Segment(entry, directory) for entry in json.load(f)['segments']]
+        _manifest = (key, loaded)
+    return loaded
+
+def write_segment(rows):
+    # rows: (order_id, quantity, zip_code, center pk or None, created_at)
+    # tuples of one month, sorted by created_at. Writes the segment and its
+    # bloom filter, then lists it in the manifest. Returns the manifest entry.
+    directory = settings.ARCHIVE_DIR
+    os.makedirs(directory, exist_ok=True)
+    order_ids, quantities, zip_codes, centers, created = zip(*rows)
+    month = created[0].astimezone(dt_timezone.utc).strftime('%Y-%m')
+    existing = [segment.name for segment in segments() if segment.month == month]
+    name = f'orders-{month}-{len(existing):04d}'
+
+    created_us = np.array([_micros(value) for value in created], dtype=np.int64)
+    center = np.array([-1 if pk is None else pk for pk in centers], dtype=np.int64)
+    quantity = np.array(quantities, dtype=np.int64)
+    keys, inverse = np.unique(np.stack([center, created_us // HOUR_US], axis=1), axis=0, return_inverse=True)
+    inverse = inverse.ravel()
+
+    fd, tmp = tempfile.mkstemp(dir=directory, suffix='.npz')
+    with os.fdopen(fd, 'wb') as f:
+        np.savez_compressed(
+            f,
+            order_id=np.array(order_ids),
+            quantity=quantity,
+            zip_code=np.array(zip_codes),
+            center=center,
+            created_at=created_us,
+            hour_center=keys[:, 0],
+            hour=keys[:, 1],
+            hour_orders=np.bincount(inverse, minlength=len(keys)).astype(np.int64),
+            hour_quantity=np.bincount(inverse, weights=quantity, minlength=len(keys)).astype(np.int64),
+        )
+    os.replace(tmp, os.path.join(directory, f'{name}.npz'))
+
+    bloom, bits, hashes = _build_bloom(order_ids, settings.ARCHIVE_BLOOM_FP_RATE)
+    fd, tmp = tempfile.mkstemp(dir=directory, suffix='.npy')
+    with os.fdopen(fd, 'wb') as f:
+        np.save(f, bloom)
+    os.replace(tmp, os.path.join(directory, f'{name}.bloom.npy'))
+
+    entry = {
+        "name": name,
+        "month": month,
+        "rows": len(rows),
+        "first": created[0].isoformat(),
+        "last": created[-1].isoformat(),
+        "bloom_bits": bits,
+        "bloom_hashes": hashes,
+    }
+    manifest_path = os.path.join(directory, MANIFEST)
+    try:
+        with open(manifest_path) as f:
+            manifest = json.load(f)
+    except OSError:
+        manifest = {"segments": []}
+    manifest["segments"].append(entry)
+    fd, tmp = tempfile.mkstemp(dir=directory, suffix='.json')
+    with os.fdopen(fd, 'w') as f:
+        json.dump(manifest, f, indent=1)
+    os.replace(tmp, manifest_path)
+    return entry
+
+def contains(order_id):
+    return bool(existing([order_id]))
+
+def existing(order_ids):
+    # The subset of order_ids already archived; only segments whose bloom
+    # filter matched one of them are opened
+    found = set()
+    loaded = segments()
+    if not loaded or not order_ids:
+        return found
+    order_ids = list(order_ids)
+    h1, h2 = _hashes(order_ids)
+    for segment in loaded:
+        candidates = [order_id for order_id, hit in zip(order_ids, segment.might_contain(h1, h2)) if hit]
+        if candidates:
+            with segment.open() as data:
+                archived = data['order_id']
+                found.update(order_id for order_id, hit in zip(candidates, np.isin(candidates, archived)) if hit)
+    return found
+
+def _bucket(hour, interval):
+    # Same buckets as Trunc() in the current time zone (exact for zones
+    # whose offset is a whole number of hours)
+    local = timezone.localtime(EPOCH + timedelta(hours=hour))
+    if interval == 'hour':
+        return local
+    if interval == 'week':
+        local -= timedelta(days=local.weekday())
+    return local.replace(hour=0)
+
+def _accumulate(totals, centers, hours, orders, quantities):
+    for key in zip(centers.tolist(), hours.tolist(), orders.tolist(), quantities.tolist()):
+        entry = totals.setdefault(key[:2], [0, 0])
+        entry[0] += key[2]
+        entry[1] += key[3]
+
+def trends(start, end, interval='day', center_pk=None):
+    # {(center pk or None, bucket): (orders, quantity)} for archived orders in
+    # [start, end). Whole hours come from the hourly totals; only a partial
+    # hour at either end reads the created_at column.
+    start_us, end_us = _micros(start), _micros(end)
+    first_full = -(-start_us // HOUR_US)
+    last_full = end_us // HOUR_US
+    edges = [
+        (start_us, min(first_full * HOUR_US, end_us)),
+        (max(last_full, first_full) * HOUR_US, end_us),
+    ]
+    totals = {}
+    for segment in segments():
+        if segment.last < start or segment.first >= end:
+            continue
+        with segment.open() as data:
+            hours, centers = data['hour'], data['hour_center']
+            mask = (hours >= first_full) & (hours < last_full)
+            if center_pk is not None:
+                mask &= centers == center_pk
+            _accumulate(totals, centers[mask], hours[mask], data['hour_orders'][mask], data['hour_quantity'][mask])
+            if any(lo < hi for lo, hi in edges):
+                created, center, quantity = data['created_at'], data['center'], data['quantity']
+                for lo, hi in edges:
+                    if lo >= hi:
+                        continue
+                    a, b = np.searchsorted(created, [lo, hi])
+                    mask = np.ones(b - a, dtype=bool) if center_pk is None else center[a:b] == center_pk
+                    _accumulate(totals, center[a:b][mask], created[a:b][mask] // HOUR_US,
+                                np.ones(mask.sum(), dtype=np.int64), quantity[a:b][mask])
+
+    buckets = {}
+    bucket_of = {}
+    for (center, hour), (orders, quantity) in totals.items():
+        if hour not in bucket_of:
+            bucket_of[hour] = _bucket(hour, interval)
+        entry = buckets.setdefault((None if center < 0 else center, bucket_of[hour]), [0, 0])
+        entry[0] += orders
+        entry[1] += quantity
+    return {key: tuple(value) for key, value in buckets.items()}
+
+def daily_totals():
+    # {(center pk, local date): (orders, quantity)} over the whole archive,
+    # for rebuilding CenterDailyRollup
+    totals = {}
+    for segment in segments():
+        with segment.open() as data:
+            hours, centers = data['hour'], data['hour_center']
+            _accumulate(totals, centers, hours, data['hour_orders'], data['hour_quantity'])
+    days = {}
+    for (center, hour), (orders, quantity) in totals.items():
+        if center < 0:
+            continue
+        entry = days.setdefault((center, _bucket(hour, 'day').date()), [0, 0])
+        entry[0] += orders
+        entry[1] += quantity
+    return {key: tuple(value) for key, value in days.items()}
@@ -0,0 +1,74 @@
+import numpy as np
+
+def solve(costs, quantities, capacities, candidates=16, passes=3):
+    # Assigns each order (row) to one center (column) so the total cost is
+    # low while no center gives out more than its capacity. Orders cannot be
+    # split, which makes the exact problem a generalized assignment problem;
+    # this uses the regret heuristic (the order that loses most by not getting
+    # its best center is placed first), then improves the result with single
+    # moves and pairwise swaps. Only each order's `candidates` cheapest centers
+    # are considered, unless none of them can take the order any more.
+    # Returns the chosen column per order, or None when nothing can take it.
+    costs = np.asarray(costs, dtype=float)
+    quantities = [int(q) for q in quantities]
+    capacity = np.array(capacities, dtype=np.int64)
+    m, n = costs.shape
+    if m == 0 or n == 0:
+        return [None] * m
+
+    k = min(candidates, n)
+    shortlist = np.argpartition(costs, k - 1, axis=1)[:, :k]
+    shortlist = [sorted(row, key=lambda j, i=i: (costs[i, j], j)) for i, row in enumerate(shortlist.tolist())]
+
+    def options(i, limit=2):
+        found = [j for j in shortlist[i] if capacity[j] >= quantities[i]][:limit]
+        if not found:
+            masked = np.where(capacity >= quantities[i], costs[i], np.inf)
+            found = [int(j) for j in np.argsort(masked, kind='stable')[:limit] if np.isfinite(masked[j])]
+        return found
+
+    choice = [None] * m
+    remaining = list(range(m))
+    while remaining:
+        best = None
+        for i in remaining:
+            found = options(i)
+            if not found:
+                continue
+            regret = costs[i, found[1]] - costs[i, found[0]] if len(found) > 1 else np.inf
+            if best is None or regret > best[0]:
+                best = (regret, i, found[0])
+        if best is None:
+            break
+        _, i, j = best
+        choice[i] = j
+        capacity[j] -= quantities[i]
+        remaining.remove(i)
+
+    assigned = [i for i in range(m) if choice[i] is not None]
+    for _ in range(passes):
+        improved = False
+        for i in assigned:
+            for j in shortlist[i]:
+                if costs[i, j] >= costs[i, choice[i]]:
+                    break
+                if capacity[j] >= quantities[i]:
+                    capacity[choice[i]] += quantities[i]
+                    capacity[j] -= quantities[i]
+                    choice[i] = j
+                    improved = True
+                    break
+        for x, a in enumerate(assigned):
+            for b in assigned[x + 1:]:
+                ja, jb = choice[a], choice[b]
+                if ja == jb or costs[a, jb] + costs[b, ja] >= costs[a, ja] + costs[b, jb]:
+                    continue
+                shift = quantities[a] - quantities[b]
+                if capacity[jb] >= shift and capacity[ja] >= -shift:
+                    capacity[jb] -= shift
+                    capacity[ja] += shift
+                    choice[a], choice[b] = jb, ja
+                    improved = True
+        if not improved:
+            break
+    return [None if j is None else int(j) for j in choice]
@@ -0,0 +1,190 @@
+import functools
+import json
+import time
+from datetime import datetime, timedelta
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import IntegrityError, transaction
+from django.http import HttpResponseNotAllowed, JsonResponse, StreamingHttpResponse
+from django.utils import timezone
+from rest_framework import exceptions
+from rest_framework.request import Request
+
+from . import alerts, inventory, metrics, replica, rollups, sharding, sinks
+from .authentication import ApiKeyAuthentication
+from .caching import aversioned_response
+from .instrumentation import stage
+from .models import DistributionCenter, Order
+from .serializers import DUPLICATE_ORDER_ERROR, OrderPayload, duplicate_order_errors
+from .views import (
+    NO_STOCK_ERROR, analytics_queryset, analytics_row, decode_cursor, encode_cursor, page_limit
+)
+
+# Async-native counterparts of /allocate/ and /analytics/ for the ASGI
+# deployment. Same inputs and outputs as the DRF views, but the ORM is used
+# through its async API and log output goes through BufferedSink.aemit, so a
+# request only holds a thread while something genuinely has to block.
+
+AUTHENTICATION_CLASSES = [ApiKeyAuthentication]
+
+def _json(data, status=200):
+    return JsonResponse(data, status=status, safe=False, encoder=DjangoJSONEncoder)
+
+def _authenticate(request):
+    drf_request = Request(request, authenticators=[cls() for cls in AUTHENTICATION_CLASSES])
+    try:
+        return drf_request.user, None
+    except exceptions.AuthenticationFailed as e:
+        return None, e.detail
+
+def api_endpoint(method):
+    # Async stand-in for @api_view + the authentication/permission decorators
+    # used by the sync views: same authenticators, same 401 body and header.
+    def decorator(view):
+        @functools.wraps(view)
+        async def wrapper(request, *args, **kwargs):
+            if request.method != method:
+                return HttpResponseNotAllowed([method])
+            user, detail = await sync_to_async(_authenticate)(request)
+            if user is None or not user.is_authenticated:
+                response = _json({"detail": str(detail or exceptions.NotAuthenticated.default_detail)}, status=401)
+                response['WWW-Authenticate'] = AUTHENTICATION_CLASSES[0]().authenticate_header(request)
+                return response
+            request.user = user
+            return await view(request, *args, **kwargs)
+        # Token-authenticated API, as with DRF's APIView
+        wrapper.csrf_exempt = True
+        return wrapper
+    return decorator
+
+def _reserve_and_create(center_pk, order_data, slot_count):
+    # Reservation, order and rollup commit together, as in the sync path: a
+    # duplicate order_id (the unique constraint) rolls the reservation back
+    # and a crash can't leave stock taken without its order. None when the
+    # center could not cover the order after all.
+    with transaction.atomic():
+        slot = sharding.reserve(center_pk, order_data['quantity'], slot_count)
+        if slot is None:
+            return None
+        order = Order.objects.create(
+            order_id=order_data['order_id'],
+            quantity=order_data['quantity'],
+            zip_code=order_data['zip_code'],
+            center_id=center_pk,
+            status='allocated'
+        )
+        rollups.record_allocation(center_pk, order_data['quantity'], slot=slot)
+        best_center = sharding.with_total_stock(DistributionCenter.objects).get(pk=center_pk)
+    return order, best_center
+
+async def aallocate_order(order_data):
+    try:
+        quantity = order_data['quantity']
+        zip_code = order_data['zip_code']
+
+        with stage('locate'):
+            snapshot = await sync_to_async(inventory.get_snapshot)()
+        while True:
+            with stage('locate'):
+                center_pk = snapshot.nearest(int(zip_code), quantity)
+            if center_pk is None:
+                return {"error": NO_STOCK_ERROR}
+            slot_count = snapshot.slot_count(center_pk)
+            with stage('reserve'):
+                # Async ORM calls cannot share a transaction, so the whole
+                # write runs as one sync call
+                allocated = await sync_to_async(_reserve_and_create)(center_pk, order_data, slot_count)
+            if allocated:
+                order, best_center = allocated
+                break
+            level = await sharding.stock_levels(DistributionCenter.objects.filter(pk=center_pk)).afirst()
+            if level is None or level[1] != slot_count:
+                await sync_to_async(inventory.invalidate)()
+                snapshot = await sync_to_async(inventory.get_snapshot)()
+            else:
+                snapshot.set_stock(center_pk, level[0])
+
+        inventory.record_stock(best_center.pk, best_center.total_stock)
+        result = {
+            "order_id": order.order_id,
+            "center_id": best_center.center_id,
+            "status": order.status
+        }
+        with stage('log'):
+            await alerts.aobserve(best_center)
+            await sinks.order_log().aemit(result)
+        return result
+
+    except IntegrityError:
+        # Raised by the unique order_id constraint, as in the sync path
+        return {"error": DUPLICATE_ORDER_ERROR}
+    except ValueError as e:
+        return {"error": f"Value error: {str(e)}"}
+    except Exception as e:
+        return {"error": str(e)}
+
+@api_endpoint('POST')
+async def allocate_order_async_view(request):
+    await replica.apin(request.user)
+    started = time.perf_counter()
+    try:
+        payload = OrderPayload(json.loads(request.body))
+    except ValueError as e:
+        return _json({"detail": f"JSON parse error - {e}"}, status=400)
+    with stage('validate'):
+        valid = payload.is_valid()
+    if not valid:
+        metrics.observe_allocation('validation_error', time.perf_counter() - started)
+        return _json(payload.errors, status=400)
+
+    result = await aallocate_order(payload.validated_data)
+    if result.get("error") == DUPLICATE_ORDER_ERROR:
+        metrics.observe_allocation('validation_error', time.perf_counter() - started)
+        return _json(duplicate_order_errors(), status=400)
+    if "error" in result:
+        outcome = 'no_stock' if result["error"] == NO_STOCK_ERROR else 'error'
+        metrics.observe_allocation(outcome, time.perf_counter() - started)
+        return _json(result, status=400)
+    metrics.observe_allocation('allocated', time.perf_counter() - started)
+    return _json(result)
+
+@api_endpoint('GET')
+@replica.areplica_reads
+@aversioned_response()
+async def center_analytics_async_view(request):
+    since = timezone.now() - timedelta(days=30)
+    if request.GET.get('from_date'):
+        try:
+            since = datetime.fromisoformat(request.GET['from_date'])
+        except ValueError:
+            return _json({"error": "Invalid from_date format (use YYYY-MM-DD)"}, status=400)
+    analytics = analytics_queryset(since)
+
+    cursor = request.GET.get('cursor')
+    if cursor:
+        try:
+            analytics = analytics.filter(center_id__gt=decode_cursor(cursor))
+        except (ValueError, UnicodeDecodeError):
+            return _json({"error": "Invalid cursor"}, status=400)
+
+    if request.GET.get('stream') in ('1', 'true'):
+        async def rows():
+            async for row in analytics.aiterator(chunk_size=settings.ANALYTICS_STREAM_CHUNK_SIZE):
+                yield json.dumps(analytics_row(row), cls=DjangoJSONEncoder) + '\n'
+        return StreamingHttpResponse(rows(), content_type='application/x-ndjson')
+
+    limit = request.GET.get('limit')
+    if limit is None and cursor is None:
+        return _json([analytics_row(row) async for row in analytics])
+
+    limit = page_limit(limit)
+    if limit is None:
+        return _json({"error": "limit must be a positive integer"}, status=400)
+    page = [analytics_row(row) async for row in analytics[:limit + 1]]
+    next_cursor = None
+    if len(page) > limit:
+        page = page[:limit]
+        next_cursor = encode_cursor(page[-1]['center_id'])
+    return _json({"results": page, "next_cursor": next_cursor})
@@ -0,0 +1,99 @@
+import hmac
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.cache import caches
+from drf_spectacular.extensions import OpenApiAuthenticationExtension
+from rest_framework import exceptions
+from rest_framework.authentication import BaseAuthentication
+
+from .instrumentation import stage
+from .models import ApiKey
+
+# Api-Key header authentication. Keys are looked up by their SHA-256 digest
+# (see ApiKey), and verified keys are kept in a bounded per-process LRU so a
+# steady client costs one digest and one version read per request instead
+# of a PBKDF2 run. Issuing, revoking or deleting a key (or changing its
+# user) bumps a version in the 'shared' cache, which drops every worker's
+# entries on their next request.
+
+VERSION_KEY = 'allocation:api-key-version'
+
+_verified = OrderedDict()
+_lock = threading.Lock()
+
+def _versions():
+    return caches['shared']
+
+def current_version():
+    return _versions().get_or_set(VERSION_KEY, 0, timeout=None)
+
+def invalidate():
+    with _lock:
+        _verified.clear()
+    try:
+        _versions().incr(VERSION_KEY)
+    except ValueError:
+        _versions().set(VERSION_KEY, 1, timeout=None)
+
+def _lookup(raw_key, digest):
+    api_key = ApiKey.objects.select_related('user').filter(
+        key_hash=digest, revoked_at__isnull=True, user__is_active=True
+    ).first()
+    if api_key is not None:
+        return api_key.user, api_key
+    if settings.API_KEY and hmac.compare_digest(raw_key.encode(), settings.API_KEY.encode()):
+        # Shared key from the environment, kept for existing clients; it acts
+        # as API_KEY_USER, which has to exist and be active
+        user = get_user_model().objects.filter(username=settings.API_KEY_USER, is_active=True).first()
+        if user is not None:
+            return user, None
+    return None
+
+def verify(raw_key):
+    # (user, api_key) for a valid key, None otherwise. api_key is None for
+    # the shared settings.API_KEY.
+    digest = ApiKey.hash_key(raw_key)
+    version = current_version()
+    now = time.monotonic()
+    with _lock:
+        entry = _verified.get(digest)
+        if entry is not None and entry[1] == version and entry[2] > now:
+            _verified.move_to_end(digest)
+            return entry[0]
+
+    result = _lookup(raw_key, digest)
+    if result is not None:
+        with _lock:
+            _verified[digest] = (result, version, now + settings.API_KEY_CACHE_TTL)
+            _verified.move_to_end(digest)
+            while len(_verified) > settings.API_KEY_CACHE_SIZE:
+                _verified.popitem(last=False)
+    return result
+
+class ApiKeyAuthentication(BaseAuthentication):
+    header = 'Api-Key'
+
+    def authenticate(self, request):
+        raw_key = request.headers.get(self.header)
+        if not raw_key:
+            return None
+        with stage('auth'):
+            result = verify(raw_key)
+        if result is None:
+            raise exceptions.AuthenticationFailed('Invalid API key')
+        return result
+
+    def authenticate_header(self, request):
+        # Makes unauthenticated requests 401 rather than 403
+        return self.header
+
+class ApiKeyScheme(OpenApiAuthenticationExtension):
+    target_class = 'allocation.authentication.ApiKeyAuthentication'
+    name = 'ApiKeyAuth'
+
+    def get_security_definition(self, auto_schema):
+        return {'type': 'apiKey', 'in': 'header', 'name': ApiKeyAuthentication.header}
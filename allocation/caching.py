@@ -0,0 +1,82 @@
+import functools
+import hashlib
+import json
+
+from django.core.cache import caches
+from django.http import HttpResponse, HttpResponseNotModified, JsonResponse
+from django.utils import timezone
+from rest_framework import status
+from rest_framework.response import Response
+
+from . import replica
+
+def _digest(view, params, kwargs):
+    params = sorted((key, sorted(values)) for key, values in params.lists())
+    fingerprint = json.dumps([
+        view.__module__, view.__qualname__, params, kwargs,
+        timezone.localdate().isoformat(), replica.source_version()
+    ], default=str)
+    return hashlib.sha1(fingerprint.encode()).hexdigest()
+
+def _matches(request, etag):
+    return etag in [tag.strip() for tag in request.headers.get('If-None-Match', '').split(',')]
+
+def versioned_response(alias='analytics'):
+    # Caches successful responses under a key built from the view, its query
+    # parameters, the current day and the inventory version (or the replica's
+    # sync, for reads routed there). TTL and LRU
+    # eviction come from the cache alias (TIMEOUT / MAX_ENTRIES). The key
+    # doubles as an ETag, so a client whose If-None-Match still matches gets
+    # a 304 without the view or the cache being touched.
+    def decorator(view):
+        @functools.wraps(view)
+        def wrapper(request, *args, **kwargs):
+            digest = _digest(view, request.query_params, kwargs)
+            etag = f'"{digest[:20]}"'
+
+            if _matches(request, etag):
+                response = Response(status=status.HTTP_304_NOT_MODIFIED)
+            else:
+                cache = caches[alias]
+                cache_key = f'response:{digest}'
+                data = cache.get(cache_key)
+                if data is None:
+                    response = view(request, *args, **kwargs)
+                    if response.status_code != status.HTTP_200_OK or not isinstance(response, Response):
+                        return response
+                    cache.set(cache_key, response.data)
+                else:
+                    response = Response(data)
+            response['ETag'] = etag
+            response['Cache-Control'] = 'private, no-cache'
+            return response
+        return wrapper
+    return decorator
+
+def aversioned_response(alias='analytics'):
+    # versioned_response for async views returning JsonResponse; the rendered
+    # body is cached instead of response.data.
+    def decorator(view):
+        @functools.wraps(view)
+        async def wrapper(request, *args, **kwargs):
+            digest = _digest(view, request.GET, kwargs)
+            etag = f'"{digest[:20]}"'
+
+            if _matches(request, etag):
+                response = HttpResponseNotModified()
+            else:
+                cache = caches[alias]
+                cache_key = f'response:{digest}'
+                content = await cache.aget(cache_key)
+                if content is None:
+                    response = await view(request, *args, **kwargs)
+                    if response.status_code != status.HTTP_200_OK or not isinstance(response, JsonResponse):
+                        return response
+                    await cache.aset(cache_key, response.content)
+                else:
+                    response = HttpResponse(content, content_type='application/json')
+            response['ETag'] = etag
+            response['Cache-Control'] = 'private, no-cache'
+            return response
+        return wrapper
+    return decorator
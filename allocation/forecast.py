@@ -0,0 +1,150 @@
+from datetime import datetime, time as dt_time, timedelta
+from itertools import chain
+
+import numpy as np
+from django.conf import settings
+from django.core.cache import cache, caches
+from django.db import DEFAULT_DB_ALIAS, connections
+from django.db.models import DateField, F, Func, IntegerField, Value
+from django.utils import timezone
+
+from . import sharding
+from .models import CenterDailyRollup, DistributionCenter
+
+# Stock-depletion forecast. Each center's daily demand is an EWMA of the
+# total_quantity of its last FORECAST_WINDOW_DAYS complete days of rollups;
+# days to stock-out is its current stock over that rate. The rates only
+# change when a day closes (the rollup tick), so they are computed once per
+# day for every center from one rollup query, as a (centers x days) matrix
+# times the EWMA weights, and cached until the next local midnight.
+
+GENERATION_KEY = 'allocation:forecast-generation'
+MAX_DAYS = 365 * 1000
+
+class DayOffset(Func):
+    # Whole days from the second date to the first, computed by the database
+    # so every column of the rollup fetch is an integer
+    output_field = IntegerField()
+    template = '(%(expressions)s)'
+    arg_joiner = ' - '
+
+    def as_sqlite(self, compiler, connection, **extra):
+        return super().as_sql(
+            compiler, connection, template='CAST(julianday(%(expressions)s) AS INTEGER)',
+            arg_joiner=') - julianday(', **extra
+        )
+
+def ewma_weights(days, alpha):
+    # Oldest day first; normalised so a constant series is its own rate
+    weights = alpha * (1 - alpha) ** np.arange(days - 1, -1, -1, dtype=float)
+    return weights / weights.sum()
+
+def ewma_rates(quantities, alpha):
+    # quantities: (centers x days) array, oldest day first
+    if quantities.shape[1] == 0:
+        return np.zeros(quantities.shape[0])
+    return quantities @ ewma_weights(quantities.shape[1], alpha)
+
+def days_to_stockout(stock, rates):
+    # inf where nothing is being consumed; 0 for centers already empty
+    stock = np.asarray(stock, dtype=float)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        days = np.where(rates > 0, stock / rates, np.inf)
+    return np.where(stock <= 0, 0.0, days)
+
+def _seconds_to_tick(now):
+    local = timezone.localtime(now)
+    midnight = timezone.make_aware(datetime.combine(local.date() + timedelta(days=1), dt_time.min))
+    return max(1, int((midnight - now).total_seconds()))
+
+def invalidate():
+    # After rollups are rebuilt: the closed days may have changed
+    try:
+        cache.incr(GENERATION_KEY)
+    except ValueError:
+        cache.set(GENERATION_KEY, 1, timeout=None)
+
+def daily_rates(now=None):
+    # (center pks sorted, EWMA units/day per center)
+    now = now or timezone.now()
+    today = timezone.localdate(now)
+    generation = cache.get_or_set(GENERATION_KEY, 0, timeout=None)
+    key = f'forecast:rates:{today.isoformat()}:{generation}'
+    store = caches['analytics']
+    cached = store.get(key)
+    if cached is not None:
+        return cached
+
+    window = settings.FORECAST_WINDOW_DAYS
+    start = today - timedelta(days=window)
+    # Closed days only, from the primary: a replica synced before midnight
+    # would otherwise pin yesterday's partial totals for a whole day. The
+    # rows (up to centers x window of them) are read with a raw cursor and
+    # go straight into one integer array, skipping the ORM's per-row
+    # conversion and a date object per row.
+    query = CenterDailyRollup.objects.filter(day__gte=start, day__lt=today).values_list(
+        'center_id', 'total_quantity', DayOffset('day', Value(start, output_field=DateField()))
+    ).query
+    sql, params = query.sql_with_params()
+    with connections[DEFAULT_DB_ALIAS].cursor() as cursor:
+        cursor.execute(sql, params)
+        rows = np.fromiter(chain.from_iterable(cursor.fetchall()), dtype=np.int64).reshape(-1, 3)
+    pks = np.array(
+        DistributionCenter.objects.using(DEFAULT_DB_ALIAS).order_by('pk').values_list('pk', flat=True),
+        dtype=np.int64,
+    )
+    quantities = np.zeros((len(pks), window))
+    if len(rows) and len(pks):
+        centers, quantity, columns = rows.T
+        positions = np.minimum(np.searchsorted(pks, centers), len(pks) - 1)
+        known = pks[positions] == centers
+        # A sharded center has one row per slot and day (see rollups)
+        np.add.at(quantities, (positions[known], columns[known]), quantity[known])
+    result = (pks, ewma_rates(quantities, settings.FORECAST_EWMA_ALPHA))
+    store.set(key, result, timeout=_seconds_to_tick(now))
+    return result
+
+def forecast(within_days=None, now=None):
+    # One row per center, soonest stock-out first (centers with no demand
+    # last). Stock is read live; only the rates come from the daily cache.
+    now = now or timezone.now()
+    pks, rates = daily_rates(now)
+    centers = list(
+        DistributionCenter.objects.annotate(available=F('stock') + sharding.slot_stock())
+        .values_list('pk', 'center_id', 'available', 'initial_stock')
+    )
+    if not centers:
+        return []
+    center_pks, center_ids, available, initial = zip(*centers)
+    center_pks = np.array(center_pks, dtype=np.int64)
+
+    # Centers created since the rates were cached have no history yet
+    center_rates = np.zeros(len(center_pks))
+    if len(pks):
+        positions = np.minimum(np.searchsorted(pks, center_pks), len(pks) - 1)
+        known = pks[positions] == center_pks
+        center_rates[known] = rates[positions[known]]
+    days = days_to_stockout(available, center_rates)
+    replenish = days <= settings.FORECAST_LEAD_TIME_DAYS
+
+    order = np.lexsort((np.array(center_ids), days))
+    if within_days is not None:
+        order = order[days[order] <= within_days]
+
+    rows = []
+    for i, rate, remaining, flag in zip(
+        order.tolist(), center_rates[order].tolist(), days[order].tolist(), replenish[order].tolist()
+    ):
+        # Rates small enough to push the date past datetime's range count as
+        # no depletion
+        finite = remaining < MAX_DAYS
+        rows.append({
+            "center_id": center_ids[i],
+            "stock": available[i],
+            "initial_stock": initial[i],
+            "daily_rate": round(rate, 3),
+            "days_to_stockout": round(remaining, 3) if finite else None,
+            "stockout_at": now + timedelta(days=remaining) if finite else None,
+            "replenish": flag,
+        })
+    return rows
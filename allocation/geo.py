@@ -0,0 +1,47 @@
+import os
+
+import numpy as np
+from django.conf import settings
+
+# Zip-code centroid table: a float32 array of shape (ZIP_SPACE, 2) holding
+# (latitude, longitude) in degrees at row int(zip_code), NaN where the zip is
+# unknown. Built by the build_zip_centroids command and memory-mapped, so
+# every worker shares the same pages instead of holding its own copy.
+ZIP_SPACE = 100000
+EARTH_RADIUS_KM = 6371.0088
+
+_table = (None, None)
+
+def load_centroids():
+    # Reloaded when the file is replaced (build_zip_centroids swaps it in and
+    # invalidates the inventory snapshots, which call this on rebuild)
+    global _table
+    path = settings.ZIP_CENTROIDS_PATH
+    try:
+        key = (path, os.stat(path).st_mtime_ns) if path else None
+    except OSError:
+        key = None
+    loaded_key, table = _table
+    if key != loaded_key:
+        table = np.load(path, mmap_mode='r') if key else None
+        _table = (key, table)
+    return table
+
+def coordinates(zip_codes, table):
+    # Radians for each zip code; NaN for zips outside the table or without a
+    # centroid.
+    zips = np.asarray(zip_codes, dtype=np.int64)
+    known = (zips >= 0) & (zips < len(table))
+    points = np.full((len(zips), 2), np.nan)
+    points[known] = table[zips[known]]
+    return np.radians(points)
+
+def haversine_term(lat1, lon1, lat2, lon2):
+    # The haversine "a" term, which is monotonic in great-circle distance, so
+    # ranking can skip the arcsin. Broadcasts: an (m, 1) column of orders
+    # against (n,) centers yields the full (m, n) matrix in one pass.
+    return (np.sin((lat2 - lat1) / 2) ** 2
+            + np.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2) ** 2)
+
+def haversine_km(lat1, lon1, lat2, lon2):
+    return 2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(haversine_term(lat1, lon1, lat2, lon2)))
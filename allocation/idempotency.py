@@ -0,0 +1,81 @@
+import hashlib
+import json
+import threading
+import time
+
+from django.conf import settings
+from django.core.cache import caches
+from rest_framework import status
+from rest_framework.response import Response
+
+# Woken whenever a request in this process finishes with a key, so local
+# duplicates return immediately; duplicates in other processes poll the cache.
+_finished = threading.Condition()
+
+def _fingerprint(request):
+    return hashlib.sha1(json.dumps(request.data, sort_keys=True, default=str).encode()).hexdigest()
+
+def _replay(entry):
+    response = Response(entry['data'], status=entry['status'])
+    response['Idempotent-Replayed'] = 'true'
+    return response
+
+def _release():
+    with _finished:
+        _finished.notify_all()
+
+def run(request, key, handler):
+    # Runs handler once per (user, Idempotency-Key). Completed responses are
+    # kept in the 'idempotency' cache alias, whose TIMEOUT / MAX_ENTRIES bound
+    # the store, and replayed to retries without calling handler again. A
+    # duplicate that arrives while the first request is still running waits
+    # for its result instead of racing it. Server errors are not stored, so
+    # the key can be retried.
+    if len(key) > settings.IDEMPOTENCY_KEY_MAX_LENGTH:
+        return Response({"error": "Idempotency-Key is too long"}, status=status.HTTP_400_BAD_REQUEST)
+
+    cache = caches['idempotency']
+    cache_key = 'idempotency:' + hashlib.sha1(f'{request.user.pk}:{key}'.encode()).hexdigest()
+    fingerprint = _fingerprint(request)
+    deadline = time.monotonic() + settings.IDEMPOTENCY_WAIT_TIMEOUT
+
+    # The in-flight marker expires on its own, so a worker that dies
+    # mid-request cannot block the key forever
+    while not cache.add(cache_key, {"fingerprint": fingerprint, "in_flight": True}, settings.IDEMPOTENCY_LOCK_TIMEOUT):
+        entry = cache.get(cache_key)
+        if entry is None:
+            continue
+        if entry['fingerprint'] != fingerprint:
+            return Response(
+                {"error": "Idempotency-Key was already used with a different request body"},
+                status=status.HTTP_422_UNPROCESSABLE_ENTITY
+            )
+        if not entry['in_flight']:
+            return _replay(entry)
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            return Response(
+                {"error": "A request with this Idempotency-Key is still in progress"},
+                status=status.HTTP_409_CONFLICT
+            )
+        with _finished:
+            _finished.wait(min(remaining, settings.IDEMPOTENCY_POLL_INTERVAL))
+
+    try:
+        response = handler()
+    except BaseException:
+        cache.delete(cache_key)
+        _release()
+        raise
+
+    if response.status_code < 500:
+        cache.set(cache_key, {
+            "fingerprint": fingerprint,
+            "in_flight": False,
+            "status": response.status_code,
+            "data": response.data,
+        })
+    else:
+        cache.delete(cache_key)
+    _release()
+    return response
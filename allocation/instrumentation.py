@@ -0,0 +1,114 @@
+import contextlib
+import contextvars
+import json
+import logging
+import random
+import time
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connections
+from rest_framework.authentication import BasicAuthentication
+
+slow_request_logger = logging.getLogger('allocation.slow_requests')
+
+_recorder = contextvars.ContextVar('allocation_request_recorder', default=None)
+_noop = contextlib.nullcontext()
+
+class RequestRecorder:
+    def __init__(self):
+        self.stages = {}
+        self.queries = 0
+        self.sql_time = 0.0
+
+    @contextlib.contextmanager
+    def stage(self, name):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.stages[name] = self.stages.get(name, 0.0) + time.perf_counter() - started
+
+    def query_wrapper(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.queries += 1
+            self.sql_time += time.perf_counter() - started
+
+def stage(name):
+    # Times a block against the current request; a shared no-op when
+    # instrumentation is off or the code runs outside a request.
+    recorder = _recorder.get()
+    if recorder is None:
+        return _noop
+    return recorder.stage(name)
+
+class TimedBasicAuthentication(BasicAuthentication):
+    def authenticate(self, request):
+        with stage('auth'):
+            return super().authenticate(request)
+
+class ServerTimingMiddleware:
+    # Records query count, SQL time and per-stage wall time for each request
+    # and reports them in a Server-Timing header. Requests slower than
+    # SLOW_REQUEST_THRESHOLD_MS are sampled to the allocation.slow_requests
+    # logger. Removed from the stack entirely when REQUEST_TIMING_ENABLED is off.
+    # Async-capable so it does not force ASGI requests onto a thread; there
+    # the async ORM runs queries on other threads, so no db entry is reported.
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        if not settings.REQUEST_TIMING_ENABLED:
+            raise MiddlewareNotUsed()
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        recorder = RequestRecorder()
+        token = _recorder.set(recorder)
+        started = time.perf_counter()
+        try:
+            with contextlib.ExitStack() as stack:
+                for connection in connections.all():
+                    stack.enter_context(connection.execute_wrapper(recorder.query_wrapper))
+                response = self.get_response(request)
+        finally:
+            _recorder.reset(token)
+        return self.report(request, response, recorder, time.perf_counter() - started, db=True)
+
+    async def __acall__(self, request):
+        recorder = RequestRecorder()
+        token = _recorder.set(recorder)
+        started = time.perf_counter()
+        try:
+            response = await self.get_response(request)
+        finally:
+            _recorder.reset(token)
+        return self.report(request, response, recorder, time.perf_counter() - started, db=False)
+
+    def report(self, request, response, recorder, total, db):
+        metrics = [f'{name};dur={seconds * 1000:.2f}' for name, seconds in recorder.stages.items()]
+        if db:
+            metrics.append(f'db;dur={recorder.sql_time * 1000:.2f};desc="{recorder.queries} queries"')
+        metrics.append(f'total;dur={total * 1000:.2f}')
+        response['Server-Timing'] = ', '.join(metrics)
+
+        if (total * 1000 >= settings.SLOW_REQUEST_THRESHOLD_MS
+                and random.random() < settings.SLOW_REQUEST_SAMPLE_RATE):
+            slow_request_logger.warning(json.dumps({
+                "method": request.method,
+                "path": request.path,
+                "status": response.status_code,
+                "total_ms": round(total * 1000, 2),
+                "queries": recorder.queries if db else None,
+                "sql_ms": round(recorder.sql_time * 1000, 2) if db else None,
+                "stages_ms": {name: round(seconds * 1000, 2) for name, seconds in recorder.stages.items()},
+            }))
+        return response
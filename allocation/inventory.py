@@ -0,0 +1,226 @@
+import bisect
+import threading
+import time
+
+import numpy as np
+from django.conf import settings
+from django.core.cache import cache
+
+from . import assignment, geo, sharding
+from .models import DistributionCenter
+
+SNAPSHOT_VERSION_KEY = 'allocation:snapshot-version'
+# Added to the zip-line distance of pairs without coordinates, so they only
+# win when no geo-located center can serve the order
+UNLOCATED_PENALTY = 1e9
+INVENTORY_VERSION_KEY = 'allocation:inventory-version'
+
+class CenterSnapshot:
+    # Centers sorted by numeric zip code. Stock is held in a parallel list so
+    # the nearest eligible center is found by bisecting on the order's zip and
+    # walking outward, skipping centers that cannot cover the quantity.
+    # When a zip-centroid table is configured, centers are ranked by
+    # great-circle distance instead and the zip line is only the fallback
+    # for zips the table does not know.
+    def __init__(self, centers, version=None):
+        rows = sorted(
+            (int(c.zip_code), c.pk, c.center_id, getattr(c, 'total_stock', c.stock), getattr(c, 'slot_count', 0))
+            for c in centers
+        )
+        self.zips = [row[0] for row in rows]
+        self.pks = [row[1] for row in rows]
+        self.center_ids = [row[2] for row in rows]
+        self.stocks = [row[3] for row in rows]
+        self.slot_counts = [row[4] for row in rows]
+        self.positions = {pk: i for i, pk in enumerate(self.pks)}
+        self.version = version
+        self.loaded_at = time.monotonic()
+
+        # Center coordinates in radians, looked up once per snapshot
+        self.table = geo.load_centroids()
+        self.points = geo.coordinates(self.zips, self.table) if self.table is not None and self.zips else None
+        if self.points is not None:
+            self.pk_array = np.array(self.pks)
+            self.stock_array = np.array(self.stocks)
+            self.unlocated = bool(np.isnan(self.points[:, 0]).any())
+
+    def __len__(self):
+        return len(self.pks)
+
+    def nearest(self, zip_code, quantity):
+        terms = None
+        if self.points is not None:
+            point = geo.coordinates([zip_code], self.table)[0]
+            terms = geo.haversine_term(point[0], point[1], self.points[:, 0], self.points[:, 1])
+        return self._nearest(zip_code, quantity, terms)
+
+    def reserve_many(self, requests):
+        # Picks a center for each (zip_code, quantity) in turn and takes the
+        # stock from the snapshot, so later orders see earlier reservations.
+        # Distances are computed as one (orders x centers) matrix per block of
+        # orders, bounded by GEO_RANK_BLOCK_ELEMENTS.
+        picks = []
+        points = geo.coordinates([zip_code for zip_code, _ in requests], self.table) if self.points is not None else None
+        block = max(1, settings.GEO_RANK_BLOCK_ELEMENTS // max(1, len(self.pks)))
+        for start in range(0, len(requests), block):
+            chunk = requests[start:start + block]
+            terms = None
+            if points is not None:
+                rows = points[start:start + block]
+                terms = geo.haversine_term(rows[:, :1], rows[:, 1:], self.points[:, 0], self.points[:, 1])
+            for j, (zip_code, quantity) in enumerate(chunk):
+                pk = self._nearest(zip_code, quantity, None if terms is None else terms[j])
+                if pk is not None:
+                    self.set_stock(pk, self.stock(pk) - quantity)
+                picks.append(pk)
+        return picks
+
+    def costs(self, zip_codes):
+        # (orders x centers) distance matrix: kilometres where both ends have
+        # a centroid, zip-line distance (plus a penalty) otherwise
+        zips = np.asarray(zip_codes, dtype=float)
+        line = np.abs(zips[:, None] - np.asarray(self.zips, dtype=float))
+        if self.points is None:
+            return line
+        points = geo.coordinates(zip_codes, self.table)
+        km = geo.haversine_km(points[:, :1], points[:, 1:], self.points[:, 0], self.points[:, 1])
+        return np.where(np.isnan(km), UNLOCATED_PENALTY + line, km)
+
+    def reserve_jointly(self, requests):
+        # Like reserve_many, but the orders are placed together to minimise
+        # the total distance instead of first come, first served.
+        if not requests or not self.pks:
+            return [None] * len(requests)
+        columns = assignment.solve(
+            self.costs([zip_code for zip_code, _ in requests]),
+            [quantity for _, quantity in requests],
+            self.stocks,
+            candidates=settings.ALLOCATION_MICROBATCH_CANDIDATES,
+        )
+        picks = []
+        for (_, quantity), j in zip(requests, columns):
+            if j is None:
+                picks.append(None)
+                continue
+            pk = self.pks[j]
+            self.set_stock(pk, self.stocks[j] - quantity)
+            picks.append(pk)
+        return picks
+
+    def _nearest(self, zip_code, quantity, terms):
+        if terms is not None and not np.isnan(terms).all():
+            eligible = (self.stock_array >= quantity) & ~np.isnan(terms)
+            if eligible.any():
+                masked = np.where(eligible, terms, np.inf)
+                candidates = np.flatnonzero(masked == masked.min())
+                return int(self.pk_array[candidates[np.argmin(self.pk_array[candidates])]])
+            if not self.unlocated:
+                return None
+            # Only centers without a centroid are left to consider
+        return self._nearest_on_line(zip_code, quantity)
+
+    def _nearest_on_line(self, zip_code, quantity):
+        # Candidates are visited in non-decreasing distance; ties go to the
+        # lowest pk, matching the old min() over the unordered queryset.
+        zips, stocks = self.zips, self.stocks
+        right = bisect.bisect_left(zips, zip_code)
+        left = right - 1
+        best = None
+        while left >= 0 or right < len(zips):
+            if right >= len(zips) or (left >= 0 and zip_code - zips[left] <= zips[right] - zip_code):
+                i, distance = left, zip_code - zips[left]
+                left -= 1
+            else:
+                i, distance = right, zips[right] - zip_code
+                right += 1
+            if best is not None and distance > best[0]:
+                break
+            if stocks[i] >= quantity and (best is None or (distance, self.pks[i]) < best[:2]):
+                best = (distance, self.pks[i], i)
+        return best[1] if best else None
+
+    def center_id(self, pk):
+        return self.center_ids[self.positions[pk]]
+
+    def stock(self, pk):
+        return self.stocks[self.positions[pk]]
+
+    def set_stock(self, pk, stock):
+        i = self.positions.get(pk)
+        if i is not None:
+            self.stocks[i] = stock
+            if self.points is not None:
+                self.stock_array[i] = stock
+
+    def zip_code(self, pk):
+        return self.zips[self.positions[pk]]
+
+    def slot_count(self, pk):
+        return self.slot_counts[self.positions[pk]]
+
+_snapshot = None
+_rebuild_lock = threading.Lock()
+
+def _incr(key):
+    try:
+        return cache.incr(key)
+    except ValueError:
+        cache.set(key, 1, timeout=None)
+        return 1
+
+def current_version():
+    return cache.get_or_set(SNAPSHOT_VERSION_KEY, 0, timeout=None)
+
+def inventory_version():
+    # Moves on every stock change; versioned response caches key on it
+    return cache.get_or_set(INVENTORY_VERSION_KEY, 0, timeout=None)
+
+def bump_inventory_version():
+    return _incr(INVENTORY_VERSION_KEY)
+
+def invalidate():
+    # Drops the local snapshot and bumps the shared version so every worker
+    # sharing the cache backend rebuilds on its next allocation.
+    global _snapshot
+    _snapshot = None
+    _incr(SNAPSHOT_VERSION_KEY)
+    bump_inventory_version()
+
+def _is_stale(snapshot, version):
+    return (snapshot is None or snapshot.version != version
+            or time.monotonic() - snapshot.loaded_at > settings.INVENTORY_SNAPSHOT_TTL)
+
+def get_snapshot():
+    global _snapshot
+    version = current_version()
+    snapshot = _snapshot
+    if _is_stale(snapshot, version):
+        with _rebuild_lock:
+            snapshot = _snapshot
+            if _is_stale(snapshot, version):
+                centers = sharding.with_total_stock(
+                    DistributionCenter.objects.only('pk', 'center_id', 'zip_code', 'stock', 'slot_count')
+                )
+                snapshot = _snapshot = CenterSnapshot(centers, version)
+    return snapshot
+
+def record_stock(pk, stock):
+    # Applies a stock change this process made itself, without forcing a
+    # rebuild. Other workers only see it once they verify against the DB.
+    if _snapshot is not None:
+        _snapshot.set_stock(pk, stock)
+    bump_inventory_version()
+
+def center_changed(center, created=False):
+    snapshot = _snapshot
+    if (not created and snapshot is not None and center.pk in snapshot.positions
+            and snapshot.center_id(center.pk) == center.center_id
+            and snapshot.zip_code(center.pk) == int(center.zip_code)
+            and snapshot.slot_count(center.pk) == center.slot_count
+            and center.total_stock <= snapshot.stock(center.pk)):
+        # Plain decrement: stale-high stock elsewhere is caught when the
+        # allocation re-reads the row, so no global invalidation is needed.
+        snapshot.set_stock(center.pk, center.total_stock)
+        bump_inventory_version()
+    else:
+        invalidate()
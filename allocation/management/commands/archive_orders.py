@@ -0,0 +1,65 @@
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.utils import timezone
+
+from allocation import archive, inventory
+from allocation.models import Order
+
+FIELDS = ('pk', 'order_id', 'quantity', 'zip_code', 'center_id', 'created_at')
+
+class Command(BaseCommand):
+    help = 'Move pedidos alocados mais antigos que a retenção para segmentos mensais compactados'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int, default=settings.ORDER_RETENTION_DAYS,
+                            help='Pedidos mais antigos que isso (em dias) são arquivados')
+        parser.add_argument('--segment-rows', type=int, default=settings.ARCHIVE_SEGMENT_MAX_ROWS,
+                            help='Máximo de pedidos por segmento')
+        parser.add_argument('--batch-size', type=int, default=1000, help='Pedidos removidos por transação')
+        parser.add_argument('--dry-run', action='store_true', help='Só informa quantos pedidos seriam arquivados')
+
+    def handle(self, *args, **options):
+        if options['days'] < 0 or options['segment_rows'] < 1 or options['batch_size'] < 1:
+            raise CommandError('--days deve ser >= 0; --segment-rows e --batch-size devem ser positivos')
+        cutoff = timezone.now() - timedelta(days=options['days'])
+        old = Order.objects.filter(status='allocated', created_at__lt=cutoff)
+        if options['dry_run']:
+            self.stdout.write(f'{old.count()} pedidos seriam arquivados (anteriores a {cutoff:%Y-%m-%d}).')
+            return
+
+        archived = removed = segments = 0
+        while True:
+            # One month (or segment_rows orders of it) at a time: rows are
+            # deleted as they are archived, so each pass starts at the oldest
+            first = old.order_by('created_at').values_list('created_at', flat=True).first()
+            if first is None:
+                break
+            month = first.replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+            next_month = (month + timedelta(days=32)).replace(day=1)
+            rows = list(
+                old.filter(created_at__lt=next_month).order_by('created_at', 'pk')
+                .values_list(*FIELDS)[:options['segment_rows']]
+            )
+
+            # Orders left behind by an interrupted run are already listed in
+            # the manifest: they are only deleted
+            already = archive.existing([row[1] for row in rows])
+            fresh = [row[1:] for row in rows if row[1] not in already]
+            if fresh:
+                archive.write_segment(fresh)
+                segments += 1
+                archived += len(fresh)
+
+            pks = [row[0] for row in rows]
+            for i in range(0, len(pks), options['batch_size']):
+                with transaction.atomic():
+                    removed += Order.objects.filter(pk__in=pks[i:i + options['batch_size']]).delete()[0]
+
+        # Respostas de tendências em cache passam a ser recalculadas
+        inventory.bump_inventory_version()
+        self.stdout.write(self.style.SUCCESS(
+            f'{archived} pedidos arquivados em {segments} segmentos; {removed} removidos da tabela.'
+        ))
@@ -0,0 +1,291 @@
+import asyncio
+import json
+import multiprocessing
+import random
+import resource
+import sys
+import threading
+import time
+
+from asgiref.sync import sync_to_async
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, connections
+from django.test import AsyncClient
+from django.test.utils import setup_test_environment, teardown_test_environment
+from rest_framework.test import APIClient
+
+from allocation import inventory
+from allocation.models import ApiKey, DistributionCenter
+from allocation.views import allocate_order
+
+SCENARIOS = ('allocate_order', 'allocate_view', 'analytics_view', 'allocate_async', 'analytics_async')
+# Async-native endpoints, driven through the ASGI handler on one event loop
+# with --concurrency requests in flight; the *_view scenarios are their WSGI
+# counterparts under the same load
+ASYNC_PATHS = {'allocate_async': '/async/allocate/', 'analytics_async': '/async/analytics/'}
+BENCH_USER = 'bench'
+# Issued for each run and revoked when it ends
+_api_key = None
+
+def percentile(values, pct):
+    if not values:
+        return None
+    ordered = sorted(values)
+    index = max(0, min(len(ordered) - 1, int(round(pct / 100 * len(ordered))) - 1))
+    return ordered[index]
+
+class _QueryCounter:
+    def __init__(self):
+        self.count = 0
+
+    def __call__(self, execute, sql, params, many, context):
+        self.count += 1
+        return execute(sql, params, many, context)
+
+class _InFlight:
+    # Peak number of requests being served at once, and of live threads
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.current = 0
+        self.peak = 0
+        self.threads = 0
+
+    def __enter__(self):
+        with self.lock:
+            self.current += 1
+            self.peak = max(self.peak, self.current)
+            self.threads = max(self.threads, threading.active_count())
+
+    def __exit__(self, *exc):
+        with self.lock:
+            self.current -= 1
+
+_in_flight = _InFlight()
+
+def _make_client():
+    # Real credentials, so authentication cost is part of the measurement
+    client = APIClient()
+    client.credentials(HTTP_API_KEY=_api_key)
+    return client
+
+def _run_ops(scenario, ops):
+    # Runs (order_id, quantity, zip_code) ops on this thread/process and
+    # returns per-op latencies and query counts.
+    client = _make_client() if scenario != 'allocate_order' else None
+    counter = _QueryCounter()
+    latencies = []
+    queries = []
+    errors = 0
+    try:
+        with connection.execute_wrapper(counter):
+            for order_id, quantity, zip_code in ops:
+                counter.count = 0
+                started = time.perf_counter()
+                _in_flight.__enter__()
+                if scenario == 'allocate_order':
+                    ok = 'error' not in allocate_order({'order_id': order_id, 'quantity': quantity, 'zip_code': zip_code})
+                elif scenario == 'allocate_view':
+                    response = client.post('/allocate/', {
+                        'order_id': order_id, 'quantity': quantity, 'zip_code': zip_code
+                    }, format='json')
+                    ok = response.status_code == 200
+                else:
+                    response = client.get('/analytics/')
+                    ok = response.status_code == 200
+                _in_flight.__exit__()
+                latencies.append(time.perf_counter() - started)
+                queries.append(counter.count)
+                errors += not ok
+    finally:
+        connection.close()
+    return latencies, queries, errors, _in_flight.peak, _in_flight.threads
+
+def _run_ops_in_process(args):
+    return _run_ops(*args)
+
+async def _run_async_ops(scenario, ops, concurrency):
+    # Queries run on the async ORM's executor thread, out of reach of the
+    # per-connection counter, so none are reported for these scenarios
+    client = AsyncClient()
+    headers = {'Api-Key': _api_key}
+    pending = iter(ops)
+    latencies = []
+    errors = 0
+
+    async def worker():
+        nonlocal errors
+        for order_id, quantity, zip_code in pending:
+            started = time.perf_counter()
+            _in_flight.__enter__()
+            if scenario == 'allocate_async':
+                response = await client.post(ASYNC_PATHS[scenario], json.dumps({
+                    'order_id': order_id, 'quantity': quantity, 'zip_code': zip_code
+                }), content_type='application/json', headers=headers)
+            else:
+                response = await client.get(ASYNC_PATHS[scenario], headers=headers)
+            _in_flight.__exit__()
+            latencies.append(time.perf_counter() - started)
+            errors += response.status_code != 200
+
+    try:
+        await asyncio.gather(*(worker() for _ in range(concurrency)))
+    finally:
+        await sync_to_async(connections.close_all)()
+    return latencies, [], errors, _in_flight.peak, _in_flight.threads
+
+class Command(BaseCommand):
+    help = 'Mede throughput e latência da alocação e do analytics em uma topologia sintética reproduzível'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--centers', type=int, default=50, help='Número de centros de distribuição')
+        parser.add_argument('--stock-min', type=int, default=500, help='Estoque mínimo por centro')
+        parser.add_argument('--stock-max', type=int, default=5000, help='Estoque máximo por centro')
+        parser.add_argument('--zip-spread', type=int, default=90000, help='Faixa de zip codes a partir de 10000')
+        parser.add_argument('--max-quantity', type=int, default=5, help='Quantidade máxima por pedido')
+        parser.add_argument('--requests', type=int, default=500, help='Requisições por cenário')
+        parser.add_argument('--concurrency', type=int, default=4, help='Workers simultâneos')
+        parser.add_argument('--mode', choices=['threads', 'processes'], default='threads')
+        parser.add_argument('--scenarios', default=','.join(SCENARIOS),
+                            help=f'Cenários separados por vírgula ({", ".join(SCENARIOS)})')
+        parser.add_argument('--seed', type=int, default=42, help='Semente para a topologia e os pedidos')
+        parser.add_argument('--baseline', help='Arquivo JSON de baseline para comparação')
+        parser.add_argument('--save-baseline', help='Salva o resultado como baseline neste arquivo')
+        parser.add_argument('--tolerance', type=float, default=0.10,
+                            help='Variação relativa tolerada antes de acusar regressão')
+        parser.add_argument('--fail-on-regression', action='store_true', help='Retorna erro se houver regressão')
+        parser.add_argument('--current-db', action='store_true',
+                            help='Usa o banco atual em vez de um banco de teste descartável (exige --allow-wipe)')
+        parser.add_argument('--allow-wipe', action='store_true',
+                            help='Confirma que, com --current-db, todos os centros do banco atual serão apagados')
+
+    def handle(self, *args, **options):
+        scenarios = [s.strip() for s in options['scenarios'].split(',') if s.strip()]
+        unknown = set(scenarios) - set(SCENARIOS)
+        if unknown:
+            raise CommandError(f'Cenários desconhecidos: {", ".join(sorted(unknown))}')
+        if options['current_db'] and not options['allow_wipe']:
+            # seed() replaces every center, which cascades to rollups and
+            # stock slots and detaches existing orders
+            raise CommandError('--current-db apaga todos os centros do banco atual; confirme com --allow-wipe')
+
+        old_name = None
+        if not options['current_db']:
+            setup_test_environment()
+            old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+        try:
+            report = self.run_benchmark(scenarios, options)
+        finally:
+            if old_name is not None:
+                connection.creation.destroy_test_db(old_name, verbosity=0)
+                teardown_test_environment()
+
+        if options['baseline']:
+            with open(options['baseline']) as f:
+                report['regressions'] = compare(json.load(f), report, options['tolerance'])
+        if options['save_baseline']:
+            with open(options['save_baseline'], 'w') as f:
+                json.dump(report, f, indent=2)
+
+        self.stdout.write(json.dumps(report, indent=2))
+        if options['fail_on_regression'] and report.get('regressions'):
+            raise CommandError(f'{len(report["regressions"])} regressão(ões) em relação ao baseline')
+
+    def seed(self, rng, options):
+        DistributionCenter.objects.all().delete()
+        centers = []
+        for i in range(options['centers']):
+            stock = rng.randint(options['stock_min'], options['stock_max'])
+            zip_code = str(10000 + rng.randrange(options['zip_spread']))
+            centers.append(DistributionCenter(center_id=f'B{i:06d}', stock=stock, initial_stock=stock, zip_code=zip_code))
+        DistributionCenter.objects.bulk_create(centers, batch_size=1000)
+        inventory.invalidate()
+
+    def run_benchmark(self, scenarios, options):
+        global _api_key
+        rng = random.Random(options['seed'])
+        self.seed(rng, options)
+        user, _ = User.objects.get_or_create(username=BENCH_USER)
+        api_key, _api_key = ApiKey.issue(user, 'bench')
+        try:
+            return self.run_scenarios(scenarios, rng, options)
+        finally:
+            api_key.revoke()
+            _api_key = None
+
+    def run_scenarios(self, scenarios, rng, options):
+        report = {
+            "config": {key: options[key] for key in (
+                'centers', 'stock_min', 'stock_max', 'zip_spread', 'max_quantity',
+                'requests', 'concurrency', 'mode', 'seed')},
+            "scenarios": {},
+        }
+        for scenario in scenarios:
+            ops = [
+                (f'{scenario}-{i}', rng.randint(1, options['max_quantity']),
+                 str(10000 + rng.randrange(options['zip_spread'])))
+                for i in range(options['requests'])
+            ]
+            report["scenarios"][scenario] = self.run_scenario(scenario, ops, options)
+        report["peak_rss_kb"] = peak_rss_kb()
+        return report
+
+    def run_scenario(self, scenario, ops, options):
+        global _in_flight
+        _in_flight = _InFlight()
+        concurrency = max(1, options['concurrency'])
+        chunks = [ops[i::concurrency] for i in range(concurrency)]
+        started = time.perf_counter()
+        if scenario in ASYNC_PATHS:
+            results = [asyncio.run(_run_async_ops(scenario, ops, concurrency))]
+        elif options['mode'] == 'processes':
+            connections.close_all()
+            with multiprocessing.get_context('fork').Pool(concurrency) as pool:
+                results = pool.map(_run_ops_in_process, [(scenario, chunk) for chunk in chunks])
+        else:
+            results = [None] * concurrency
+
+            def worker(n):
+                results[n] = _run_ops(scenario, chunks[n])
+
+            threads = [threading.Thread(target=worker, args=(n,)) for n in range(concurrency)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+        elapsed = time.perf_counter() - started
+
+        latencies = [value for result in results for value in result[0]]
+        queries = [value for result in results for value in result[1]]
+        errors = sum(result[2] for result in results)
+        return {
+            "requests": len(latencies),
+            "errors": errors,
+            "throughput_rps": round(len(latencies) / elapsed, 2) if elapsed else None,
+            "p50_ms": round(percentile(latencies, 50) * 1000, 3),
+            "p95_ms": round(percentile(latencies, 95) * 1000, 3),
+            "p99_ms": round(percentile(latencies, 99) * 1000, 3),
+            "queries_per_request": round(sum(queries) / len(queries), 2) if queries else None,
+            "peak_in_flight": max(result[3] for result in results),
+            "peak_threads": max(result[4] for result in results),
+        }
+
+def peak_rss_kb():
+    # ru_maxrss is KiB on Linux and bytes on macOS
+    scale = 1024 if sys.platform == 'darwin' else 1
+    own = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss // scale
+    children = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss // scale
+    return max(own, children)
+
+def compare(baseline, report, tolerance):
+    regressions = []
+    for scenario, current in report["scenarios"].items():
+        previous = baseline.get("scenarios", {}).get(scenario)
+        if not previous:
+            continue
+        if previous.get("throughput_rps") and current["throughput_rps"] < previous["throughput_rps"] * (1 - tolerance):
+            regressions.append(f'{scenario}: throughput {current["throughput_rps"]} < baseline {previous["throughput_rps"]}')
+        for key in ('p95_ms', 'p99_ms', 'queries_per_request'):
+            if previous.get(key) and current.get(key) is not None and current[key] > previous[key] * (1 + tolerance):
+                regressions.append(f'{scenario}: {key} {current[key]} > baseline {previous[key]}')
+    return regressions
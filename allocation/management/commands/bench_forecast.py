@@ -0,0 +1,95 @@
+import json
+import random
+import statistics
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.cache import caches
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test.utils import setup_test_environment, teardown_test_environment
+from django.utils import timezone
+
+from allocation import forecast
+from allocation.models import CenterDailyRollup, DistributionCenter
+
+# Time of /analytics/forecast/'s work with and without the daily rate cache:
+# the first request of a day reads FORECAST_WINDOW_DAYS rollup rows per
+# center, later ones only read the live stock. Seeds --centers centers with a
+# full window of rollups in a disposable test database, or measures the
+# current database's data as it is with --current-db.
+
+class Command(BaseCommand):
+    help = 'Mede o tempo do forecast de estoque com e sem o cache diário das taxas'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--centers', type=int, default=20000, help='Centros gerados, cada um com a janela completa de agregados')
+        parser.add_argument('--runs', type=int, default=5, help='Medições por cenário')
+        parser.add_argument('--seed', type=int, default=42, help='Semente das quantidades geradas')
+        parser.add_argument('--current-db', action='store_true',
+                            help='Mede os dados do banco atual em vez de gerar um banco de teste descartável')
+
+    def handle(self, *args, **options):
+        if options['runs'] < 1 or options['centers'] < 1:
+            raise CommandError('--runs e --centers devem ser positivos')
+
+        old_name = None
+        if not options['current_db']:
+            setup_test_environment()
+            old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+        try:
+            if old_name is not None:
+                self.seed(options['centers'], random.Random(options['seed']))
+            report = {
+                "config": {
+                    "centers": DistributionCenter.objects.count(),
+                    "rollup_rows": CenterDailyRollup.objects.count(),
+                    "window_days": settings.FORECAST_WINDOW_DAYS,
+                    "runs": options['runs'],
+                },
+                "uncached": self.measure(options['runs'], cached=False),
+                "cached": self.measure(options['runs'], cached=True),
+            }
+        finally:
+            if old_name is not None:
+                connection.creation.destroy_test_db(old_name, verbosity=0)
+                teardown_test_environment()
+        self.stdout.write(json.dumps(report, indent=2))
+
+    def seed(self, count, rng):
+        centers = DistributionCenter.objects.bulk_create(
+            (DistributionCenter(center_id=f'F{i:06d}', stock=1000, initial_stock=1000, zip_code='10000')
+             for i in range(count)),
+            batch_size=5000,
+        )
+        today = timezone.localdate()
+        CenterDailyRollup.objects.bulk_create(
+            (CenterDailyRollup(center=center, day=today - timedelta(days=age), order_count=1,
+                               total_quantity=rng.randint(0, 20))
+             for center in centers for age in range(1, settings.FORECAST_WINDOW_DAYS + 1)),
+            batch_size=5000,
+        )
+
+    def measure(self, runs, cached):
+        queries = 0
+
+        def count(execute, sql, params, many, context):
+            nonlocal queries
+            queries += 1
+            return execute(sql, params, many, context)
+
+        samples = []
+        forecast.forecast()
+        with connection.execute_wrapper(count):
+            for _ in range(runs):
+                if not cached:
+                    caches['analytics'].clear()
+                started = time.perf_counter()
+                forecast.forecast()
+                samples.append(time.perf_counter() - started)
+        return {
+            "median_s": round(statistics.median(samples), 3),
+            "min_s": round(min(samples), 3),
+            "queries": queries // runs,
+        }
@@ -0,0 +1,77 @@
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+# Runs in a fresh interpreter per sample: the time and peak RSS of what a
+# worker does before serving its first request (django.setup() and loading
+# the URLconf, which imports every view). The PRELOAD modules are imported
+# first; 'boto3' reproduces the old eager import in views.py.
+PROBE = '''
+import json, os, resource, sys, time
+started = time.perf_counter()
+for name in sys.argv[1:]:
+    __import__(name)
+preloaded = time.perf_counter()
+import django
+django.setup()
+from django.urls import get_resolver
+get_resolver().url_patterns
+done = time.perf_counter()
+print(json.dumps({
+    "preload_ms": (preloaded - started) * 1000,
+    "import_ms": (done - started) * 1000,
+    "rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+    "boto3": "boto3" in sys.modules,
+}))
+'''
+
+class Command(BaseCommand):
+    help = 'Mede o tempo de importação e a memória (RSS) de um worker recém-iniciado'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--runs', type=int, default=5, help='Interpretadores iniciados por cenário')
+        parser.add_argument('--preload', action='append', default=[],
+                            help='Módulo importado antes do Django (repetível), p.ex. boto3 para comparar com o import antigo')
+        parser.add_argument('--json', action='store_true', help='Saída em JSON')
+
+    def handle(self, *args, **options):
+        if options['runs'] < 1:
+            raise CommandError('--runs deve ser positivo')
+        scenarios = {'atual': []}
+        if options['preload']:
+            scenarios[' + '.join(options['preload'])] = options['preload']
+
+        env = dict(os.environ, DJANGO_SETTINGS_MODULE=os.environ.get('DJANGO_SETTINGS_MODULE', 'order_allocation.settings'))
+        report = {}
+        for label, preload in scenarios.items():
+            samples = []
+            for _ in range(options['runs']):
+                result = subprocess.run(
+                    [sys.executable, '-c', PROBE, *preload],
+                    cwd=settings.BASE_DIR, env=env, capture_output=True, text=True,
+                )
+                if result.returncode != 0:
+                    raise CommandError(f'Falha ao iniciar o interpretador ({label}):\n{result.stderr.strip()}')
+                samples.append(json.loads(result.stdout.strip().splitlines()[-1]))
+            report[label] = {
+                "runs": len(samples),
+                "import_ms_median": statistics.median(s['import_ms'] for s in samples),
+                "import_ms_min": min(s['import_ms'] for s in samples),
+                "preload_ms_median": statistics.median(s['preload_ms'] for s in samples),
+                "rss_mb_median": statistics.median(s['rss_mb'] for s in samples),
+                "boto3_loaded": any(s['boto3'] for s in samples),
+            }
+
+        if options['json']:
+            self.stdout.write(json.dumps(report, indent=2))
+            return
+        for label, row in report.items():
+            self.stdout.write(
+                f'{label:>12}: importação {row["import_ms_median"]:.0f} ms (mín. {row["import_ms_min"]:.0f} ms), '
+                f'RSS {row["rss_mb_median"]:.1f} MB, boto3 carregado: {"sim" if row["boto3_loaded"] else "não"}'
+            )
@@ -0,0 +1,74 @@
+import json
+import random
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test.utils import setup_test_environment, teardown_test_environment
+
+from allocation.serializers import OrderPayload, OrderSerializer
+
+# Per-request cost of validating an /allocate/ payload: the OrderSerializer
+# that used to run (field construction, model introspection and its
+# order_id existence query) against OrderPayload. Duplicates are left to the
+# unique constraint with OrderPayload, so it makes no query at all.
+VALIDATORS = {'serializer': lambda data: OrderSerializer(data=data), 'payload': OrderPayload}
+
+def payloads(rng, count, invalid_ratio):
+    for i in range(count):
+        data = {'order_id': f'V{i:08d}', 'quantity': rng.randint(1, 10), 'zip_code': str(rng.randint(10000, 99999))}
+        if rng.random() < invalid_ratio:
+            data[rng.choice(('quantity', 'zip_code'))] = rng.choice((0, '', 'abc', None))
+        yield data
+
+class Command(BaseCommand):
+    help = 'Compara o custo por requisição da validação do /allocate/ (OrderSerializer x OrderPayload)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=5000, help='Payloads validados por validador')
+        parser.add_argument('--invalid-ratio', type=float, default=0.1, help='Fração de payloads inválidos')
+        parser.add_argument('--seed', type=int, default=42, help='Semente dos payloads')
+        parser.add_argument('--current-db', action='store_true',
+                            help='Usa o banco atual em vez de um banco de teste descartável')
+
+    def handle(self, *args, **options):
+        if options['requests'] < 1 or not 0 <= options['invalid_ratio'] <= 1:
+            raise CommandError('--requests deve ser positivo e --invalid-ratio estar entre 0 e 1')
+
+        old_name = None
+        if not options['current_db']:
+            setup_test_environment()
+            old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+        try:
+            report = {"config": {key: options[key] for key in ('requests', 'invalid_ratio', 'seed')}, "validators": {}}
+            for name, validator in VALIDATORS.items():
+                data = list(payloads(random.Random(options['seed']), options['requests'], options['invalid_ratio']))
+                report["validators"][name] = self.measure(validator, data)
+        finally:
+            if old_name is not None:
+                connection.creation.destroy_test_db(old_name, verbosity=0)
+                teardown_test_environment()
+
+        serializer, payload = report["validators"]["serializer"], report["validators"]["payload"]
+        report["speedup"] = round(serializer["us_per_request"] / payload["us_per_request"], 2)
+        self.stdout.write(json.dumps(report, indent=2))
+
+    def measure(self, validator, data):
+        valid = 0
+        queries = 0
+
+        def count(execute, sql, params, many, context):
+            nonlocal queries
+            queries += 1
+            return execute(sql, params, many, context)
+
+        with connection.execute_wrapper(count):
+            started = time.perf_counter()
+            for item in data:
+                valid += validator(item).is_valid()
+            elapsed = time.perf_counter() - started
+        return {
+            "valid": valid,
+            "us_per_request": round(elapsed / len(data) * 1e6, 2),
+            "queries_per_request": round(queries / len(data), 2),
+        }
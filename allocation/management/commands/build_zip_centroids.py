@@ -0,0 +1,69 @@
+import csv
+import os
+import tempfile
+
+import numpy as np
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from allocation import geo, inventory
+
+ZIP_COLUMNS = ('zip', 'zip_code', 'zcta', 'zcta5', 'geoid')
+LAT_COLUMNS = ('lat', 'latitude', 'intptlat')
+LON_COLUMNS = ('lon', 'lng', 'longitude', 'intptlong')
+
+def find_column(fieldnames, candidates):
+    for name in fieldnames:
+        if name.strip().lower() in candidates:
+            return name
+    raise CommandError(f'Coluna não encontrada (esperado um de: {", ".join(candidates)})')
+
+class Command(BaseCommand):
+    help = 'Gera a tabela de centroides (lat/lon) por zip code usada no ranking geográfico dos centros'
+
+    def add_arguments(self, parser):
+        parser.add_argument('source', help='CSV/TSV com zip e lat/lon (ex.: Census ZCTA Gazetteer)')
+        parser.add_argument('--output', help='Arquivo .npy de saída (padrão: ZIP_CENTROIDS_PATH)')
+
+    def handle(self, *args, **options):
+        output = options['output'] or settings.ZIP_CENTROIDS_PATH
+        table = np.full((geo.ZIP_SPACE, 2), np.nan, dtype=np.float32)
+        loaded = skipped = 0
+
+        try:
+            f = open(options['source'], encoding='utf-8-sig', newline='')
+        except OSError as e:
+            raise CommandError(str(e))
+        with f:
+            delimiter = '\t' if '\t' in f.readline() else ','
+            f.seek(0)
+            reader = csv.DictReader(f, delimiter=delimiter)
+            zip_col = find_column(reader.fieldnames, ZIP_COLUMNS)
+            lat_col = find_column(reader.fieldnames, LAT_COLUMNS)
+            lon_col = find_column(reader.fieldnames, LON_COLUMNS)
+            for row in reader:
+                try:
+                    zip_code = int(row[zip_col])
+                    lat, lon = float(row[lat_col]), float(row[lon_col])
+                except (TypeError, ValueError):
+                    skipped += 1
+                    continue
+                if not 0 <= zip_code < geo.ZIP_SPACE or not -90 <= lat <= 90 or not -180 <= lon <= 180:
+                    skipped += 1
+                    continue
+                table[zip_code] = (lat, lon)
+                loaded += 1
+
+        # Written under a temporary name and swapped in, so workers never
+        # memory-map a half-written file
+        directory = os.path.dirname(os.path.abspath(output))
+        os.makedirs(directory, exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=directory, suffix='.npy')
+        with os.fdopen(fd, 'wb') as out:
+            np.save(out, table)
+        os.replace(tmp, output)
+        inventory.invalidate()
+
+        self.stdout.write(self.style.SUCCESS(
+            f'{loaded:,} centroides gravados em {output} ({skipped:,} linhas ignoradas).'
+        ))
@@ -0,0 +1,39 @@
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.utils import timezone
+
+from allocation import authentication
+from allocation.models import ApiKey
+
+class Command(BaseCommand):
+    help = 'Emite uma chave de API para um usuário (com --rotate, revoga as anteriores)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('username', help='Usuário dono da chave')
+        parser.add_argument('--name', default='', help='Descrição da chave')
+        parser.add_argument('--rotate', action='store_true', help='Revoga as chaves ativas do usuário')
+        parser.add_argument('--create-user', action='store_true', help='Cria o usuário se não existir')
+
+    def handle(self, *args, **options):
+        User = get_user_model()
+        if options['create_user']:
+            user, _ = User.objects.get_or_create(username=options['username'])
+        else:
+            try:
+                user = User.objects.get(username=options['username'])
+            except User.DoesNotExist:
+                raise CommandError(f'Usuário não encontrado: {options["username"]}')
+
+        with transaction.atomic():
+            revoked = 0
+            if options['rotate']:
+                revoked = ApiKey.objects.filter(user=user, revoked_at__isnull=True).update(revoked_at=timezone.now())
+            _, raw_key = ApiKey.issue(user, options['name'])
+        # Again once the revocation is committed, so no worker re-caches an old key
+        authentication.invalidate()
+
+        if revoked:
+            self.stdout.write(f'{revoked} chave(s) anterior(es) revogada(s).')
+        self.stdout.write(self.style.SUCCESS('Chave criada; guarde-a, ela não será exibida novamente:'))
+        self.stdout.write(raw_key)
@@ -1,5 +1,24 @@
-from django.core.management.base import BaseCommand
-from allocation.models import DistributionCenter
+import contextlib
+import itertools
+import random
+import time
+from datetime import datetime, timedelta
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.utils import timezone
+from allocation import inventory, rollups
+from allocation.models import DistributionCenter, Order
+
+@contextlib.contextmanager
+def explicit_created_at():
+    # bulk_create would otherwise stamp every generated order with now()
+    field = Order._meta.get_field('created_at')
+    field.auto_now_add = False
+    try:
+        yield
+    finally:
+        field.auto_now_add = True
 
 class Command(BaseCommand):
     help = 'Popula o banco com centros de distribuição, com opções para atualizar ou limpar'
@@ -7,8 +26,24 @@ class Command(BaseCommand):
     def add_arguments(self, parser):
         parser.add_argument('--reset', action='store_true', help='Limpa todos os centros antes de popular')
         parser.add_argument('--update', action='store_true', help='Atualiza centros existentes em vez de criar novos')
+        parser.add_argument('--generate', action='store_true',
+                            help='Gera centros e histórico de pedidos sintéticos em vez dos centros fixos')
+        parser.add_argument('--centers', type=int, default=1000, help='Centros gerados (com --generate)')
+        parser.add_argument('--orders', type=int, default=0, help='Pedidos históricos gerados (com --generate)')
+        parser.add_argument('--seed', type=int, default=42, help='Semente da geração')
+        parser.add_argument('--stock-min', type=int, default=100, help='Estoque inicial mínimo por centro')
+        parser.add_argument('--stock-max', type=int, default=10000, help='Estoque inicial máximo por centro')
+        parser.add_argument('--zip-spread', type=int, default=90000, help='Faixa de zip codes a partir de 10000')
+        parser.add_argument('--max-quantity', type=int, default=5, help='Quantidade máxima por pedido')
+        parser.add_argument('--start-date', help='Início do intervalo de created_at (ISO, padrão: 90 dias atrás)')
+        parser.add_argument('--end-date', help='Fim do intervalo de created_at (ISO, padrão: agora)')
+        parser.add_argument('--chunk-size', type=int, default=5000, help='Linhas por bulk_create')
+        parser.add_argument('--chunks-per-transaction', type=int, default=10, help='Lotes por transação')
 
     def handle(self, *args, **options):
+        if options['generate']:
+            return self.generate(options)
+
         centers = [
             {'center_id': 'C1', 'stock': 100, 'initial_stock': 100, 'zip_code': '10000'},
             {'center_id': 'C2', 'stock': 50, 'initial_stock': 50, 'zip_code': '10003'},
@@ -45,4 +80,102 @@ class Command(BaseCommand):
                 else:
                     self.stdout.write(self.style.SUCCESS(f'Centro {center["center_id"]} criado com sucesso.'))
 
-        self.stdout.write(self.style.SUCCESS('População concluída!'))
\ No newline at end of file
+        # Garante que nenhum worker continue alocando com um snapshot antigo
+        inventory.invalidate()
+        self.stdout.write(self.style.SUCCESS('População concluída!'))
+
+    def generate(self, options):
+        rng = random.Random(options['seed'])
+        end = self.parse_date(options['end_date'], timezone.now())
+        start = self.parse_date(options['start_date'], end - timedelta(days=90))
+        if start >= end:
+            raise CommandError('--start-date deve ser anterior a --end-date')
+
+        if options['reset']:
+            Order.objects.all().delete()
+            DistributionCenter.objects.all().delete()
+            self.stdout.write(self.style.WARNING('Todos os centros e pedidos foram deletados.'))
+
+        # Sem --reset, a numeração continua após os IDs já gerados
+        first_center = self.next_number(DistributionCenter, 'center_id', 'G', r'^G[0-9]{6}$')
+        first_order = self.next_number(Order, 'order_id', f'G{options["seed"]}-', rf'^G{options["seed"]}-[0-9]{{10}}$')
+        if first_center:
+            self.stdout.write(f'Centros gerados já existem; numeração continua em G{first_center:06d}.')
+
+        def centers():
+            for i in range(first_center, first_center + options['centers']):
+                stock = rng.randint(options['stock_min'], options['stock_max'])
+                yield DistributionCenter(
+                    center_id=f'G{i:06d}',
+                    stock=stock,
+                    initial_stock=stock,
+                    zip_code=str(10000 + rng.randrange(options['zip_spread']))
+                )
+
+        self.stream('centros', DistributionCenter, centers(), options['centers'], options)
+        center_pks = list(
+            DistributionCenter.objects.filter(center_id__startswith='G').order_by('pk').values_list('pk', flat=True)
+        )
+
+        if options['orders']:
+            if not center_pks:
+                raise CommandError('Nenhum centro disponível para os pedidos gerados')
+            span = (end - start).total_seconds()
+
+            def orders():
+                for i in range(first_order, first_order + options['orders']):
+                    yield Order(
+                        order_id=f'G{options["seed"]}-{i:010d}',
+                        quantity=rng.randint(1, options['max_quantity']),
+                        zip_code=str(10000 + rng.randrange(options['zip_spread'])),
+                        center_id=rng.choice(center_pks),
+                        status='allocated',
+                        created_at=start + timedelta(seconds=rng.random() * span)
+                    )
+
+            with explicit_created_at():
+                self.stream('pedidos', Order, orders(), options['orders'], options)
+            count = rollups.rebuild()
+            self.stdout.write(f'{count} agregados diários reconstruídos.')
+
+        inventory.invalidate()
+        self.stdout.write(self.style.SUCCESS('Geração concluída!'))
+
+    def stream(self, label, model, rows, total, options):
+        # Chunked bulk_create over a generator: memory stays bounded by
+        # chunk_size, with one transaction per chunks_per_transaction chunks.
+        chunk_size = options['chunk_size']
+        per_transaction = options['chunks_per_transaction']
+        done = 0
+        started = time.monotonic()
+        exhausted = False
+        while not exhausted:
+            with transaction.atomic():
+                for _ in range(per_transaction):
+                    chunk = list(itertools.islice(rows, chunk_size))
+                    if not chunk:
+                        exhausted = True
+                        break
+                    model.objects.bulk_create(chunk, batch_size=chunk_size)
+                    done += len(chunk)
+            exhausted = exhausted or done >= total
+            elapsed = time.monotonic() - started
+            rate = done / elapsed if elapsed else 0
+            self.stdout.write(f'{label}: {done:,}/{total:,} ({rate:,.0f}/s)')
+
+    def next_number(self, model, field, prefix, pattern):
+        # Número seguinte ao maior ID gerado (largura fixa, então a ordem
+        # lexicográfica é a numérica), ou 0 se ainda não há nenhum
+        last = model.objects.filter(**{f'{field}__regex': pattern}).order_by(f'-{field}').values_list(
+            field, flat=True
+        ).first()
+        return int(last[len(prefix):]) + 1 if last else 0
+
+    def parse_date(self, value, default):
+        if not value:
+            return default
+        try:
+            parsed = datetime.fromisoformat(value)
+        except ValueError:
+            raise CommandError(f'Data inválida: {value}')
+        return timezone.make_aware(parsed) if timezone.is_naive(parsed) else parsed
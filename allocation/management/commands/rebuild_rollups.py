@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+from allocation import inventory, rollups
+
+class Command(BaseCommand):
+    help = 'Reconstrói os agregados diários por centro a partir do histórico de pedidos'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000, help='Tamanho dos lotes de inserção')
+
+    def handle(self, *args, **options):
+        count = rollups.rebuild(batch_size=options['batch_size'])
+        # Respostas de analytics em cache passam a ser recalculadas
+        inventory.bump_inventory_version()
+        self.stdout.write(self.style.SUCCESS(f'{count} agregados reconstruídos.'))
@@ -0,0 +1,34 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from allocation import sharding
+from allocation.models import DistributionCenter
+
+class Command(BaseCommand):
+    help = 'Divide o estoque de centros concorridos em slots (ou junta de volta com --slots 0)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('center_ids', nargs='*', help='Centros a redistribuir')
+        parser.add_argument('--all', action='store_true', help='Aplica a todos os centros')
+        parser.add_argument('--slots', type=int, default=settings.INVENTORY_STOCK_SLOTS,
+                            help='Número de slots por centro (0 volta o estoque para a linha do centro)')
+
+    def handle(self, *args, **options):
+        slots = options['slots']
+        if not 0 <= slots <= 256:
+            raise CommandError('--slots deve estar entre 0 e 256')
+        if options['all']:
+            centers = DistributionCenter.objects.all()
+        elif options['center_ids']:
+            centers = DistributionCenter.objects.filter(center_id__in=options['center_ids'])
+            missing = set(options['center_ids']) - set(centers.values_list('center_id', flat=True))
+            if missing:
+                raise CommandError(f'Centros não encontrados: {", ".join(sorted(missing))}')
+        else:
+            raise CommandError('Informe os center_ids ou use --all')
+
+        count = 0
+        for pk in centers.values_list('pk', flat=True):
+            sharding.reshard(pk, slots)
+            count += 1
+        self.stdout.write(self.style.SUCCESS(f'{count} centros redistribuídos em {slots} slots.'))
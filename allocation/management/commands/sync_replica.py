@@ -0,0 +1,26 @@
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from allocation import replica
+
+class Command(BaseCommand):
+    help = 'Copia o banco SQLite principal para a réplica de leitura, uma vez ou periodicamente'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--interval', type=float, default=0,
+                            help=f'Repete a cópia a cada N segundos (ex.: {settings.REPLICA_SYNC_INTERVAL}); 0 copia uma vez')
+
+    def handle(self, *args, **options):
+        while True:
+            started = time.monotonic()
+            try:
+                replica.sync()
+            except ValueError as e:
+                raise CommandError(str(e))
+            elapsed = time.monotonic() - started
+            self.stdout.write(self.style.SUCCESS(f'Réplica sincronizada em {elapsed:.2f}s: {replica.replica_path()}'))
+            if options['interval'] <= 0:
+                return
+            time.sleep(max(options['interval'] - elapsed, 0))
@@ -0,0 +1,190 @@
+import atexit
+import bisect
+import glob
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
+
+from django.conf import settings
+
+from . import sharding, sinks
+from .models import DistributionCenter
+
+logger = logging.getLogger('allocation.metrics')
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+OUTCOMES = ('allocated', 'no_stock', 'validation_error', 'error')
+
+class _Shard:
+    # Written only by its owning thread, so recording takes no lock. Once
+    # that thread has exited, the next scrape folds its counts into
+    # _retired and drops it, so thread churn doesn't grow _shards.
+    __slots__ = ('buckets', 'sums', 'alerts', 'owner')
+
+    def __init__(self, owner=None):
+        self.buckets = {outcome: [0] * (len(LATENCY_BUCKETS) + 1) for outcome in OUTCOMES}
+        self.sums = dict.fromkeys(OUTCOMES, 0.0)
+        self.alerts = 0
+        self.owner = owner
+
+    def add(self, other):
+        for outcome in OUTCOMES:
+            self.buckets[outcome] = [a + b for a, b in zip(self.buckets[outcome], other.buckets[outcome])]
+            self.sums[outcome] += other.sums[outcome]
+        self.alerts += other.alerts
+
+_local = threading.local()
+_shards = []
+_retired = _Shard()
+_shards_lock = threading.Lock()
+_flusher = None
+
+def _shard():
+    shard = getattr(_local, 'shard', None)
+    if shard is None:
+        shard = _local.shard = _Shard(threading.current_thread())
+        with _shards_lock:
+            _shards.append(shard)
+        _start_flusher()
+    return shard
+
+def observe_allocation(outcome, seconds):
+    shard = _shard()
+    shard.buckets[outcome][bisect.bisect_left(LATENCY_BUCKETS, seconds)] += 1
+    shard.sums[outcome] += seconds
+
+def count_low_stock_alert():
+    _shard().alerts += 1
+
+def _prune():
+    # Called with _shards_lock held
+    alive = []
+    for shard in _shards:
+        if shard.owner.is_alive():
+            alive.append(shard)
+        else:
+            _retired.add(shard)
+    _shards[:] = alive
+
+def local_totals():
+    totals = {
+        "pid": os.getpid(),
+        "updated": time.time(),
+        "histogram": {outcome: {"buckets": [0] * (len(LATENCY_BUCKETS) + 1), "sum": 0.0} for outcome in OUTCOMES},
+        "alerts": 0,
+        "queues": {name: stats['queue_depth'] for name, stats in sinks.stats().items()},
+    }
+    with _shards_lock:
+        _prune()
+        for shard in (_retired, *_shards):
+            for outcome in OUTCOMES:
+                merged = totals["histogram"][outcome]
+                merged["buckets"] = [a + b for a, b in zip(merged["buckets"], shard.buckets[outcome])]
+                merged["sum"] += shard.sums[outcome]
+            totals["alerts"] += shard.alerts
+    return totals
+
+def flush():
+    # Publishes this process's totals to METRICS_DIR so any worker can serve
+    # the merged view; written atomically via rename.
+    directory = settings.METRICS_DIR
+    if not directory:
+        return
+    os.makedirs(directory, exist_ok=True)
+    fd, tmp = tempfile.mkstemp(dir=directory, suffix='.tmp')
+    with os.fdopen(fd, 'w') as f:
+        json.dump(local_totals(), f)
+    os.replace(tmp, os.path.join(directory, f'{os.getpid()}.json'))
+
+def _start_flusher():
+    global _flusher
+    if _flusher is not None or not settings.METRICS_DIR:
+        return
+    with _shards_lock:
+        if _flusher is not None:
+            return
+
+        def run():
+            # A failed write (full disk, METRICS_DIR gone) must not stop
+            # later flushes
+            while True:
+                time.sleep(settings.METRICS_FLUSH_INTERVAL)
+                try:
+                    flush()
+                except Exception:
+                    logger.exception('metrics flush to %s failed', settings.METRICS_DIR)
+
+        _flusher = threading.Thread(target=run, name='metrics-flush', daemon=True)
+        _flusher.start()
+
+def merged_totals():
+    if not settings.METRICS_DIR:
+        return [local_totals()]
+    flush()
+    totals = []
+    for path in glob.glob(os.path.join(settings.METRICS_DIR, '*.json')):
+        try:
+            with open(path) as f:
+                totals.append(json.load(f))
+        except (OSError, ValueError):
+            continue
+    return totals
+
+def render():
+    totals = merged_totals()
+    live_after = time.time() - 3 * settings.METRICS_FLUSH_INTERVAL
+    lines = [
+        '# HELP allocation_request_duration_seconds Latency of /allocate/ requests by outcome.',
+        '# TYPE allocation_request_duration_seconds histogram',
+    ]
+    for outcome in OUTCOMES:
+        buckets = [0] * (len(LATENCY_BUCKETS) + 1)
+        total_sum = 0.0
+        for process in totals:
+            histogram = process["histogram"][outcome]
+            buckets = [a + b for a, b in zip(buckets, histogram["buckets"])]
+            total_sum += histogram["sum"]
+        cumulative = 0
+        for bound, count in zip(LATENCY_BUCKETS + ('+Inf',), buckets):
+            cumulative += count
+            lines.append(f'allocation_request_duration_seconds_bucket{{outcome="{outcome}",le="{bound}"}} {cumulative}')
+        lines.append(f'allocation_request_duration_seconds_sum{{outcome="{outcome}"}} {total_sum}')
+        lines.append(f'allocation_request_duration_seconds_count{{outcome="{outcome}"}} {cumulative}')
+
+    lines += [
+        '# HELP allocation_low_stock_alerts_total Low-stock alerts emitted.',
+        '# TYPE allocation_low_stock_alerts_total counter',
+        f'allocation_low_stock_alerts_total {sum(process["alerts"] for process in totals)}',
+        '# HELP allocation_sink_queue_depth Records waiting in background log writers.',
+        '# TYPE allocation_sink_queue_depth gauge',
+    ]
+    depths = {}
+    for process in totals:
+        # Queue depth is a live value: skip processes that stopped reporting
+        if process["updated"] >= live_after:
+            for name, depth in process["queues"].items():
+                depths[name] = depths.get(name, 0) + depth
+    for name, depth in sorted(depths.items()):
+        lines.append(f'allocation_sink_queue_depth{{sink="{name}"}} {depth}')
+
+    lines += [
+        '# HELP allocation_center_stock Current stock per distribution center.',
+        '# TYPE allocation_center_stock gauge',
+    ]
+    low_stock = []
+    centers = sharding.with_total_stock(
+        DistributionCenter.objects.only('center_id', 'stock', 'initial_stock', 'slot_count').order_by('center_id')
+    )
+    for center in centers.iterator():
+        lines.append(f'allocation_center_stock{{center_id="{center.center_id}"}} {center.total_stock}')
+        low_stock.append(f'allocation_center_low_stock{{center_id="{center.center_id}"}} {int(center.is_low_stock())}')
+    lines += [
+        '# HELP allocation_center_low_stock 1 when the center is below its low-stock threshold.',
+        '# TYPE allocation_center_low_stock gauge',
+    ] + low_stock
+    return '\n'.join(lines) + '\n'
+
+atexit.register(flush)
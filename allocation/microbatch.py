@@ -0,0 +1,86 @@
+import threading
+
+from django.conf import settings
+
+class _Slot:
+    __slots__ = ('data', 'result', 'leader', 'wake')
+
+    def __init__(self, data):
+        self.data = data
+        self.result = None
+        self.leader = False
+        self.wake = threading.Event()
+
+class MicroBatcher:
+    # Collects concurrent requests into windows. The first request to arrive
+    # in an empty queue leads the window: it waits up to
+    # ALLOCATION_MICROBATCH_WINDOW_MS (or until ALLOCATION_MICROBATCH_MAX_SIZE
+    # requests are queued), hands the whole window to `handler` on its own
+    # thread and DB connection, and wakes every request with its result.
+    # Requests that did not fit hand leadership to the next in line, so the
+    # next window fills while the current one commits.
+    #
+    # `prepare` checks a request before it joins a window; a request it
+    # rejects (ValueError/TypeError) gets its own error result, so only a
+    # failure of the handler itself fails every request in a window.
+    def __init__(self, handler, prepare=None):
+        self.handler = handler
+        self.prepare = prepare
+        self.pending = []
+        self.ready = threading.Condition()
+
+    def submit(self, data):
+        if self.prepare is not None:
+            try:
+                data = self.prepare(data)
+            except (TypeError, ValueError) as e:
+                return {"error": f"Value error: {e}"}
+        slot = _Slot(data)
+        with self.ready:
+            self.pending.append(slot)
+            slot.leader = len(self.pending) == 1
+            if len(self.pending) >= settings.ALLOCATION_MICROBATCH_MAX_SIZE:
+                self.ready.notify_all()
+        if not slot.leader:
+            slot.wake.wait()
+        if slot.result is None:
+            self._lead()
+        return slot.result
+
+    def _lead(self):
+        size = settings.ALLOCATION_MICROBATCH_MAX_SIZE
+        with self.ready:
+            self.ready.wait_for(lambda: len(self.pending) >= size, settings.ALLOCATION_MICROBATCH_WINDOW_MS / 1000)
+            batch, self.pending = self.pending[:size], self.pending[size:]
+            if self.pending:
+                self.pending[0].leader = True
+                self.pending[0].wake.set()
+
+        try:
+            results = self.handler([slot.data for slot in batch])
+        except Exception as e:
+            results = [{"error": str(e)}] * len(batch)
+        for slot, result in zip(batch, results):
+            slot.result = result
+            slot.wake.set()
+
+def _prepare_order(order_data):
+    # The conversions the allocator makes, done per request
+    int(order_data['zip_code'])
+    int(order_data['quantity'])
+    return order_data
+
+def _allocate_window(orders_data):
+    from .views import allocate_orders
+    results = allocate_orders(orders_data, joint=True)
+    return [
+        {"error": result['error']} if result['status'] == 'rejected' else result
+        for result in results
+    ]
+
+_batcher = MicroBatcher(_allocate_window, _prepare_order)
+
+def allocate(order_data):
+    # Same result shape as views.allocate_order, but solved together with the
+    # other requests in the same window
+    return _batcher.submit(order_data)
@@ -0,0 +1,31 @@
+# Generated by Django 4.2.11 on 2026-10-17 19:42
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('allocation', '0002_distributioncenter_initial_stock'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CenterDailyRollup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('day', models.DateField()),
+                ('order_count', models.IntegerField(default=0)),
+                ('total_quantity', models.IntegerField(default=0)),
+                ('center', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='rollups', to='allocation.distributioncenter')),
+            ],
+            options={
+                'db_table': 'center_daily_rollups',
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='centerdailyrollup',
+            constraint=models.UniqueConstraint(fields=('center', 'day'), name='unique_center_day_rollup'),
+        ),
+    ]
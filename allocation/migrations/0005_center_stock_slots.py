@@ -0,0 +1,35 @@
+# Generated by Django 4.2.11 on 2026-10-17 20:07
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('allocation', '0004_order_trend_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='distributioncenter',
+            name='slot_count',
+            field=models.PositiveSmallIntegerField(default=0),
+        ),
+        migrations.CreateModel(
+            name='CenterStockSlot',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('slot', models.PositiveSmallIntegerField()),
+                ('stock', models.IntegerField()),
+                ('center', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='stock_slots', to='allocation.distributioncenter')),
+            ],
+            options={
+                'db_table': 'center_stock_slots',
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='centerstockslot',
+            constraint=models.UniqueConstraint(fields=('center', 'slot'), name='unique_center_stock_slot'),
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 4.2.11 on 2026-10-17 20:11
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('allocation', '0005_center_stock_slots'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='distributioncenter',
+            name='alert_level',
+            field=models.PositiveSmallIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='distributioncenter',
+            name='alert_sent_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+    ]
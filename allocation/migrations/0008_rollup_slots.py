@@ -0,0 +1,26 @@
+# Generated by Django 4.2.11 on 2026-10-17 21:22
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('allocation', '0007_api_keys'),
+    ]
+
+    operations = [
+        migrations.RemoveConstraint(
+            model_name='centerdailyrollup',
+            name='unique_center_day_rollup',
+        ),
+        migrations.AddField(
+            model_name='centerdailyrollup',
+            name='slot',
+            field=models.PositiveSmallIntegerField(default=0),
+        ),
+        migrations.AddConstraint(
+            model_name='centerdailyrollup',
+            constraint=models.UniqueConstraint(fields=('center', 'day', 'slot'), name='unique_center_day_slot_rollup'),
+        ),
+    ]
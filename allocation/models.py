@@ -1,10 +1,23 @@
+import hashlib
+import secrets
+
+from django.conf import settings
 from django.db import models
+from django.db.models import Sum
+from django.utils import timezone
 
 class DistributionCenter(models.Model):
     center_id = models.CharField(max_length=50, unique=True)
     stock = models.IntegerField()
     initial_stock = models.IntegerField(default=100)  
     zip_code = models.CharField(max_length=10)
+    # Number of CenterStockSlot rows holding this center's stock; 0 means the
+    # stock lives on this row (see allocation.sharding)
+    slot_count = models.PositiveSmallIntegerField(default=0)
+    # Low-stock alert state (see allocation.alerts): 0 = ok, otherwise the
+    # ALERT_LEVELS entry the center is in, and when it was last alerted
+    alert_level = models.PositiveSmallIntegerField(default=0)
+    alert_sent_at = models.DateTimeField(null=True, blank=True)
 
     class Meta:
         db_table = 'distribution_centers'
@@ -12,8 +25,17 @@ class DistributionCenter(models.Model):
     def __str__(self):
         return self.center_id
 
+    @property
+    def total_stock(self):
+        if not self.slot_count:
+            return self.stock
+        if not hasattr(self, 'slot_stock'):
+            # Annotated by sharding.with_total_stock() when loaded in bulk
+            self.slot_stock = self.stock_slots.aggregate(total=Sum('stock'))['total'] or 0
+        return self.stock + self.slot_stock
+
     def is_low_stock(self):
-        return self.stock < 0.2 * self.initial_stock  
+        return self.total_stock < 0.2 * self.initial_stock  
 
     def save(self, *args, **kwargs):
         if self.stock < 0:
@@ -32,6 +54,75 @@ class Order(models.Model):
 
     class Meta:
         db_table = 'orders'
+        indexes = [
+            # Range scans for trends/analytics over allocated orders
+            models.Index(fields=['status', 'created_at'], name='orders_status_created_idx'),
+            models.Index(fields=['center', 'created_at'], name='orders_center_created_idx'),
+        ]
+
+    def __str__(self):
+        return self.order_id
+
+class CenterDailyRollup(models.Model):
+    center = models.ForeignKey(DistributionCenter, on_delete=models.CASCADE, related_name='rollups')
+    day = models.DateField()
+    # Sharded centers spread their rollup over their stock slots, so writers
+    # on different slots don't queue on one row; readers sum a day's slots
+    slot = models.PositiveSmallIntegerField(default=0)
+    order_count = models.IntegerField(default=0)
+    total_quantity = models.IntegerField(default=0)
+
+    class Meta:
+        db_table = 'center_daily_rollups'
+        constraints = [
+            models.UniqueConstraint(fields=['center', 'day', 'slot'], name='unique_center_day_slot_rollup'),
+        ]
+
+    def __str__(self):
+        return f'{self.center_id} {self.day}'
+
+class CenterStockSlot(models.Model):
+    center = models.ForeignKey(DistributionCenter, on_delete=models.CASCADE, related_name='stock_slots')
+    slot = models.PositiveSmallIntegerField()
+    stock = models.IntegerField()
+
+    class Meta:
+        db_table = 'center_stock_slots'
+        constraints = [
+            models.UniqueConstraint(fields=['center', 'slot'], name='unique_center_stock_slot'),
+        ]
 
     def __str__(self):
-        return self.order_id
\ No newline at end of file
+        return f'{self.center_id} #{self.slot}'
+
+class ApiKey(models.Model):
+    # Client credential for the Api-Key header. Only the SHA-256 of the key is
+    # stored: keys are 256-bit random tokens, so unlike passwords they need no
+    # slow hash to resist guessing, and verification costs one digest.
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='api_keys')
+    name = models.CharField(max_length=100, blank=True)
+    prefix = models.CharField(max_length=8)
+    key_hash = models.CharField(max_length=64, unique=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    revoked_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        db_table = 'api_keys'
+
+    def __str__(self):
+        return f'{self.prefix}… ({self.user})'
+
+    @staticmethod
+    def hash_key(raw_key):
+        return hashlib.sha256(raw_key.encode()).hexdigest()
+
+    @classmethod
+    def issue(cls, user, name='', raw_key=None):
+        # Returns (api_key, raw_key); the raw key is not recoverable later
+        raw_key = raw_key or secrets.token_urlsafe(32)
+        api_key = cls.objects.create(user=user, name=name, prefix=raw_key[:8], key_hash=cls.hash_key(raw_key))
+        return api_key, raw_key
+
+    def revoke(self):
+        self.revoked_at = timezone.now()
+        self.save(update_fields=['revoked_at'])
@@ -0,0 +1,165 @@
+import contextvars
+import functools
+import os
+import sqlite3
+import tempfile
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import connections
+from django.http import StreamingHttpResponse
+
+from . import inventory
+
+# Read-replica routing. Views decorated with replica_reads run their queries
+# on settings.REPLICA_DATABASE, unless the client allocated something in the
+# last REPLICA_STICKY_SECONDS (so it always sees its own writes) or the
+# replica has never been synced. Every write goes to 'default'. Pins are
+# kept in the 'shared' cache: a client's next read may land on any worker.
+#
+# Locally the replica is a second SQLite file refreshed by sync_replica; each
+# sync swaps in a new file and rewrites <file>.synced, whose identity says
+# which copy readers are seeing.
+
+_read_alias = contextvars.ContextVar('allocation_read_alias', default=None)
+
+class ReplicaRouter:
+    def db_for_read(self, model, **hints):
+        # The shared cache's table (DatabaseCache) is read where it is written
+        if model._meta.app_label == 'django_cache':
+            return 'default'
+        return _read_alias.get()
+
+    def db_for_write(self, model, **hints):
+        return 'default'
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Same data on both aliases
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        # The replica gets its schema with the data it is synced from
+        return False if db == settings.REPLICA_DATABASE else None
+
+def _pins():
+    return caches['shared']
+
+def _pin_key(user):
+    return f'allocation:replica-pin:{user.pk}'
+
+def pin(user):
+    # Sends the user's reads to the primary for the sticky window
+    if settings.REPLICA_READS_ENABLED:
+        _pins().set(_pin_key(user), 1, timeout=settings.REPLICA_STICKY_SECONDS)
+
+async def apin(user):
+    if settings.REPLICA_READS_ENABLED:
+        await _pins().aset(_pin_key(user), 1, timeout=settings.REPLICA_STICKY_SECONDS)
+
+def replica_path():
+    return str(connections[settings.REPLICA_DATABASE].settings_dict['NAME'])
+
+def _stamp_path():
+    return f'{replica_path()}.synced'
+
+def replica_stamp():
+    # Rewritten by every sync; None until the first one (connecting to a
+    # SQLite alias creates an empty file, so the file itself proves nothing)
+    try:
+        stat = os.stat(_stamp_path())
+    except OSError:
+        return None
+    return f'{stat.st_ino}:{stat.st_mtime_ns}'
+
+def _available():
+    return settings.REPLICA_READS_ENABLED and replica_stamp() is not None
+
+def read_alias(user):
+    if not _available() or (user is not None and _pins().get(_pin_key(user))):
+        return None
+    return settings.REPLICA_DATABASE
+
+async def aread_alias(user):
+    if not _available() or (user is not None and await _pins().aget(_pin_key(user))):
+        return None
+    return settings.REPLICA_DATABASE
+
+def source_version():
+    # Version of the data the current reads see, for versioned responses:
+    # the replica lags the inventory version until its next sync
+    if _read_alias.get() == settings.REPLICA_DATABASE:
+        return f'replica:{replica_stamp()}'
+    return inventory.inventory_version()
+
+def _stream(alias, content):
+    _read_alias.set(alias)
+    try:
+        yield from content
+    finally:
+        _read_alias.set(None)
+
+async def _astream(alias, content):
+    _read_alias.set(alias)
+    try:
+        async for chunk in content:
+            yield chunk
+    finally:
+        _read_alias.set(None)
+
+def replica_reads(view):
+    # Streaming bodies are produced after the view returns, so they carry
+    # the routing decision with them
+    @functools.wraps(view)
+    def wrapper(request, *args, **kwargs):
+        alias = read_alias(getattr(request, 'user', None))
+        token = _read_alias.set(alias)
+        try:
+            response = view(request, *args, **kwargs)
+        finally:
+            _read_alias.reset(token)
+        if alias and isinstance(response, StreamingHttpResponse):
+            response.streaming_content = _stream(alias, response.streaming_content)
+        return response
+    return wrapper
+
+def areplica_reads(view):
+    @functools.wraps(view)
+    async def wrapper(request, *args, **kwargs):
+        alias = await aread_alias(getattr(request, 'user', None))
+        token = _read_alias.set(alias)
+        try:
+            response = await view(request, *args, **kwargs)
+        finally:
+            _read_alias.reset(token)
+        if alias and isinstance(response, StreamingHttpResponse):
+            response.streaming_content = _astream(alias, response.streaming_content)
+        return response
+    return wrapper
+
+def sync():
+    # Copies the primary into a new file with SQLite's online backup API (a
+    # consistent snapshot, even with writers running) and swaps it in.
+    # Connections opened afterwards read the new copy.
+    source = connections['default']
+    if source.vendor != 'sqlite' or connections[settings.REPLICA_DATABASE].vendor != 'sqlite':
+        raise ValueError('sync() only copies SQLite files; use the database\'s own replication')
+    target = replica_path()
+    fd, tmp = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(target)), suffix='.sqlite3')
+    os.close(fd)
+    try:
+        src = sqlite3.connect(source.settings_dict['NAME'])
+        dst = sqlite3.connect(tmp)
+        try:
+            src.backup(dst)
+        finally:
+            dst.close()
+            src.close()
+        os.replace(tmp, target)
+    except BaseException:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+        raise
+    connections[settings.REPLICA_DATABASE].close()
+    fd, tmp = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(target)), suffix='.synced')
+    os.close(fd)
+    os.replace(tmp, _stamp_path())
@@ -0,0 +1,82 @@
+from django.db import transaction
+from django.db.models import Case, Count, F, IntegerField, Sum, Value, When
+from django.db.models.functions import TruncDate
+from django.utils import timezone
+
+from . import archive, forecast
+from .models import CenterDailyRollup, DistributionCenter, Order
+
+# Centers per UPDATE statement, so its CASE parameters stay well under the
+# database's bind-variable limit
+UPDATE_CHUNK_SIZE = 500
+
+def _add_totals(day, slot, totals):
+    # One UPDATE adding each center's (orders, quantity) to its row for day
+    def increment(field, position):
+        return F(field) + Case(
+            *[When(center_id=center_pk, then=Value(total[position])) for center_pk, total in totals.items()],
+            default=Value(0), output_field=IntegerField()
+        )
+    CenterDailyRollup.objects.filter(day=day, slot=slot, center_id__in=list(totals)).update(
+        order_count=increment('order_count', 0),
+        total_quantity=increment('total_quantity', 1),
+    )
+
+def record_allocations(totals, day=None, slot=0):
+    # totals maps center pk -> (orders, quantity). Must run inside the
+    # allocation's transaction so the rollup never drifts from Order. Each
+    # center's day is kept on one row per stock slot: a single order adds to
+    # the slot its stock came from (see sharding.reserve), so writers on
+    # different slots don't serialize on the rollup either. The
+    # query count doesn't depend on how many centers a batch touched: per
+    # UPDATE_CHUNK_SIZE centers, one lookup of their rows for the day, one
+    # insert of empty rows for the centers seen for the first time that
+    # day, and one UPDATE adding every center's totals.
+    day = day or timezone.localdate()
+    items = list(totals.items())
+    for i in range(0, len(items), UPDATE_CHUNK_SIZE):
+        chunk = dict(items[i:i + UPDATE_CHUNK_SIZE])
+        existing = set(CenterDailyRollup.objects.filter(
+            day=day, slot=slot, center_id__in=list(chunk)
+        ).values_list('center_id', flat=True))
+        if len(existing) < len(chunk):
+            # Rows another worker creates meanwhile are kept; both sides'
+            # totals are then added by the UPDATE
+            CenterDailyRollup.objects.bulk_create(
+                [CenterDailyRollup(center_id=center_pk, day=day, slot=slot) for center_pk in chunk if center_pk not in existing],
+                ignore_conflicts=True
+            )
+        _add_totals(day, slot, chunk)
+
+def record_allocation(center_pk, quantity, day=None, slot=0):
+    record_allocations({center_pk: (1, quantity)}, day, slot)
+
+def rebuild(batch_size=1000):
+    # Recomputes every rollup from Order history in one grouped query, plus
+    # the hourly totals kept with archived orders (see allocation.archive).
+    # Each center's day is folded onto slot 0.
+    rows = (
+        Order.objects.filter(status='allocated', center__isnull=False)
+        .annotate(day=TruncDate('created_at'))
+        .values('center', 'day')
+        .annotate(order_count=Count('id'), total_quantity=Sum('quantity'))
+        .order_by()
+    )
+    totals = {key: list(value) for key, value in archive.daily_totals().items()}
+    if totals:
+        # Archived orders may point at centers that were deleted since
+        centers = set(DistributionCenter.objects.values_list('pk', flat=True))
+        totals = {key: value for key, value in totals.items() if key[0] in centers}
+    for row in rows.iterator():
+        entry = totals.setdefault((row['center'], row['day']), [0, 0])
+        entry[0] += row['order_count']
+        entry[1] += row['total_quantity']
+    with transaction.atomic():
+        CenterDailyRollup.objects.all().delete()
+        rollups = CenterDailyRollup.objects.bulk_create(
+            (CenterDailyRollup(center_id=center_pk, day=day, order_count=orders, total_quantity=quantity)
+             for (center_pk, day), (orders, quantity) in totals.items()),
+            batch_size=batch_size
+        )
+    forecast.invalidate()
+    return len(rollups)
@@ -1,23 +1,149 @@
-from rest_framework import serializers
+from collections.abc import Mapping
+
+from rest_framework import fields, serializers
+from rest_framework.settings import api_settings
+from rest_framework.validators import ProhibitSurrogateCharactersValidator
+from . import archive
 from .models import Order
 
-class OrderSerializer(serializers.ModelSerializer):
-    class Meta:
-        model = Order
-        fields = ['order_id', 'quantity', 'zip_code']
+DUPLICATE_ORDER_ERROR = "Order_id já existe."
+QUANTITY_ERROR = "Quantity deve ser um inteiro positivo."
+ZIP_CODE_ERROR = "Zip_code deve ser numérico."
+
+def duplicate_order_errors():
+    # What OrderSerializer's unique validator reports for an order_id already
+    # in the table; /allocate/ learns of those from the unique constraint
+    field = Order._meta.get_field('order_id')
+    message = field.error_messages['unique'] % {'model_name': Order._meta.verbose_name, 'field_label': field.verbose_name}
+    return {'order_id': [str(message)]}
 
+def is_zip_code(value):
+    # ASCII digits only: str.isdigit() alone also accepts characters such as
+    # '²' that int() rejects
+    return value.isascii() and value.isdigit()
+
+class OrderFieldsMixin:
     def validate_quantity(self, value):
         if value <= 0:
-            raise serializers.ValidationError("Quantity deve ser um inteiro positivo.")
+            raise serializers.ValidationError(QUANTITY_ERROR)
         return value
 
     def validate_zip_code(self, value):
-        if not value.isdigit():
-            raise serializers.ValidationError("Zip_code deve ser numérico.")
+        if not is_zip_code(value):
+            raise serializers.ValidationError(ZIP_CODE_ERROR)
         return value
 
+class OrderSerializer(OrderFieldsMixin, serializers.ModelSerializer):
+    class Meta:
+        model = Order
+        fields = ['order_id', 'quantity', 'zip_code']
+
     def validate(self, data):
-        # Verifica se order_id já existe
-        if Order.objects.filter(order_id=data['order_id']).exists():
-            raise serializers.ValidationError("Order_id já existe.")
-        return data
\ No newline at end of file
+        # Verifica se order_id já existe (também entre os pedidos arquivados)
+        if Order.objects.filter(order_id=data['order_id']).exists() or archive.contains(data['order_id']):
+            raise serializers.ValidationError(DUPLICATE_ORDER_ERROR)
+        return data
+
+class BatchOrderItemSerializer(OrderFieldsMixin, serializers.Serializer):
+    # Same field rules as OrderSerializer, but without the per-order
+    # uniqueness query: the batch path checks order_ids in one lookup.
+    order_id = serializers.CharField(max_length=50)
+    quantity = serializers.IntegerField()
+    zip_code = serializers.CharField(max_length=10)
+
+class OrderPayload:
+    # /allocate/ payload parser: the same rules and error messages as
+    # OrderSerializer (DRF's own messages for required, null, blank, length
+    # and type errors), without building serializer fields per request.
+    # Duplicates are not looked up here; the unique constraint on order_id
+    # reports them at insert time (only archived orders, which the
+    # constraint cannot see, are checked up front).
+    __slots__ = ('data', 'validated_data', 'errors')
+
+    def __init__(self, data):
+        self.data = data
+        self.validated_data = None
+        self.errors = {}
+
+    def is_valid(self):
+        data = self.data
+        if data is None:
+            self.errors = {api_settings.NON_FIELD_ERRORS_KEY: ['No data provided']}
+            return False
+        if not isinstance(data, Mapping):
+            message = str(serializers.Serializer.default_error_messages['invalid'])
+            self.errors = {api_settings.NON_FIELD_ERRORS_KEY: [message.format(datatype=type(data).__name__)]}
+            return False
+
+        errors = {}
+        order_id = self._char(data, 'order_id', 50, errors)
+        quantity = self._integer(data, 'quantity', errors)
+        if quantity is not None and quantity <= 0:
+            errors['quantity'] = [QUANTITY_ERROR]
+        zip_code = self._char(data, 'zip_code', 10, errors)
+        if zip_code is not None and not is_zip_code(zip_code):
+            errors['zip_code'] = [ZIP_CODE_ERROR]
+        if not errors and archive.contains(order_id):
+            errors[api_settings.NON_FIELD_ERRORS_KEY] = [DUPLICATE_ORDER_ERROR]
+        if errors:
+            self.errors = errors
+            return False
+        self.validated_data = {"order_id": order_id, "quantity": quantity, "zip_code": zip_code}
+        return True
+
+    @staticmethod
+    def _present(data, name, errors):
+        value = data.get(name, fields.empty)
+        if value is fields.empty:
+            errors[name] = [str(fields.Field.default_error_messages['required'])]
+        elif value is None:
+            errors[name] = [str(fields.Field.default_error_messages['null'])]
+        else:
+            return True
+        return False
+
+    @classmethod
+    def _char(cls, data, name, max_length, errors):
+        # rest_framework.fields.CharField with trim_whitespace and max_length
+        if not cls._present(data, name, errors):
+            return None
+        value = data[name]
+        messages = fields.CharField.default_error_messages
+        if value == '' or str(value).strip() == '':
+            errors[name] = [str(messages['blank'])]
+            return None
+        if isinstance(value, bool) or not isinstance(value, (str, int, float)):
+            errors[name] = [str(messages['invalid'])]
+            return None
+        value = str(value).strip()
+        problems = []
+        if len(value) > max_length:
+            problems.append(str(messages['max_length']).format(max_length=max_length))
+        if '\x00' in value:
+            problems.append('Null characters are not allowed.')
+        try:
+            value.encode('utf-8')
+        except UnicodeEncodeError as exc:
+            problems.append(str(ProhibitSurrogateCharactersValidator.message).format(
+                code_point=ord(value[exc.start])
+            ))
+        if problems:
+            errors[name] = problems
+            return None
+        return value
+
+    @classmethod
+    def _integer(cls, data, name, errors):
+        # rest_framework.fields.IntegerField without bounds
+        if not cls._present(data, name, errors):
+            return None
+        value = data[name]
+        messages = fields.IntegerField.default_error_messages
+        if isinstance(value, str) and len(value) > fields.IntegerField.MAX_STRING_LENGTH:
+            errors[name] = [str(messages['max_string_length'])]
+            return None
+        try:
+            return int(fields.IntegerField.re_decimal.sub('', str(value)))
+        except (ValueError, TypeError):
+            errors[name] = [str(messages['invalid'])]
+            return None
@@ -4,4 +4,3 @@ REST_FRAMEWORK = {
     ],
     'DEFAULT_SCHEMA_CLASS': 'drf_spectacular.openapi.AutoSchema'
 }
-API_KEY = 'ty/>Q438I8Ds'  
\ No newline at end of file
@@ -0,0 +1,105 @@
+import random
+
+from django.db import transaction
+from django.db.models import Case, F, IntegerField, OuterRef, Subquery, Sum, Value, When
+from django.db.models.functions import Coalesce
+
+from .models import CenterStockSlot, DistributionCenter
+
+# Opt-in sharded inventory. A hot center's stock can be moved off its
+# distribution_centers row onto K CenterStockSlot rows; allocations then
+# decrement one slot, so up to K writers proceed in parallel instead of
+# queueing on a single row lock. Readers use total_stock (or the annotations
+# below), which sums the row and its slots.
+
+def _shares(total, slots):
+    return [total // slots + (1 if i < total % slots else 0) for i in range(slots)]
+
+def slot_stock():
+    # Sum of a center's slots; only evaluated for sharded centers
+    total = CenterStockSlot.objects.filter(center=OuterRef('pk')).order_by().values('center').annotate(
+        total=Sum('stock')
+    ).values('total')
+    return Case(
+        When(slot_count=0, then=Value(0)),
+        default=Coalesce(Subquery(total, output_field=IntegerField()), Value(0)),
+        output_field=IntegerField()
+    )
+
+def with_total_stock(queryset):
+    # Annotates slot_stock so center.total_stock needs no extra query
+    return queryset.annotate(slot_stock=slot_stock())
+
+def lock_slots(centers):
+    # Locks the slot rows of the sharded centers among `centers`, in a fixed
+    # order, and sets their slot_stock from the locked rows, so the totals a
+    # batch ranks on cannot move before take() writes them back
+    sharded = {center.pk: center for center in centers if center.slot_count}
+    if not sharded:
+        return
+    totals = dict.fromkeys(sharded, 0)
+    for center_id, stock in CenterStockSlot.objects.select_for_update().filter(
+        center_id__in=sharded
+    ).order_by('center_id', 'slot').values_list('center_id', 'stock'):
+        totals[center_id] += stock
+    for center_pk, total in totals.items():
+        sharded[center_pk].slot_stock = total
+
+def stock_levels(queryset):
+    # (summed stock, slot_count) per center
+    return with_total_stock(queryset).annotate(
+        available=F('stock') + F('slot_stock')
+    ).values_list('available', 'slot_count')
+
+def reshard(center_pk, slots):
+    # Spreads the center's stock evenly over `slots` slot rows, or folds it
+    # back onto the center row with slots=0.
+    with transaction.atomic():
+        center = DistributionCenter.objects.select_for_update().get(pk=center_pk)
+        existing = CenterStockSlot.objects.select_for_update().filter(center=center)
+        total = center.stock + sum(row.stock for row in existing)
+        existing.delete()
+        if slots:
+            CenterStockSlot.objects.bulk_create(
+                CenterStockSlot(center=center, slot=i, stock=share) for i, share in enumerate(_shares(total, slots))
+            )
+        center.stock = 0 if slots else total
+        center.slot_count = slots
+        center.save(update_fields=['stock', 'slot_count'])
+    return center
+
+def reserve(center_pk, quantity, slot_count):
+    # Conditional decrement of the center row, or of one of its slots picked
+    # at random. A slot that cannot cover the order moves on to the next; when
+    # no single slot can but the slots together do, they are rebalanced.
+    # Returns the slot the order's rollup goes to (0 for unsharded centers),
+    # or None when the stock cannot cover it.
+    if not slot_count:
+        if DistributionCenter.objects.filter(
+            pk=center_pk, stock__gte=quantity
+        ).update(stock=F('stock') - quantity):
+            return 0
+        return None
+    start = random.randrange(slot_count)
+    for i in range(slot_count):
+        slot = (start + i) % slot_count
+        if CenterStockSlot.objects.filter(
+            center_id=center_pk, slot=slot, stock__gte=quantity
+        ).update(stock=F('stock') - quantity):
+            return slot
+    if take(center_pk, quantity):
+        return start
+    return None
+
+def take(center_pk, quantity):
+    # Locks every slot of the center, takes quantity from their sum and
+    # spreads the remainder evenly again. False if the slots cannot cover it.
+    with transaction.atomic():
+        rows = list(CenterStockSlot.objects.select_for_update().filter(center_id=center_pk).order_by('slot'))
+        total = sum(row.stock for row in rows)
+        if not rows or total < quantity:
+            return False
+        for row, share in zip(rows, _shares(total - quantity, len(rows))):
+            row.stock = share
+        CenterStockSlot.objects.bulk_update(rows, ['stock'])
+    return True
@@ -0,0 +1,29 @@
+from django.contrib.auth import get_user_model
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from . import alerts, authentication, inventory
+from .models import ApiKey, DistributionCenter
+
+@receiver(post_save, sender=DistributionCenter)
+def center_saved(sender, instance, created, **kwargs):
+    inventory.center_changed(instance, created)
+    # Restocks and edits can move a center between alert levels too
+    alerts.observe(instance)
+
+@receiver(post_delete, sender=DistributionCenter)
+def center_deleted(sender, instance, **kwargs):
+    inventory.invalidate()
+
+@receiver(post_save, sender=ApiKey)
+@receiver(post_delete, sender=ApiKey)
+def api_key_changed(sender, **kwargs):
+    authentication.invalidate()
+
+@receiver(post_save, sender=get_user_model())
+@receiver(post_delete, sender=get_user_model())
+def api_key_user_changed(sender, update_fields=None, **kwargs):
+    # Deactivated or deleted users lose their keys; logins (last_login only)
+    # do not matter here
+    if update_fields is None or set(update_fields) != {'last_login'}:
+        authentication.invalidate()
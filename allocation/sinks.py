@@ -0,0 +1,218 @@
+import atexit
+import json
+import logging
+import os
+import queue
+import threading
+import time
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.utils import timezone
+
+from . import storage as storage_backends
+
+logger = logging.getLogger('allocation.sinks')
+
+class BufferedSink:
+    # Takes records from a bounded in-memory queue on a background thread and
+    # appends them to rotating NDJSON segments in a storage backend (a
+    # directory path means LocalStorage), so request threads never wait on
+    # disk or the network. Segments rotate by size or age and may be
+    # gzip-compressed.
+    def __init__(self, storage, prefix, queue_size=None, batch_size=None, flush_interval=None,
+                 segment_max_bytes=None, segment_max_age=None, compress=None, block_timeout=None):
+        if isinstance(storage, (str, os.PathLike)):
+            storage = storage_backends.LocalStorage(storage)
+        self.storage = storage
+        self.prefix = prefix
+        self.batch_size = batch_size or settings.LOG_SINK_BATCH_SIZE
+        self.flush_interval = flush_interval or settings.LOG_SINK_FLUSH_INTERVAL
+        self.segment_max_bytes = segment_max_bytes or settings.LOG_SINK_SEGMENT_MAX_BYTES
+        self.segment_max_age = segment_max_age or settings.LOG_SINK_SEGMENT_MAX_AGE
+        self.compress = settings.LOG_SINK_COMPRESS if compress is None else compress
+        self.block_timeout = settings.LOG_SINK_BLOCK_TIMEOUT if block_timeout is None else block_timeout
+        self.queue = queue.Queue(maxsize=queue_size or settings.LOG_SINK_QUEUE_SIZE)
+
+        self.enqueued = 0
+        self.written = 0
+        self.dropped = 0
+        self.blocked = 0
+        self.failed = 0
+        self.segments = 0
+
+        self._stats_lock = threading.Lock()
+        self._file = None
+        self._segment_bytes = 0
+        self._segment_opened = 0
+        self._thread = None
+        self._lock = threading.Lock()
+        self._closed = False
+
+    def emit(self, record):
+        # Returns False when the record was dropped because the queue stayed
+        # full for longer than block_timeout.
+        self._ensure_started()
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            with self._stats_lock:
+                self.blocked += 1
+            try:
+                self.queue.put(record, timeout=self.block_timeout)
+            except queue.Full:
+                with self._stats_lock:
+                    self.dropped += 1
+                return False
+        with self._stats_lock:
+            self.enqueued += 1
+        return True
+
+    async def aemit(self, record):
+        # emit() for the event loop: the common case is a non-blocking put;
+        # only a full queue waits for room, and it does so off the loop.
+        self._ensure_started()
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            return await sync_to_async(self.emit, thread_sensitive=False)(record)
+        with self._stats_lock:
+            self.enqueued += 1
+        return True
+
+    def flush(self):
+        # Blocks until every record emitted so far is on disk.
+        if self._thread is not None:
+            self.queue.join()
+
+    def close(self):
+        with self._lock:
+            if self._closed or self._thread is None:
+                self._closed = True
+                return
+            self._closed = True
+        self.queue.put(None)
+        self._thread.join()
+
+    def stats(self):
+        return {
+            "queue_depth": self.queue.qsize(),
+            "queue_capacity": self.queue.maxsize,
+            "enqueued": self.enqueued,
+            "written": self.written,
+            "dropped": self.dropped,
+            "blocked": self.blocked,
+            "failed": self.failed,
+            "segments": self.segments,
+        }
+
+    def _ensure_started(self):
+        if self._thread is None:
+            with self._lock:
+                if self._thread is None and not self._closed:
+                    self._thread = threading.Thread(target=self._run, name=f'sink-{self.prefix}', daemon=True)
+                    self._thread.start()
+
+    def _run(self):
+        stop = False
+        while not stop:
+            try:
+                batch = [self.queue.get(timeout=self.flush_interval)]
+            except queue.Empty:
+                self._guarded(self._rotate_if_stale)
+                continue
+            while len(batch) < self.batch_size:
+                try:
+                    batch.append(self.queue.get_nowait())
+                except queue.Empty:
+                    break
+            records = [record for record in batch if record is not None]
+            stop = len(records) != len(batch)
+            try:
+                if records and not self._guarded(self._write, records):
+                    with self._stats_lock:
+                        self.failed += len(records)
+            finally:
+                for _ in batch:
+                    self.queue.task_done()
+        self._guarded(self._close_segment)
+
+    def _guarded(self, step, *args):
+        # A failing backend (disk full, AWS unreachable) costs the batch and
+        # the open segment, not the writer thread
+        try:
+            step(*args)
+            return True
+        except Exception:
+            logger.exception('sink %s: storage write failed', self.prefix)
+            self._file = None
+            return False
+
+    def _write(self, records):
+        data = ''.join(json.dumps(record, default=str) + '\n' for record in records)
+        self._rotate_if_stale()
+        if self._file is None:
+            self._open_segment()
+        self._file.write(data)
+        self._segment_bytes += len(data)
+        self.written += len(records)
+        if self._segment_bytes >= self.segment_max_bytes:
+            self._close_segment()
+
+    def _open_segment(self):
+        self.segments += 1
+        stamp = timezone.now().strftime('%Y%m%dT%H%M%S')
+        name = f'{self.prefix}-{stamp}-{os.getpid()}-{self.segments:06d}.ndjson'
+        self._file = self.storage.open_segment(name, compress=self.compress)
+        self._segment_bytes = 0
+        self._segment_opened = time.monotonic()
+
+    def _rotate_if_stale(self):
+        if self._file is not None and time.monotonic() - self._segment_opened >= self.segment_max_age:
+            self._close_segment()
+
+    def _close_segment(self):
+        if self._file is not None:
+            file, self._file = self._file, None
+            file.close()
+
+_sinks = {}
+_sinks_lock = threading.Lock()
+
+def get_sink(name):
+    # Storage from settings.LOG_SINK_STORAGES[name]; a directory named after
+    # the sink when it isn't listed
+    sink = _sinks.get(name)
+    if sink is None:
+        with _sinks_lock:
+            sink = _sinks.get(name)
+            if sink is None:
+                config = settings.LOG_SINK_STORAGES.get(name, {'BACKEND': 'local', 'OPTIONS': {'directory': name}})
+                storage = storage_backends.create(config['BACKEND'], config.get('OPTIONS'))
+                sink = _sinks[name] = BufferedSink(storage, name)
+    return sink
+
+def order_log():
+    # Allocation results (S3, or its local mock)
+    return get_sink('orders')
+
+def alert_log():
+    # Low-stock alerts (CloudWatch Logs, or its local mock)
+    return get_sink('alerts')
+
+def flush_all():
+    for sink in list(_sinks.values()):
+        sink.flush()
+
+def shutdown():
+    # Flushes and closes every sink; registered to run at interpreter exit.
+    with _sinks_lock:
+        sinks = list(_sinks.values())
+        _sinks.clear()
+    for sink in sinks:
+        sink.close()
+
+def stats():
+    return {name: sink.stats() for name, sink in _sinks.items()}
+
+atexit.register(shutdown)
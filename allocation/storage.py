@@ -0,0 +1,166 @@
+import gzip
+import io
+import os
+import threading
+import time
+
+# Where BufferedSink segments end up. A backend opens a segment by name and
+# returns a writer with write(text) and close(); the sink decides when to
+# rotate. Backends are chosen per sink in settings.LOG_SINK_STORAGES, and
+# the AWS ones import boto3 the first time they talk to AWS, so processes
+# that never use them (tests, management commands, the local mocks) don't
+# pay for loading it.
+
+class LocalStorage:
+    # NDJSON segment files in a directory, created on first write
+    def __init__(self, directory):
+        self.directory = directory
+
+    def open_segment(self, name, compress=False):
+        os.makedirs(self.directory, exist_ok=True)
+        path = os.path.join(self.directory, name)
+        if compress:
+            return _LocalSegment(gzip.open(path + '.gz', 'at', encoding='utf-8'), fsync=False)
+        return _LocalSegment(open(path, 'a', encoding='utf-8'), fsync=True)
+
+class _LocalSegment:
+    def __init__(self, file, fsync):
+        self.file = file
+        self.fsync = fsync
+
+    def write(self, data):
+        self.file.write(data)
+        self.file.flush()
+
+    def close(self):
+        self.file.flush()
+        if self.fsync:
+            os.fsync(self.file.fileno())
+        self.file.close()
+
+class MemoryStorage:
+    # Segments kept in the process, {name: text}; for tests and for
+    # deployments that only want the metrics
+    def __init__(self):
+        self.segments = {}
+        self._lock = threading.Lock()
+
+    def open_segment(self, name, compress=False):
+        return _MemorySegment(self, name)
+
+    def lines(self):
+        with self._lock:
+            return [line for text in self.segments.values() for line in text.splitlines()]
+
+    def clear(self):
+        with self._lock:
+            self.segments.clear()
+
+class _MemorySegment:
+    def __init__(self, storage, name):
+        self.storage = storage
+        self.name = name
+        with storage._lock:
+            storage.segments[name] = ''
+
+    def write(self, data):
+        with self.storage._lock:
+            self.storage.segments[self.name] += data
+
+    def close(self):
+        pass
+
+class _AwsStorage:
+    service = None
+
+    def __init__(self, region_name=None, **client_options):
+        self.client_options = dict(client_options, region_name=region_name)
+        self._client = None
+
+    @property
+    def client(self):
+        # Only the sink's writer thread gets here
+        if self._client is None:
+            import boto3
+            self._client = boto3.client(self.service, **self.client_options)
+        return self._client
+
+class S3Storage(_AwsStorage):
+    # One object per segment, uploaded when the segment is closed
+    service = 's3'
+
+    def __init__(self, bucket, prefix='', **options):
+        super().__init__(**options)
+        self.bucket = bucket
+        self.prefix = prefix
+
+    def open_segment(self, name, compress=False):
+        return _S3Segment(self, self.prefix + name, compress)
+
+class _S3Segment:
+    def __init__(self, storage, key, compress):
+        self.storage = storage
+        self.key = key
+        self.compress = compress
+        self.buffer = io.StringIO()
+
+    def write(self, data):
+        self.buffer.write(data)
+
+    def close(self):
+        body = self.buffer.getvalue().encode('utf-8')
+        if not body:
+            return
+        key = self.key
+        if self.compress:
+            body = gzip.compress(body)
+            key += '.gz'
+        self.storage.client.put_object(Bucket=self.storage.bucket, Key=key, Body=body)
+
+class CloudWatchStorage(_AwsStorage):
+    # One log stream per segment; every written batch is one
+    # put_log_events call (records past the API's per-call limit are split)
+    service = 'logs'
+    MAX_EVENTS = 10000
+
+    def __init__(self, log_group, **options):
+        super().__init__(**options)
+        self.log_group = log_group
+
+    def open_segment(self, name, compress=False):
+        self.client.create_log_stream(logGroupName=self.log_group, logStreamName=name)
+        return _CloudWatchSegment(self, name)
+
+class _CloudWatchSegment:
+    def __init__(self, storage, stream):
+        self.storage = storage
+        self.stream = stream
+
+    def write(self, data):
+        timestamp = int(time.time() * 1000)
+        events = [{'timestamp': timestamp, 'message': line} for line in data.splitlines()]
+        for i in range(0, len(events), self.storage.MAX_EVENTS):
+            self.storage.client.put_log_events(
+                logGroupName=self.storage.log_group,
+                logStreamName=self.stream,
+                logEvents=events[i:i + self.storage.MAX_EVENTS],
+            )
+
+    def close(self):
+        pass
+
+BACKENDS = {
+    'local': LocalStorage,
+    'memory': MemoryStorage,
+    's3': S3Storage,
+    'cloudwatch': CloudWatchStorage,
+}
+
+def create(backend, options=None):
+    # backend: a BACKENDS name or a dotted path to a class
+    if backend in BACKENDS:
+        cls = BACKENDS[backend]
+    else:
+        from django.utils.module_loading import import_string
+        cls = import_string(backend)
+    return cls(**(options or {}))
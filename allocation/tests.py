@@ -1,13 +1,45 @@
-from django.test import TestCase
+from django.contrib.auth.models import User
+from django.test import TestCase, TransactionTestCase, override_settings
 from rest_framework.test import APIClient
-from allocation.models import DistributionCenter, Order
+from asgiref.sync import sync_to_async
+from allocation.models import CenterDailyRollup, DistributionCenter, Order
 from django.conf import settings
 from django.utils import timezone
 from datetime import timedelta
+import json
 import os
 
+def issue_api_key(username='api-client'):
+    # A fresh issued key for username, created if needed; for tests that go
+    # through ApiKeyAuthentication
+    from allocation.models import ApiKey
+    user, _ = User.objects.get_or_create(username=username)
+    return ApiKey.issue(user, 'tests')[1]
+
+def logged_in_client(username):
+    # A client authenticated as a new user, skipping the authenticators
+    client = APIClient()
+    client.force_authenticate(User.objects.create_user(username, password=username))
+    return client
+
+def sink_records(directory):
+    # Records written by this process's sinks into one of the mock directories
+    import glob
+    import gzip
+    import json
+    from allocation import alerts, sinks
+    alerts.flush()
+    sinks.flush_all()
+    records = []
+    for path in sorted(glob.glob(f'{directory}/*-{os.getpid()}-*.ndjson*')):
+        opener = gzip.open if path.endswith('.gz') else open
+        with opener(path, 'rt') as f:
+            records.extend(json.loads(line) for line in f)
+    return records
+
 class TestAllocation(TestCase):
     def setUp(self):
+        self.api_key = issue_api_key()
         self.client = APIClient()
         self.center1 = DistributionCenter.objects.create(center_id='C1', stock=15, initial_stock=100, zip_code='10000')
         self.center2 = DistributionCenter.objects.create(center_id='C2', stock=8, initial_stock=50, zip_code='10003')
@@ -17,17 +49,17 @@ class TestAllocation(TestCase):
             'order_id': 'O1',
             'quantity': 10,
             'zip_code': '10001'
-        }, format='json', HTTP_API_KEY=settings.API_KEY)
+        }, format='json', HTTP_API_KEY=self.api_key)
         self.assertEqual(response.status_code, 200)
         self.assertEqual(response.data['center_id'], 'C1')
-        self.assertTrue(os.path.exists('logs/O1.json'))  # Test S3 mock
+        self.assertIn('O1', [r['order_id'] for r in sink_records('logs')])  # Test S3 mock
 
     def test_insufficient_stock(self):
         response = self.client.post('/allocate/', {
             'order_id': 'O2',
             'quantity': 50,
             'zip_code': '10001'
-        }, format='json', HTTP_API_KEY=settings.API_KEY)
+        }, format='json', HTTP_API_KEY=self.api_key)
         self.assertEqual(response.status_code, 400)
         self.assertIn('error', response.data)
 
@@ -36,7 +68,7 @@ class TestAllocation(TestCase):
             'order_id': 'O3',
             'quantity': -5,
             'zip_code': '10001'
-        }, format='json', HTTP_API_KEY=settings.API_KEY)
+        }, format='json', HTTP_API_KEY=self.api_key)
         self.assertEqual(response.status_code, 400)
         self.assertIn('Quantity deve ser um inteiro positivo', str(response.data))
 
@@ -45,7 +77,7 @@ class TestAllocation(TestCase):
             'order_id': 'O4',
             'quantity': 10,
             'zip_code': 'abc'
-        }, format='json', HTTP_API_KEY=settings.API_KEY)
+        }, format='json', HTTP_API_KEY=self.api_key)
         self.assertEqual(response.status_code, 400)
         self.assertIn('Zip_code deve ser numérico', str(response.data))
 
@@ -55,9 +87,9 @@ class TestAllocation(TestCase):
             'order_id': 'O5',
             'quantity': 10,
             'zip_code': '10001'
-        }, format='json', HTTP_API_KEY=settings.API_KEY)
+        }, format='json', HTTP_API_KEY=self.api_key)
         self.assertEqual(response.status_code, 400)
-        self.assertIn('Order_id já existe', str(response.data))
+        self.assertEqual(response.json(), {'order_id': ['order with this order id already exists.']})
 
     def test_low_stock_alert(self):
         self.center1.stock = 19
@@ -66,9 +98,9 @@ class TestAllocation(TestCase):
             'order_id': 'O6',
             'quantity': 1,
             'zip_code': '10000'
-        }, format='json', HTTP_API_KEY=settings.API_KEY)
+        }, format='json', HTTP_API_KEY=self.api_key)
         self.assertEqual(response.status_code, 200)
-        self.assertTrue(os.path.exists('alerts/C1_alert.json'))  # Test CloudWatch mock
+        self.assertIn('C1', [r['center_id'] for r in sink_records('alerts')])  # Test CloudWatch mock
 
     def test_api_key_authentication(self):
         response = self.client.post('/allocate/', {
@@ -86,14 +118,14 @@ class TestAllocation(TestCase):
 
     def test_analytics_endpoint(self):
         Order.objects.create(order_id='O9', quantity=5, zip_code='10001', center=self.center1, status='allocated')
-        response = self.client.get('/analytics/', HTTP_API_KEY=settings.API_KEY)
+        response = self.client.get('/analytics/', HTTP_API_KEY=self.api_key)
         self.assertEqual(response.status_code, 200)
         data = response.data
         self.assertTrue(any(d['center_id'] == 'C1' and d['low_stock_alert'] for d in data))
 
     def test_analytics_with_date_filter(self):
         Order.objects.create(order_id='O10', quantity=5, zip_code='10001', center=self.center1, status='allocated', created_at=timezone.now() - timedelta(days=60))
-        response = self.client.get('/analytics/?from_date=' + timezone.now().strftime('%Y-%m-%d'), HTTP_API_KEY=settings.API_KEY)
+        response = self.client.get('/analytics/?from_date=' + timezone.now().strftime('%Y-%m-%d'), HTTP_API_KEY=self.api_key)
         self.assertEqual(response.status_code, 200)
         data = response.data
         self.assertFalse(any(d['center_id'] == 'C1' and d['total_orders'] > 0 for d in data))
@@ -110,11 +142,11 @@ class TestAllocation(TestCase):
             self.center1.save()
 
     def test_openapi_schema(self):
-        response = self.client.get('/schema/', HTTP_API_KEY=settings.API_KEY)
+        response = self.client.get('/schema/', HTTP_API_KEY=self.api_key)
         self.assertEqual(response.status_code, 200)
 
     def test_empty_analytics(self):
-        response = self.client.get('/analytics/', HTTP_API_KEY=settings.API_KEY)
+        response = self.client.get('/analytics/', HTTP_API_KEY=self.api_key)
         self.assertEqual(response.status_code, 200)
         self.assertEqual(len(response.data), 2)  # Two centers, no orders
 
@@ -124,7 +156,7 @@ class TestAllocation(TestCase):
             'order_id': 'O11',
             'quantity': 10,
             'zip_code': '10001'
-        }, format='json', HTTP_API_KEY=settings.API_KEY)
+        }, format='json', HTTP_API_KEY=self.api_key)
         self.assertEqual(response.status_code, 400)
         self.assertIn('error', response.data)
 
@@ -132,4 +164,2024 @@ class TestAllocation(TestCase):
         DistributionCenter.objects.all().delete()
         from django.core.management import call_command
         call_command('populate_centers')
-        self.assertEqual(DistributionCenter.objects.count(), 3)  # C1, C2, C3
\ No newline at end of file
+        self.assertEqual(DistributionCenter.objects.count(), 3)  # C1, C2, C3
+
+class TestBatchAllocation(TestCase):
+    def setUp(self):
+        self.client = logged_in_client('batch')
+        self.center1 = DistributionCenter.objects.create(center_id='C1', stock=15, initial_stock=100, zip_code='10000')
+        self.center2 = DistributionCenter.objects.create(center_id='C2', stock=8, initial_stock=50, zip_code='10003')
+
+    def post_batch(self, orders):
+        return self.client.post('/allocate/batch/', {'orders': orders}, format='json')
+
+    def test_batch_allocates_against_shared_snapshot(self):
+        response = self.post_batch([
+            {'order_id': 'B1', 'quantity': 5, 'zip_code': '10003'},
+            {'order_id': 'B2', 'quantity': 5, 'zip_code': '10003'},
+            {'order_id': 'B3', 'quantity': 10, 'zip_code': '10001'},
+        ])
+        self.assertEqual(response.status_code, 200)
+        results = response.data['results']
+        self.assertEqual([r['center_id'] for r in results], ['C2', 'C1', 'C1'])
+        self.assertEqual(response.data['allocated'], 3)
+        self.center1.refresh_from_db()
+        self.center2.refresh_from_db()
+        self.assertEqual(self.center1.stock, 0)
+        self.assertEqual(self.center2.stock, 3)
+        self.assertEqual(Order.objects.filter(status='allocated').count(), 3)
+
+    def test_batch_partial_failures(self):
+        Order.objects.create(order_id='B4', quantity=1, zip_code='10000', center=self.center1, status='allocated')
+        response = self.post_batch([
+            {'order_id': 'B4', 'quantity': 1, 'zip_code': '10000'},
+            {'order_id': 'B5', 'quantity': -1, 'zip_code': '10000'},
+            {'order_id': 'B6', 'quantity': 1, 'zip_code': 'abc'},
+            {'order_id': 'B7', 'quantity': 500, 'zip_code': '10000'},
+            {'order_id': 'B8', 'quantity': 1, 'zip_code': '10000'},
+            {'order_id': 'B8', 'quantity': 1, 'zip_code': '10000'},
+        ])
+        self.assertEqual(response.status_code, 200)
+        results = response.data['results']
+        self.assertEqual([r['status'] for r in results], ['rejected'] * 4 + ['allocated', 'rejected'])
+        self.assertIn('Order_id já existe', str(results[0]['error']))
+        self.assertIn('Quantity deve ser um inteiro positivo', str(results[1]['error']))
+        self.assertIn('Zip_code deve ser numérico', str(results[2]['error']))
+        self.assertIn('sufficient stock', results[3]['error'])
+        self.assertIn('Order_id já existe', results[5]['error'])
+        self.assertEqual(response.data['rejected'], 5)
+
+    def test_non_ascii_digit_zip_is_rejected_per_order(self):
+        response = self.post_batch([
+            {'order_id': 'U1', 'quantity': 2, 'zip_code': '10000'},
+            {'order_id': 'U2', 'quantity': 2, 'zip_code': '\u00b2'},
+            {'order_id': 'U3', 'quantity': 2, 'zip_code': '10003'},
+        ])
+        self.assertEqual(response.status_code, 200)
+        results = response.data['results']
+        self.assertEqual([r['status'] for r in results], ['allocated', 'rejected', 'allocated'])
+        self.assertIn('Zip_code deve ser numérico', str(results[1]['error']))
+        self.assertEqual(Order.objects.count(), 2)
+
+    def test_unconvertible_zip_does_not_fail_the_batch(self):
+        # Past validation (e.g. a caller handing over its own data), the
+        # conversion is still guarded per order
+        from django.db import transaction
+        from allocation.views import _allocate_pending
+        results = [None, None]
+        pending = [(0, {'order_id': 'U4', 'quantity': 1, 'zip_code': '\u00b2'}),
+                   (1, {'order_id': 'U5', 'quantity': 1, 'zip_code': '10000'})]
+        with transaction.atomic():
+            _allocate_pending(pending, results, joint=False)
+        self.assertEqual(results[0]['status'], 'rejected')
+        self.assertIn('Value error', results[0]['error'])
+        self.assertEqual(results[1]['center_id'], 'C1')
+
+    def test_concurrent_duplicate_rejects_only_that_order(self):
+        from unittest import mock
+        from allocation import archive
+        from allocation.views import allocate_orders
+
+        def racing_insert(order_ids):
+            # Another request commits B10 between the duplicate check and the insert
+            Order.objects.create(order_id='B10', quantity=1, zip_code='10000', center=self.center1, status='allocated')
+            return set()
+
+        with mock.patch.object(archive, 'existing', side_effect=racing_insert):
+            results = allocate_orders([
+                {'order_id': 'B9', 'quantity': 2, 'zip_code': '10000'},
+                {'order_id': 'B10', 'quantity': 3, 'zip_code': '10000'},
+                {'order_id': 'B11', 'quantity': 4, 'zip_code': '10000'},
+            ])
+        self.assertEqual([r['status'] for r in results], ['allocated', 'rejected', 'allocated'])
+        self.assertIn('Order_id já existe', results[1]['error'])
+        self.center1.refresh_from_db()
+        self.assertEqual(self.center1.stock, 9)
+        self.assertEqual(Order.objects.get(order_id='B10').quantity, 1)
+        rollup = CenterDailyRollup.objects.get(center=self.center1)
+        self.assertEqual((rollup.order_count, rollup.total_quantity), (2, 6))
+
+    def test_batch_query_count_is_constant(self):
+        # Order n goes to center Z<n % centers>, each at its own zip code
+        def orders(prefix, n, centers):
+            return [{'order_id': f'{prefix}{i}', 'quantity': 1, 'zip_code': str(20000 + 10 * (i % centers))}
+                    for i in range(n)]
+
+        from django.db import connection
+        from django.test.utils import CaptureQueriesContext
+        for i in range(6):
+            DistributionCenter.objects.create(center_id=f'Z{i}', stock=100, initial_stock=100, zip_code=str(20000 + 10 * i))
+        self.post_batch(orders('W', 6, 6))  # creates today's rollup rows
+        with CaptureQueriesContext(connection) as small:
+            self.post_batch(orders('S', 2, 1))
+        with CaptureQueriesContext(connection) as large:
+            self.post_batch(orders('L', 12, 6))
+        self.assertEqual(len(small), len(large))
+        rollups = dict(CenterDailyRollup.objects.filter(center__center_id__startswith='Z').values_list(
+            'center__center_id', 'order_count'
+        ))
+        self.assertEqual(rollups, {'Z0': 5, 'Z1': 3, 'Z2': 3, 'Z3': 3, 'Z4': 3, 'Z5': 3})
+
+    def test_rollups_recorded_with_one_update(self):
+        from django.db import connection
+        from django.test.utils import CaptureQueriesContext
+        from allocation import rollups
+        rollups.record_allocations({self.center1.pk: (1, 5)})
+        with CaptureQueriesContext(connection) as queries:
+            rollups.record_allocations({self.center1.pk: (2, 3), self.center2.pk: (1, 4)})
+        self.assertEqual(sum(q['sql'].startswith('UPDATE') for q in queries), 1)
+        self.assertEqual(len(queries), 3)
+        totals = dict((c, (o, q)) for c, o, q in CenterDailyRollup.objects.values_list('center_id', 'order_count', 'total_quantity'))
+        self.assertEqual(totals, {self.center1.pk: (3, 8), self.center2.pk: (1, 4)})
+
+    def test_batch_rejects_bad_payload(self):
+        response = self.post_batch([])
+        self.assertEqual(response.status_code, 400)
+        with self.settings(ALLOCATION_BATCH_MAX_SIZE=1):
+            response = self.post_batch([
+                {'order_id': 'B9', 'quantity': 1, 'zip_code': '10000'},
+                {'order_id': 'B10', 'quantity': 1, 'zip_code': '10000'},
+            ])
+        self.assertEqual(response.status_code, 400)
+
+    def test_batch_requires_api_key(self):
+        # The key is checked by the authenticator, which force_authenticate skips
+        response = APIClient().post('/allocate/batch/', {'orders': []}, format='json', HTTP_API_KEY='wrong-key')
+        self.assertEqual(response.status_code, 401)
+
+
+class TestCenterSnapshot(TestCase):
+    def setUp(self):
+        from allocation import inventory
+        self.inventory = inventory
+        self.center1 = DistributionCenter.objects.create(center_id='C1', stock=15, initial_stock=100, zip_code='10000')
+        self.center2 = DistributionCenter.objects.create(center_id='C2', stock=8, initial_stock=50, zip_code='10003')
+        self.center3 = DistributionCenter.objects.create(center_id='C3', stock=30, initial_stock=50, zip_code='10010')
+
+    def test_nearest_bisects_and_skips_low_stock(self):
+        snapshot = self.inventory.get_snapshot()
+        self.assertEqual(snapshot.nearest(10003, 5), self.center2.pk)
+        self.assertEqual(snapshot.nearest(10003, 10), self.center1.pk)
+        self.assertEqual(snapshot.nearest(10009, 20), self.center3.pk)
+        self.assertEqual(snapshot.nearest(99999, 1), self.center3.pk)
+        self.assertEqual(snapshot.nearest(0, 1), self.center1.pk)
+        self.assertIsNone(snapshot.nearest(10003, 31))
+
+    def test_nearest_tie_prefers_lowest_pk(self):
+        snapshot = self.inventory.CenterSnapshot([self.center3, self.center1])
+        self.assertEqual(snapshot.nearest(10005, 1), self.center1.pk)
+
+    def test_snapshot_invalidated_on_center_changes(self):
+        snapshot = self.inventory.get_snapshot()
+        self.assertIs(self.inventory.get_snapshot(), snapshot)
+        center4 = DistributionCenter.objects.create(center_id='C4', stock=5, initial_stock=5, zip_code='10004')
+        snapshot = self.inventory.get_snapshot()
+        self.assertEqual(snapshot.nearest(10004, 1), center4.pk)
+        # Replenishing stock forces a rebuild; decrements are applied in place
+        self.center2.stock = 40
+        self.center2.save()
+        self.assertIsNot(self.inventory.get_snapshot(), snapshot)
+        snapshot = self.inventory.get_snapshot()
+        self.center2.stock = 20
+        self.center2.save()
+        self.assertIs(self.inventory.get_snapshot(), snapshot)
+        self.assertEqual(snapshot.stock(self.center2.pk), 20)
+
+    def test_populate_centers_invalidates_snapshot(self):
+        from django.core.management import call_command
+        snapshot = self.inventory.get_snapshot()
+        call_command('populate_centers', '--reset', stdout=open(os.devnull, 'w'))
+        self.assertIsNot(self.inventory.get_snapshot(), snapshot)
+        self.assertEqual(len(self.inventory.get_snapshot()), 3)
+
+    def test_allocation_skips_stale_snapshot_entry(self):
+        from allocation.views import allocate_order
+        self.inventory.get_snapshot()
+        # Another worker drained C2 without this process seeing it
+        DistributionCenter.objects.filter(pk=self.center2.pk).update(stock=0)
+        result = allocate_order({'order_id': 'S1', 'quantity': 5, 'zip_code': '10003'})
+        self.assertEqual(result['center_id'], 'C1')
+        self.center2.refresh_from_db()
+        self.assertEqual(self.center2.stock, 0)
+
+
+class TestConcurrentAllocation(TransactionTestCase):
+    THREADS = 8
+    ORDERS_PER_THREAD = 30
+
+    def setUp(self):
+        self.center1 = DistributionCenter.objects.create(center_id='C1', stock=100, initial_stock=100, zip_code='10000')
+        self.center2 = DistributionCenter.objects.create(center_id='C2', stock=60, initial_stock=60, zip_code='10003')
+
+    def test_concurrent_allocations_never_oversell(self):
+        import sys
+        import threading
+        import time
+        from django.db import connection
+        from allocation.views import allocate_order
+
+        results = []
+        lock = threading.Lock()
+
+        def worker(n):
+            try:
+                for i in range(self.ORDERS_PER_THREAD):
+                    result = allocate_order({'order_id': f'T{n}-{i}', 'quantity': 1, 'zip_code': '10001'})
+                    with lock:
+                        results.append(result)
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=worker, args=(n,)) for n in range(self.THREADS)]
+        started = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.perf_counter() - started
+
+        allocated = [r for r in results if 'center_id' in r]
+        errors = [r for r in results if 'error' in r]
+        self.assertEqual(len(results), self.THREADS * self.ORDERS_PER_THREAD)
+        # Demand (240) exceeds supply (160): every unit is sold exactly once
+        self.assertEqual(len(allocated), 160)
+        self.assertTrue(all('sufficient stock' in r['error'] for r in errors))
+        self.center1.refresh_from_db()
+        self.center2.refresh_from_db()
+        self.assertEqual((self.center1.stock, self.center2.stock), (0, 0))
+        self.assertEqual(Order.objects.filter(center=self.center1).count(), 100)
+        self.assertEqual(Order.objects.filter(center=self.center2).count(), 60)
+        sys.stderr.write(f'\n{len(results) / elapsed:.0f} allocations/sec across {self.THREADS} threads\n')
+
+
+class TestBufferedSink(TestCase):
+    def setUp(self):
+        import tempfile
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+
+    def make_sink(self, **kwargs):
+        from allocation.sinks import BufferedSink
+        sink = BufferedSink(self.tmp.name, 'test', **kwargs)
+        self.addCleanup(sink.close)
+        return sink
+
+    def read_segments(self):
+        import glob
+        import gzip
+        import json
+        records = []
+        paths = sorted(glob.glob(os.path.join(self.tmp.name, '*')))
+        for path in paths:
+            opener = gzip.open if path.endswith('.gz') else open
+            with opener(path, 'rt') as f:
+                records.extend(json.loads(line) for line in f)
+        return paths, records
+
+    def test_records_appended_as_ndjson(self):
+        sink = self.make_sink()
+        for i in range(10):
+            self.assertTrue(sink.emit({'order_id': f'O{i}'}))
+        sink.flush()
+        paths, records = self.read_segments()
+        self.assertEqual(len(paths), 1)
+        self.assertEqual([r['order_id'] for r in records], [f'O{i}' for i in range(10)])
+        self.assertEqual(sink.stats()['written'], 10)
+
+    def test_segments_rotate_by_size_and_compress(self):
+        sink = self.make_sink(segment_max_bytes=50, batch_size=1, compress=True)
+        for i in range(6):
+            sink.emit({'order_id': f'O{i}', 'center_id': 'C1'})
+        sink.close()
+        paths, records = self.read_segments()
+        self.assertGreater(len(paths), 1)
+        self.assertTrue(all(p.endswith('.ndjson.gz') for p in paths))
+        self.assertEqual(len(records), 6)
+
+    def test_full_queue_drops_and_reports_backpressure(self):
+        import threading
+        sink = self.make_sink(queue_size=1, block_timeout=0.01)
+        gate = threading.Event()
+        self.addCleanup(gate.set)
+        sink._write = lambda records: gate.wait()
+        results = [sink.emit({'n': i}) for i in range(5)]
+        self.assertIn(False, results)
+        stats = sink.stats()
+        self.assertGreater(stats['dropped'], 0)
+        self.assertGreaterEqual(stats['blocked'], stats['dropped'])
+
+    def test_close_flushes_pending_records(self):
+        sink = self.make_sink(flush_interval=60)
+        sink.emit({'order_id': 'O1'})
+        sink.close()
+        _, records = self.read_segments()
+        self.assertEqual(records, [{'order_id': 'O1'}])
+
+
+
+class TestSinkStorage(TestCase):
+    class FakeClient:
+        def __init__(self):
+            self.calls = []
+
+        def __getattr__(self, name):
+            return lambda **kwargs: self.calls.append((name, kwargs))
+
+    def make_sink(self, storage, **kwargs):
+        from allocation.sinks import BufferedSink
+        sink = BufferedSink(storage, 'test', **kwargs)
+        self.addCleanup(sink.close)
+        return sink
+
+    def test_boto3_not_imported_at_startup(self):
+        import sys
+        from django.urls import get_resolver
+        get_resolver().url_patterns  # imports every view
+        self.assertNotIn('boto3', sys.modules)
+
+    def test_sink_uses_backend_from_settings(self):
+        from allocation import sinks
+        config = {'sink-test': {'BACKEND': 'memory'}}
+        with override_settings(LOG_SINK_STORAGES=config):
+            sink = sinks.get_sink('sink-test')
+        self.addCleanup(lambda: sinks._sinks.pop('sink-test').close())
+        sink.emit({'order_id': 'O1'})
+        sink.flush()
+        self.assertEqual([json.loads(line) for line in sink.storage.lines()], [{'order_id': 'O1'}])
+
+    def test_s3_uploads_one_object_per_segment(self):
+        import gzip
+        from allocation.storage import S3Storage
+        storage = S3Storage('bucket', prefix='orders/')
+        storage._client = client = self.FakeClient()
+        sink = self.make_sink(storage, compress=True)
+        sink.emit({'order_id': 'O1'})
+        sink.emit({'order_id': 'O2'})
+        sink.close()
+        self.assertEqual(len(client.calls), 1)
+        method, kwargs = client.calls[0]
+        self.assertEqual((method, kwargs['Bucket']), ('put_object', 'bucket'))
+        self.assertTrue(kwargs['Key'].startswith('orders/test-') and kwargs['Key'].endswith('.ndjson.gz'))
+        lines = gzip.decompress(kwargs['Body']).decode().splitlines()
+        self.assertEqual([json.loads(line)['order_id'] for line in lines], ['O1', 'O2'])
+
+    def test_cloudwatch_puts_each_batch(self):
+        from allocation.storage import CloudWatchStorage
+        storage = CloudWatchStorage('fanatics-alerts')
+        storage._client = client = self.FakeClient()
+        sink = self.make_sink(storage)
+        sink.emit({'center_id': 'C1'})
+        sink.flush()
+        self.assertEqual([method for method, _ in client.calls], ['create_log_stream', 'put_log_events'])
+        events = client.calls[1][1]['logEvents']
+        self.assertEqual([json.loads(event['message']) for event in events], [{'center_id': 'C1'}])
+
+    def test_failing_backend_counts_records_and_keeps_writing(self):
+        from allocation.storage import MemoryStorage
+
+        class Flaky(MemoryStorage):
+            fail = True
+
+            def open_segment(self, name, compress=False):
+                if self.fail:
+                    self.fail = False
+                    raise OSError('unavailable')
+                return super().open_segment(name, compress)
+
+        storage = Flaky()
+        sink = self.make_sink(storage)
+        with self.assertLogs('allocation.sinks', 'ERROR'):
+            sink.emit({'n': 1})
+            sink.flush()
+        sink.emit({'n': 2})
+        sink.flush()
+        self.assertEqual(sink.stats()['failed'], 1)
+        self.assertEqual([json.loads(line) for line in storage.lines()], [{'n': 2}])
+
+class TestAnalyticsRollups(TestCase):
+    def setUp(self):
+        self.client = logged_in_client('rollup')
+        self.center1 = DistributionCenter.objects.create(center_id='C1', stock=15, initial_stock=100, zip_code='10000')
+        self.center2 = DistributionCenter.objects.create(center_id='C2', stock=8, initial_stock=50, zip_code='10003')
+
+    def rollup_totals(self):
+        from allocation.models import CenterDailyRollup
+        return {
+            (r.center.center_id, r.day): (r.order_count, r.total_quantity)
+            for r in CenterDailyRollup.objects.select_related('center')
+        }
+
+    def test_allocations_update_rollups(self):
+        from allocation.views import allocate_order, allocate_orders
+        allocate_order({'order_id': 'R1', 'quantity': 3, 'zip_code': '10000'})
+        allocate_order({'order_id': 'R2', 'quantity': 2, 'zip_code': '10000'})
+        allocate_orders([
+            {'order_id': 'R3', 'quantity': 1, 'zip_code': '10003'},
+            {'order_id': 'R4', 'quantity': 4, 'zip_code': '10003'},
+        ])
+        today = timezone.localdate()
+        self.assertEqual(self.rollup_totals(), {('C1', today): (2, 5), ('C2', today): (2, 5)})
+
+    def test_rebuild_rollups_command(self):
+        from django.core.management import call_command
+        Order.objects.create(order_id='R5', quantity=5, zip_code='10001', center=self.center1, status='allocated')
+        Order.objects.create(order_id='R6', quantity=7, zip_code='10001', center=self.center1, status='allocated')
+        old = Order.objects.create(order_id='R7', quantity=2, zip_code='10001', center=self.center2, status='allocated')
+        Order.objects.filter(pk=old.pk).update(created_at=timezone.now() - timedelta(days=60))
+        Order.objects.create(order_id='R8', quantity=9, zip_code='10001', center=self.center2, status='pending')
+        call_command('rebuild_rollups', stdout=open(os.devnull, 'w'))
+        today = timezone.localdate()
+        self.assertEqual(self.rollup_totals(), {
+            ('C1', today): (2, 12),
+            ('C2', (timezone.now() - timedelta(days=60)).date()): (1, 2),
+        })
+
+        response = self.client.get('/analytics/')
+        by_center = {row['center_id']: row for row in response.data}
+        self.assertEqual((by_center['C1']['total_orders'], by_center['C1']['total_quantity']), (2, 12))
+        self.assertEqual(by_center['C2']['total_orders'], 0)
+
+    def test_analytics_query_count_independent_of_history(self):
+        from django.db import connection
+        from django.test.utils import CaptureQueriesContext
+        from allocation.views import allocate_orders
+        allocate_orders([{'order_id': f'H{i}', 'quantity': 1, 'zip_code': '10000'} for i in range(10)])
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get('/analytics/')
+        self.assertEqual(len(queries), 1)
+        self.assertNotIn('"orders"', queries[0]['sql'])
+        by_center = {row['center_id']: row for row in response.data}
+        self.assertEqual(by_center['C1']['total_orders'], 10)
+
+    def test_analytics_invalid_from_date(self):
+        response = self.client.get('/analytics/?from_date=yesterday')
+        self.assertEqual(response.status_code, 400)
+
+
+class TestAnalyticsCache(TestCase):
+    def setUp(self):
+        self.client = logged_in_client('cache')
+        self.center1 = DistributionCenter.objects.create(center_id='C1', stock=15, initial_stock=100, zip_code='10000')
+
+    def get(self, url='/analytics/', **headers):
+        return self.client.get(url, **headers)
+
+    def test_repeated_polls_served_from_cache(self):
+        first = self.get()
+        self.assertEqual(first.status_code, 200)
+        self.assertIn('ETag', first)
+        with self.assertNumQueries(0):
+            second = self.get()
+        self.assertEqual(second.data, first.data)
+        self.assertEqual(second['ETag'], first['ETag'])
+        self.assertNotEqual(self.get('/analytics/?from_date=2020-01-01')['ETag'], first['ETag'])
+
+    def test_if_none_match_returns_304_until_stock_changes(self):
+        from allocation.views import allocate_order
+        etag = self.get()['ETag']
+        with self.assertNumQueries(0):
+            response = self.get(HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+
+        allocate_order({'order_id': 'E1', 'quantity': 1, 'zip_code': '10000'})
+        response = self.get(HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+        self.assertEqual(response.data[0]['total_orders'], 1)
+
+    def test_errors_are_not_cached(self):
+        self.assertEqual(self.get('/analytics/?from_date=bad').status_code, 400)
+        self.assertEqual(self.get('/analytics/?from_date=bad').status_code, 400)
+
+
+class TestAnalyticsPagination(TestCase):
+    def setUp(self):
+        self.client = logged_in_client('pages')
+        for i in range(5):
+            DistributionCenter.objects.create(center_id=f'C{i}', stock=10, initial_stock=10, zip_code=f'1000{i}')
+
+    def get(self, query):
+        return self.client.get('/analytics/' + query)
+
+    def test_keyset_pagination_walks_every_center_once(self):
+        seen = []
+        query = '?limit=2'
+        pages = 0
+        while True:
+            response = self.get(query)
+            self.assertEqual(response.status_code, 200)
+            self.assertLessEqual(len(response.data['results']), 2)
+            seen.extend(row['center_id'] for row in response.data['results'])
+            pages += 1
+            if response.data['next_cursor'] is None:
+                break
+            query = f"?limit=2&cursor={response.data['next_cursor']}"
+        self.assertEqual(seen, [f'C{i}' for i in range(5)])
+        self.assertEqual(pages, 3)
+
+    def test_pagination_rejects_bad_parameters(self):
+        self.assertEqual(self.get('?cursor=%%%').status_code, 400)
+        self.assertEqual(self.get('?limit=0').status_code, 400)
+        self.assertEqual(self.get('?limit=abc').status_code, 400)
+
+    def test_unpaginated_request_keeps_list_response(self):
+        response = self.get('')
+        self.assertEqual(len(response.data), 5)
+
+    def test_stream_mode_emits_ndjson(self):
+        import json
+        response = self.get('?stream=1')
+        self.assertTrue(response.streaming)
+        self.assertEqual(response['Content-Type'], 'application/x-ndjson')
+        rows = [json.loads(line) for line in b''.join(response.streaming_content).splitlines()]
+        self.assertEqual([row['center_id'] for row in rows], [f'C{i}' for i in range(5)])
+        self.assertEqual(rows[0]['total_orders'], 0)
+
+
+class TestOrderTrends(TestCase):
+    def setUp(self):
+        self.client = logged_in_client('trends')
+        self.center1 = DistributionCenter.objects.create(center_id='C1', stock=15, initial_stock=100, zip_code='10000')
+        self.center2 = DistributionCenter.objects.create(center_id='C2', stock=8, initial_stock=50, zip_code='10003')
+        self.base = timezone.now().replace(minute=0, second=0, microsecond=0) - timedelta(days=1)
+        for i, (center, hours, quantity, status) in enumerate([
+            (self.center1, 0, 2, 'allocated'),
+            (self.center1, 0, 3, 'allocated'),
+            (self.center1, 2, 4, 'allocated'),
+            (self.center2, 1, 5, 'allocated'),
+            (self.center2, 1, 9, 'pending'),
+        ]):
+            order = Order.objects.create(order_id=f'TR{i}', quantity=quantity, zip_code='10001', center=center, status=status)
+            Order.objects.filter(pk=order.pk).update(created_at=self.base + timedelta(hours=hours, minutes=10))
+
+    def get(self, query):
+        return self.client.get('/analytics/trends/' + query)
+
+    def test_hourly_buckets_per_center(self):
+        start = (self.base - timedelta(hours=1)).isoformat().replace('+00:00', '')
+        response = self.get(f'?interval=hour&from_date={start}')
+        self.assertEqual(response.status_code, 200)
+        rows = [(r['center_id'], r['bucket'], r['total_orders'], r['total_quantity']) for r in response.data]
+        self.assertEqual(rows, [
+            ('C1', self.base, 2, 5),
+            ('C1', self.base + timedelta(hours=2), 1, 4),
+            ('C2', self.base + timedelta(hours=1), 1, 5),
+        ])
+
+    def test_daily_buckets_filtered_by_center(self):
+        response = self.get('?interval=day&center_id=C1')
+        self.assertEqual(sum(r['total_orders'] for r in response.data), 3)
+        self.assertEqual({r['center_id'] for r in response.data}, {'C1'})
+
+    def test_invalid_parameters(self):
+        self.assertEqual(self.get('?interval=month').status_code, 400)
+        self.assertEqual(self.get('?from_date=nope').status_code, 400)
+        self.assertEqual(self.get('?from_date=2030-01-02&to_date=2030-01-01').status_code, 400)
+
+    def test_trend_queries_use_composite_indexes(self):
+        from allocation.views import order_trends
+        end = timezone.now()
+        start = end - timedelta(days=7)
+        plan = order_trends(start, end, 'hour').explain()
+        self.assertIn('orders_status_created_idx', plan)
+        plan = order_trends(start, end, 'hour', center_id='C1').explain()
+        self.assertRegex(plan, 'orders_(center|status)_created_idx')
+
+
+class TestRequestInstrumentation(TestCase):
+    def setUp(self):
+        self.api_key = issue_api_key('timing')
+        self.center1 = DistributionCenter.objects.create(center_id='C1', stock=15, initial_stock=100, zip_code='10000')
+
+    def post(self):
+        # Through ApiKeyAuthentication, so the auth stage is timed
+        return APIClient().post('/allocate/', {
+            'order_id': 'P1',
+            'quantity': 1,
+            'zip_code': '10000'
+        }, format='json', HTTP_API_KEY=self.api_key)
+
+    def test_server_timing_header_reports_stages_and_sql(self):
+        with self.settings(REQUEST_TIMING_ENABLED=True, SLOW_REQUEST_THRESHOLD_MS=10 ** 6):
+            response = self.post()
+        self.assertEqual(response.status_code, 200)
+        metrics = {item.split(';')[0].strip(): item for item in response['Server-Timing'].split(',')}
+        for name in ('auth', 'validate', 'locate', 'reserve', 'log', 'db', 'total'):
+            self.assertIn(name, metrics)
+        self.assertRegex(metrics['db'], r'desc="\d+ queries"')
+
+    def test_slow_requests_are_logged(self):
+        with self.settings(REQUEST_TIMING_ENABLED=True, SLOW_REQUEST_THRESHOLD_MS=0):
+            with self.assertLogs('allocation.slow_requests', level='WARNING') as logs:
+                self.post()
+        self.assertIn('"path": "/allocate/"', logs.output[0])
+
+    def test_disabled_instrumentation_adds_no_header(self):
+        from allocation.instrumentation import stage
+        with self.settings(REQUEST_TIMING_ENABLED=False):
+            response = self.post()
+        self.assertNotIn('Server-Timing', response)
+        self.assertIs(stage('locate'), stage('reserve'))
+
+
+class TestMetricsEndpoint(TestCase):
+    def setUp(self):
+        self.client = logged_in_client('metrics')
+        self.center1 = DistributionCenter.objects.create(center_id='C1', stock=20, initial_stock=100, zip_code='10000')
+
+    def scrape(self):
+        response = self.client.get('/metrics/')
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response['Content-Type'].startswith('text/plain'))
+        samples = {}
+        for line in response.content.decode().splitlines():
+            if not line.startswith('#'):
+                name, value = line.rsplit(' ', 1)
+                samples[name] = float(value)
+        return samples
+
+    def allocate(self, order_id, quantity):
+        return self.client.post('/allocate/', {
+            'order_id': order_id,
+            'quantity': quantity,
+            'zip_code': '10000'
+        }, format='json')
+
+    def test_outcome_histograms_and_gauges(self):
+        from allocation import alerts
+        # Alerts are counted when the engine publishes its batch
+        alerts.flush()
+        before = self.scrape()
+        self.allocate('M1', 5)
+        self.allocate('M2', 500)
+        self.allocate('M3', -1)
+        alerts.flush()
+        after = self.scrape()
+
+        def delta(name):
+            return after[name] - before.get(name, 0)
+
+        for outcome in ('allocated', 'no_stock', 'validation_error'):
+            self.assertEqual(delta(f'allocation_request_duration_seconds_count{{outcome="{outcome}"}}'), 1)
+            self.assertEqual(delta(f'allocation_request_duration_seconds_bucket{{outcome="{outcome}",le="+Inf"}}'), 1)
+        self.assertEqual(delta('allocation_low_stock_alerts_total'), 1)
+        self.assertEqual(after['allocation_center_stock{center_id="C1"}'], 15)
+        self.assertEqual(after['allocation_center_low_stock{center_id="C1"}'], 1)
+
+    def test_metrics_merged_across_processes(self):
+        import json
+        import tempfile
+        from allocation import alerts, metrics
+        alerts.flush()
+        with tempfile.TemporaryDirectory() as directory, self.settings(METRICS_DIR=directory):
+            other = metrics.local_totals()
+            other['pid'] = -1
+            other['alerts'] = 7
+            other['histogram']['allocated']['buckets'][0] = 3
+            other['queues'] = {'orders': 4}
+            with open(os.path.join(directory, 'other.json'), 'w') as f:
+                json.dump(other, f)
+            local = metrics.local_totals()
+            samples = self.scrape()
+        self.assertEqual(samples['allocation_low_stock_alerts_total'], local['alerts'] + 7)
+        self.assertEqual(
+            samples['allocation_request_duration_seconds_bucket{outcome="allocated",le="0.001"}'],
+            local['histogram']['allocated']['buckets'][0] + 3
+        )
+        self.assertGreaterEqual(samples['allocation_sink_queue_depth{sink="orders"}'], 4)
+
+    def test_recording_is_thread_safe(self):
+        import threading
+        from allocation import metrics
+        before = metrics.local_totals()['histogram']['error']['buckets'][0]
+
+        def worker():
+            for _ in range(1000):
+                metrics.observe_allocation('error', 0.0001)
+
+        threads = [threading.Thread(target=worker) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(metrics.local_totals()['histogram']['error']['buckets'][0] - before, 4000)
+
+
+    def test_dead_thread_shards_are_folded_and_dropped(self):
+        import threading
+        from allocation import metrics
+        before = metrics.local_totals()['histogram']['error']['buckets'][0]
+        threads = [threading.Thread(target=metrics.observe_allocation, args=('error', 0.0001)) for _ in range(20)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(metrics.local_totals()['histogram']['error']['buckets'][0] - before, 20)
+        self.assertFalse(any(shard.owner in threads for shard in metrics._shards))
+        self.assertEqual(metrics.local_totals()['histogram']['error']['buckets'][0] - before, 20)
+
+    def test_flusher_survives_a_failed_flush(self):
+        import tempfile
+        import threading
+        from unittest import mock
+        from allocation import metrics
+        calls = threading.Semaphore(0)
+
+        def flush():
+            calls.release()
+            raise OSError('disk full')
+
+        with tempfile.TemporaryDirectory() as directory, \
+                self.settings(METRICS_DIR=directory, METRICS_FLUSH_INTERVAL=0.01), \
+                mock.patch.object(metrics, 'flush', side_effect=flush), \
+                self.assertLogs('allocation.metrics', 'ERROR'):
+            metrics._start_flusher()
+            for _ in range(2):
+                self.assertTrue(calls.acquire(timeout=15))
+        self.assertTrue(metrics._flusher.is_alive())
+
+class TestBenchAllocationCommand(TransactionTestCase):
+    def run_bench(self, *args):
+        import io
+        import json
+        from django.core.management import call_command
+        out = io.StringIO()
+        call_command('bench_allocation', '--current-db', '--allow-wipe', '--centers', '10', '--requests', '20',
+                     '--concurrency', '2', '--scenarios', 'allocate_order', *args, stdout=out)
+        return json.loads(out.getvalue())
+
+    def test_reports_latency_throughput_and_queries(self):
+        report = self.run_bench()
+        result = report['scenarios']['allocate_order']
+        self.assertEqual(result['requests'], 20)
+        self.assertEqual(result['errors'], 0)
+        for key in ('throughput_rps', 'p50_ms', 'p95_ms', 'p99_ms', 'queries_per_request'):
+            self.assertGreater(result[key], 0)
+        self.assertLessEqual(result['p50_ms'], result['p99_ms'])
+        self.assertGreater(report['peak_rss_kb'], 0)
+        self.assertEqual(DistributionCenter.objects.count(), 10)
+
+    def test_current_db_requires_allow_wipe(self):
+        from django.core.management import call_command
+        from django.core.management.base import CommandError
+        DistributionCenter.objects.create(center_id='REAL', stock=5, initial_stock=5, zip_code='10000')
+        with self.assertRaises(CommandError):
+            call_command('bench_allocation', '--current-db', '--requests', '1', stdout=open(os.devnull, 'w'))
+        self.assertTrue(DistributionCenter.objects.filter(center_id='REAL').exists())
+
+    def test_baseline_regressions_are_flagged(self):
+        import json
+        import tempfile
+        from django.core.management.base import CommandError
+        baseline = {'scenarios': {'allocate_order': {
+            'throughput_rps': 10 ** 9, 'p95_ms': 10 ** -6, 'p99_ms': 10 ** -6, 'queries_per_request': 0.5
+        }}}
+        with tempfile.NamedTemporaryFile('w', suffix='.json', delete=False) as f:
+            json.dump(baseline, f)
+        self.addCleanup(os.remove, f.name)
+        report = self.run_bench('--baseline', f.name)
+        self.assertEqual(len(report['regressions']), 4)
+        with self.assertRaises(CommandError):
+            self.run_bench('--baseline', f.name, '--fail-on-regression')
+
+    @override_settings(PASSWORD_HASHERS=['django.contrib.auth.hashers.MD5PasswordHasher'])
+    def test_async_scenarios_compared_with_wsgi(self):
+        report = self.run_bench('--scenarios', 'allocate_view,allocate_async,analytics_async')
+        for name in ('allocate_view', 'allocate_async', 'analytics_async'):
+            result = report['scenarios'][name]
+            self.assertEqual((result['requests'], result['errors']), (20, 0))
+            self.assertEqual(result['peak_in_flight'], 2)
+            self.assertGreater(result['p99_ms'], 0)
+        self.assertIsNone(report['scenarios']['allocate_async']['queries_per_request'])
+        self.assertEqual(Order.objects.filter(order_id__startswith='allocate_async-').count(), 20)
+        # The run's key does not outlive it
+        from allocation.models import ApiKey
+        self.assertEqual(ApiKey.objects.filter(user__username='bench', revoked_at__isnull=True).count(), 0)
+
+
+class TestSyntheticDataGenerator(TestCase):
+    def generate(self, *args, reset=True):
+        import io
+        from django.core.management import call_command
+        out = io.StringIO()
+        call_command('populate_centers', '--generate', *(['--reset'] if reset else []), '--centers', '30', '--orders', '450',
+                     '--chunk-size', '100', '--chunks-per-transaction', '2', '--seed', '7',
+                     '--start-date', '2025-01-01', '--end-date', '2025-03-01', *args, stdout=out)
+        return out.getvalue()
+
+    def test_generates_centers_and_spread_order_history(self):
+        from django.db.models import Max, Min, Sum
+        from allocation.models import CenterDailyRollup
+        output = self.generate()
+        self.assertIn('pedidos: 450/450', output)
+        self.assertIn('pedidos: 200/450', output)
+        self.assertEqual(DistributionCenter.objects.count(), 30)
+        self.assertEqual(Order.objects.count(), 450)
+        bounds = Order.objects.aggregate(first=Min('created_at'), last=Max('created_at'))
+        self.assertGreaterEqual(bounds['first'].date().isoformat(), '2025-01-01')
+        self.assertLess(bounds['last'].date().isoformat(), '2025-03-01')
+        self.assertGreater((bounds['last'] - bounds['first']).days, 30)
+        self.assertEqual(CenterDailyRollup.objects.aggregate(n=Sum('order_count'))['n'], 450)
+        # Regular allocations still get a creation timestamp
+        self.assertTrue(Order._meta.get_field('created_at').auto_now_add)
+
+    def test_generation_is_reproducible(self):
+        self.generate()
+        first = list(Order.objects.order_by('order_id').values_list('order_id', 'quantity', 'zip_code', 'center__center_id', 'created_at')[:20])
+        centers = list(DistributionCenter.objects.order_by('center_id').values_list('center_id', 'stock', 'zip_code'))
+        self.generate()
+        self.assertEqual(first, list(Order.objects.order_by('order_id').values_list('order_id', 'quantity', 'zip_code', 'center__center_id', 'created_at')[:20]))
+        self.assertEqual(centers, list(DistributionCenter.objects.order_by('center_id').values_list('center_id', 'stock', 'zip_code')))
+
+    def test_invalid_date_range(self):
+        from django.core.management.base import CommandError
+        with self.assertRaises(CommandError):
+            self.generate('--start-date', '2025-04-01')
+
+    def test_rerun_without_reset_continues_numbering(self):
+        from django.db.models import Sum
+        from allocation.models import CenterDailyRollup
+        self.generate()
+        output = self.generate(reset=False)
+        self.assertIn('numeração continua em G000030', output)
+        self.assertEqual(DistributionCenter.objects.filter(center_id__startswith='G').count(), 60)
+        self.assertTrue(DistributionCenter.objects.filter(center_id='G000059').exists())
+        self.assertEqual(Order.objects.count(), 900)
+        self.assertTrue(Order.objects.filter(order_id='G7-0000000899').exists())
+        self.assertEqual(CenterDailyRollup.objects.aggregate(n=Sum('order_count'))['n'], 900)
+
+
+class TestImportOrdersCommand(TestCase):
+    def setUp(self):
+        import tempfile
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+        self.center1 = DistributionCenter.objects.create(center_id='C1', stock=15, initial_stock=100, zip_code='10000')
+        self.center2 = DistributionCenter.objects.create(center_id='C2', stock=8, initial_stock=50, zip_code='10003')
+        Order.objects.create(order_id='EXISTING', quantity=1, zip_code='10000', center=self.center1, status='allocated')
+
+    def run_import(self, name, content, *args):
+        import gzip
+        import io
+        from django.core.management import call_command
+        path = os.path.join(self.tmp.name, name)
+        opener = gzip.open if name.endswith('.gz') else open
+        with opener(path, 'wt', encoding='utf-8') as f:
+            f.write(content)
+        call_command('import_orders', path, '--chunk-size', '2', *args, stdout=io.StringIO())
+        with open(path + '.rejects.ndjson', encoding='utf-8') as f:
+            import json
+            return [json.loads(line) for line in f]
+
+    def test_gzip_csv_import_with_rejects(self):
+        rejects = self.run_import('orders.csv.gz', '\n'.join([
+            'order_id,quantity,zip_code',
+            'I1,5,10003',
+            'I2,-1,10000',
+            'I3,2,abc',
+            'EXISTING,1,10000',
+            'I1,1,10000',
+            'I4,500,10000',
+            'I5,10,10001',
+        ]) + '\n')
+        self.assertEqual(
+            sorted(Order.objects.exclude(order_id='EXISTING').values_list('order_id', 'center__center_id')),
+            [('I1', 'C2'), ('I5', 'C1')]
+        )
+        self.assertEqual([r['line'] for r in rejects], [3, 4, 5, 6, 7])
+        self.assertIn('Quantity deve ser um inteiro positivo', str(rejects[0]['error']))
+        self.assertIn('Zip_code deve ser numérico', str(rejects[1]['error']))
+        self.assertIn('Order_id já existe', rejects[2]['error'])
+        self.assertIn('Order_id já existe', rejects[3]['error'])
+        self.assertIn('sufficient stock', rejects[4]['error'])
+
+    def test_csv_line_numbers_follow_multiline_fields(self):
+        rejects = self.run_import('orders.csv', '\n'.join([
+            'order_id,quantity,zip_code',
+            '"M1',
+            'continued",1,10000',
+            '',
+            'M2,-1,10000',
+        ]) + '\n')
+        # M1's quoted order_id spans lines 2-3 and line 4 is blank, so M2 is
+        # the third record but sits on physical line 5
+        self.assertTrue(Order.objects.filter(order_id='M1\ncontinued').exists())
+        self.assertEqual([r['line'] for r in rejects], [5])
+
+    def test_bad_zip_row_is_rejected_and_import_continues(self):
+        rejects = self.run_import('orders.csv', '\n'.join([
+            'order_id,quantity,zip_code',
+            'Z1,1,10000',
+            'Z2,1,\u00b2',
+            'Z3,1,10003',
+            'Z4,1,10000',
+        ]) + '\n')
+        self.assertEqual(sorted(Order.objects.filter(order_id__startswith='Z').values_list('order_id', flat=True)),
+                         ['Z1', 'Z3', 'Z4'])
+        self.assertEqual([r['line'] for r in rejects], [3])
+        self.assertIn('Zip_code deve ser numérico', str(rejects[0]['error']))
+
+    def test_row_that_fails_the_chunk_is_rejected_alone(self):
+        from unittest import mock
+        from allocation.management.commands import import_orders
+        allocate_orders = import_orders.allocate_orders
+
+        def failing(rows):
+            if any(row['order_id'] == 'F2' for row in rows):
+                raise ValueError('boom')
+            return allocate_orders(rows)
+
+        with mock.patch.object(import_orders, 'allocate_orders', side_effect=failing):
+            rejects = self.run_import('orders.csv', 'order_id,quantity,zip_code\nF1,1,10000\nF2,1,10000\nF3,1,10000\n')
+        self.assertEqual(sorted(Order.objects.filter(order_id__startswith='F').values_list('order_id', flat=True)),
+                         ['F1', 'F3'])
+        self.assertEqual(rejects, [{'line': 3, 'row': {'order_id': 'F2', 'quantity': '1', 'zip_code': '10000'},
+                                    'error': 'Value error: boom'}])
+
+    def test_ndjson_import_rejects_malformed_lines(self):
+        rejects = self.run_import('orders.ndjson', '\n'.join([
+            '{"order_id": "N1", "quantity": 1, "zip_code": "10000"}',
+            '{not json',
+            '[1, 2]',
+            '',
+            '{"order_id": "N2", "quantity": 2}',
+        ]) + '\n')
+        self.assertTrue(Order.objects.filter(order_id='N1', status='allocated').exists())
+        self.assertEqual([r['line'] for r in rejects], [2, 3, 5])
+        self.assertIn('Invalid JSON', rejects[0]['error'])
+        self.assertIn('zip_code', rejects[2]['error'])
+
+    def test_uniqueness_checked_once_per_chunk(self):
+        from django.db import connection
+        from django.test.utils import CaptureQueriesContext
+        rows = '\n'.join(f'{{"order_id": "Q{i}", "quantity": 1, "zip_code": "10000"}}' for i in range(6))
+        with CaptureQueriesContext(connection) as queries:
+            self.run_import('orders.jsonl', rows + '\n')
+        lookups = [q for q in queries if q['sql'].startswith('SELECT "orders"."order_id"')]
+        self.assertEqual(len(lookups), 3)
+
+
+class TestIdempotencyKeys(TestCase):
+    def setUp(self):
+        from django.core.cache import caches
+        caches['idempotency'].clear()
+        self.client = logged_in_client('idem')
+        self.center1 = DistributionCenter.objects.create(center_id='C1', stock=15, initial_stock=100, zip_code='10000')
+
+    def post(self, data, key, url='/allocate/'):
+        return self.client.post(url, data, format='json', HTTP_IDEMPOTENCY_KEY=key)
+
+    def test_retry_replays_original_response(self):
+        data = {'order_id': 'K1', 'quantity': 5, 'zip_code': '10000'}
+        first = self.post(data, 'key-1')
+        self.assertEqual(first.status_code, 200)
+        with self.assertNumQueries(0):
+            retry = self.post(data, 'key-1')
+        self.assertEqual(retry.status_code, 200)
+        self.assertEqual(retry.data, first.data)
+        self.assertEqual(retry['Idempotent-Replayed'], 'true')
+        self.center1.refresh_from_db()
+        self.assertEqual(self.center1.stock, 10)
+
+        # Without the key the duplicate still goes through validation
+        response = self.client.post('/allocate/', data, format='json')
+        self.assertEqual(response.status_code, 400)
+
+    def test_key_reused_with_different_body(self):
+        self.post({'order_id': 'K2', 'quantity': 1, 'zip_code': '10000'}, 'key-2')
+        response = self.post({'order_id': 'K3', 'quantity': 1, 'zip_code': '10000'}, 'key-2')
+        self.assertEqual(response.status_code, 422)
+        self.assertFalse(Order.objects.filter(order_id='K3').exists())
+
+    def test_batch_retry_replayed(self):
+        data = {'orders': [{'order_id': 'KB1', 'quantity': 1, 'zip_code': '10000'}]}
+        first = self.post(data, 'batch-1', url='/allocate/batch/')
+        retry = self.post(data, 'batch-1', url='/allocate/batch/')
+        self.assertEqual(retry.data, first.data)
+        self.assertEqual(retry.data['allocated'], 1)
+
+    def test_concurrent_duplicate_waits_for_in_flight_request(self):
+        import threading
+        from types import SimpleNamespace
+        from rest_framework.response import Response
+        from allocation import idempotency
+
+        request = SimpleNamespace(user=SimpleNamespace(pk=1), data={'order_id': 'K4'})
+        started, release = threading.Event(), threading.Event()
+        calls = []
+
+        def handler():
+            calls.append(1)
+            started.set()
+            release.wait(5)
+            return Response({'order_id': 'K4', 'status': 'allocated'})
+
+        results = [None, None]
+
+        def first():
+            results[0] = idempotency.run(request, 'key-4', handler)
+
+        def duplicate():
+            results[1] = idempotency.run(request, 'key-4', handler)
+
+        threads = [threading.Thread(target=first), threading.Thread(target=duplicate)]
+        threads[0].start()
+        started.wait(5)
+        threads[1].start()
+        release.set()
+        for thread in threads:
+            thread.join(5)
+
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(results[0].data, results[1].data)
+        self.assertEqual(results[1]['Idempotent-Replayed'], 'true')
+
+    def test_server_errors_are_not_stored(self):
+        from types import SimpleNamespace
+        from rest_framework.response import Response
+        from allocation import idempotency
+
+        request = SimpleNamespace(user=SimpleNamespace(pk=1), data={'order_id': 'K5'})
+        idempotency.run(request, 'key-5', lambda: Response({'error': 'boom'}, status=500))
+        response = idempotency.run(request, 'key-5', lambda: Response({'status': 'allocated'}))
+        self.assertEqual(response.status_code, 200)
+
+
+class TestGeoRanking(TestCase):
+    CENTROIDS = [
+        ('10003', 34.05, -118.24),
+        ('10004', 40.70, -74.01),
+        ('30000', 40.71, -74.00),
+        ('30001', 40.71, -74.00),
+        ('50000', 41.88, -87.63),
+    ]
+
+    def setUp(self):
+        import tempfile
+        from django.core.management import call_command
+        from django.test import override_settings
+        from allocation import inventory
+        self.inventory = inventory
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        source = os.path.join(tmp.name, 'centroids.tsv')
+        with open(source, 'w') as f:
+            f.write('GEOID\tALAND\tINTPTLAT\tINTPTLONG   \n')
+            f.writelines(f'{zip_code}\t0\t{lat}\t{lon}\n' for zip_code, lat, lon in self.CENTROIDS)
+            f.write('bogus\t0\tx\ty\n')
+        path = os.path.join(tmp.name, 'zip_centroids.npy')
+        call_command('build_zip_centroids', source, '--output', path, stdout=open(os.devnull, 'w'))
+        override = override_settings(ZIP_CENTROIDS_PATH=path)
+        override.enable()
+        self.addCleanup(override.disable)
+        self.addCleanup(inventory.invalidate)
+        inventory.invalidate()
+
+        self.la = DistributionCenter.objects.create(center_id='LA', stock=50, initial_stock=100, zip_code='10003')
+        self.ny = DistributionCenter.objects.create(center_id='NY', stock=10, initial_stock=100, zip_code='30000')
+        self.chi = DistributionCenter.objects.create(center_id='CHI', stock=50, initial_stock=100, zip_code='50000')
+
+    def test_nearest_uses_great_circle_distance(self):
+        snapshot = self.inventory.get_snapshot()
+        self.assertIsNotNone(snapshot.points)
+        # Numerically 10003 is next door, geographically it is across the country
+        self.assertEqual(snapshot.nearest(10004, 5), self.ny.pk)
+        self.assertEqual(snapshot.nearest(10004, 20), self.chi.pk)
+        self.assertIsNone(snapshot.nearest(10004, 51))
+
+    def test_unknown_zips_fall_back_to_numeric_distance(self):
+        snapshot = self.inventory.get_snapshot()
+        self.assertEqual(snapshot.nearest(10010, 1), self.la.pk)
+        unlocated = DistributionCenter.objects.create(center_id='X', stock=500, initial_stock=500, zip_code='10020')
+        snapshot = self.inventory.get_snapshot()
+        self.assertEqual(snapshot.nearest(10004, 5), self.ny.pk)
+        self.assertEqual(snapshot.nearest(10004, 100), unlocated.pk)
+
+    def test_equal_distance_prefers_lowest_pk(self):
+        twin = DistributionCenter.objects.create(center_id='NY2', stock=10, initial_stock=100, zip_code='30001')
+        snapshot = self.inventory.CenterSnapshot([twin, self.ny, self.la])
+        self.assertEqual(snapshot.nearest(10004, 1), self.ny.pk)
+
+    def test_reserve_many_matches_sequential_ranking(self):
+        import random
+        from types import SimpleNamespace
+        rng = random.Random(7)
+        centers = [
+            SimpleNamespace(pk=i, center_id=f'R{i}', zip_code=str(rng.choice([10003, 10004, 30000, 50000, 60000])),
+                            stock=rng.randint(0, 20))
+            for i in range(1, 30)
+        ]
+        requests = [(rng.choice([10003, 10004, 30001, 50000, 77777]), rng.randint(1, 6)) for _ in range(60)]
+
+        expected = []
+        sequential = self.inventory.CenterSnapshot(centers)
+        for zip_code, quantity in requests:
+            pk = sequential.nearest(zip_code, quantity)
+            if pk is not None:
+                sequential.set_stock(pk, sequential.stock(pk) - quantity)
+            expected.append(pk)
+
+        with self.settings(GEO_RANK_BLOCK_ELEMENTS=100):
+            self.assertEqual(self.inventory.CenterSnapshot(centers).reserve_many(requests), expected)
+
+    def test_batch_allocation_uses_geo_ranking(self):
+        from allocation.views import allocate_orders
+        results = allocate_orders([
+            {'order_id': 'G1', 'quantity': 8, 'zip_code': '10004'},
+            {'order_id': 'G2', 'quantity': 8, 'zip_code': '10004'},
+        ])
+        self.assertEqual([r['center_id'] for r in results], ['NY', 'CHI'])
+        self.ny.refresh_from_db()
+        self.assertEqual(self.ny.stock, 2)
+
+
+class TestMicroBatching(TestCase):
+    def setUp(self):
+        self.center1 = DistributionCenter.objects.create(center_id='A', stock=5, initial_stock=100, zip_code='10000')
+        self.center2 = DistributionCenter.objects.create(center_id='B', stock=5, initial_stock=100, zip_code='10010')
+
+    def test_regret_placement_beats_first_come_first_served(self):
+        from allocation import assignment
+        # Greedy gives order 0 its nearest center and sends order 1 far away
+        self.assertEqual(assignment.solve([[1, 2], [1, 100]], [5, 5], [5, 5]), [1, 0])
+        self.assertEqual(assignment.solve([[1, 2], [1, 100]], [5, 9], [5, 5]), [0, None])
+
+    def test_assignment_respects_capacity(self):
+        import random
+        from allocation import assignment
+        rng = random.Random(3)
+        for _ in range(20):
+            m, n = rng.randint(1, 12), rng.randint(1, 6)
+            costs = [[rng.random() * 100 for _ in range(n)] for _ in range(m)]
+            quantities = [rng.randint(1, 5) for _ in range(m)]
+            capacities = [rng.randint(0, 10) for _ in range(n)]
+            choice = assignment.solve(costs, quantities, capacities, candidates=2)
+            used = [0] * n
+            for i, j in enumerate(choice):
+                if j is not None:
+                    used[j] += quantities[i]
+            self.assertTrue(all(u <= c for u, c in zip(used, capacities)))
+
+    def test_joint_batch_minimises_total_distance(self):
+        from allocation.views import allocate_orders
+        orders = [
+            {'order_id': 'J1', 'quantity': 5, 'zip_code': '10004'},
+            {'order_id': 'J2', 'quantity': 5, 'zip_code': '09990'},
+        ]
+        results = allocate_orders(orders, joint=True)
+        self.assertEqual([r['center_id'] for r in results], ['B', 'A'])
+        results = allocate_orders([dict(o, order_id=o['order_id'] + 'x') for o in orders])
+        self.assertEqual([r['status'] for r in results], ['rejected', 'rejected'])
+
+    def test_concurrent_requests_share_one_window(self):
+        import threading
+        from allocation.microbatch import MicroBatcher
+        windows = []
+
+        def handler(batch):
+            windows.append(list(batch))
+            return [{'echo': data} for data in batch]
+
+        batcher = MicroBatcher(handler)
+        results = {}
+
+        def submit(n):
+            results[n] = batcher.submit(n)
+
+        with self.settings(ALLOCATION_MICROBATCH_WINDOW_MS=2000, ALLOCATION_MICROBATCH_MAX_SIZE=3):
+            threads = [threading.Thread(target=submit, args=(n,)) for n in range(5)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join(10)
+
+        self.assertEqual(results, {n: {'echo': n} for n in range(5)})
+        self.assertEqual(sorted(len(window) for window in windows), [2, 3])
+
+    def test_bad_order_fails_alone_in_its_window(self):
+        import threading
+        from allocation.microbatch import MicroBatcher, _prepare_order
+        windows = []
+
+        def handler(batch):
+            # Raises for the whole window if a bad zip reaches it
+            windows.append([data['order_id'] for data in batch])
+            return [{'zip': int(data['zip_code'])} for data in batch]
+
+        batcher = MicroBatcher(handler, _prepare_order)
+        zips = {'W1': '10000', 'W2': '\u00b2', 'W3': '10001', 'W4': '10002'}
+        results = {}
+
+        def submit(order_id):
+            results[order_id] = batcher.submit({'order_id': order_id, 'quantity': 1, 'zip_code': zips[order_id]})
+
+        with self.settings(ALLOCATION_MICROBATCH_WINDOW_MS=500, ALLOCATION_MICROBATCH_MAX_SIZE=3):
+            threads = [threading.Thread(target=submit, args=(order_id,)) for order_id in zips]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join(10)
+
+        self.assertIn('Value error', results['W2']['error'])
+        self.assertEqual({k: v for k, v in results.items() if k != 'W2'},
+                         {'W1': {'zip': 10000}, 'W3': {'zip': 10001}, 'W4': {'zip': 10002}})
+        self.assertEqual(sorted(sum(windows, [])), ['W1', 'W3', 'W4'])
+
+    def test_allocate_view_in_microbatch_mode(self):
+        client = logged_in_client('batcher')
+        with self.settings(ALLOCATION_MICROBATCH_ENABLED=True, ALLOCATION_MICROBATCH_WINDOW_MS=1):
+            response = client.post('/allocate/', {'order_id': 'M1', 'quantity': 3, 'zip_code': '10001'}, format='json')
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(response.data, {'order_id': 'M1', 'center_id': 'A', 'status': 'allocated'})
+            response = client.post('/allocate/', {'order_id': 'M2', 'quantity': 6, 'zip_code': '10001'}, format='json')
+            self.assertEqual(response.status_code, 400)
+            self.assertEqual(response.data, {'error': 'No distribution center with sufficient stock'})
+
+
+class TestAsyncViews(TestCase):
+    def setUp(self):
+        from django.test import AsyncClient
+        self.auth = {'Api-Key': issue_api_key('async')}
+        self.client = AsyncClient()
+        self.center1 = DistributionCenter.objects.create(center_id='C1', stock=15, initial_stock=100, zip_code='10000')
+        self.center2 = DistributionCenter.objects.create(center_id='C2', stock=8, initial_stock=50, zip_code='10003')
+
+    async def post(self, data, **headers):
+        return await self.client.post('/async/allocate/', data, content_type='application/json',
+                                      headers={**self.auth, **headers})
+
+    async def test_allocate_matches_sync_view(self):
+        response = await self.post({'order_id': 'A1', 'quantity': 5, 'zip_code': '10003'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json(), {'order_id': 'A1', 'center_id': 'C2', 'status': 'allocated'})
+        center = await DistributionCenter.objects.aget(pk=self.center2.pk)
+        self.assertEqual(center.stock, 3)
+        rollup = await CenterDailyRollup.objects.aget(center=self.center2)
+        self.assertEqual((rollup.order_count, rollup.total_quantity), (1, 5))
+
+        response = await self.post({'order_id': 'A1', 'quantity': 1, 'zip_code': '10003'})
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.json(), {'order_id': ['order with this order id already exists.']})
+        response = await self.post({'order_id': 'A2', 'quantity': 500, 'zip_code': '10003'})
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.json(), {'error': 'No distribution center with sufficient stock'})
+        response = await self.post({'order_id': 'A3', 'quantity': -1, 'zip_code': '10003'})
+        self.assertIn('Quantity deve ser um inteiro positivo', str(response.json()))
+
+    async def test_low_stock_alert_emitted(self):
+        await self.post({'order_id': 'A4', 'quantity': 7, 'zip_code': '10003'})
+        alerts = await sync_to_async(sink_records)('alerts')
+        self.assertTrue(any(record['center_id'] == 'C2' for record in alerts))
+
+    async def test_authentication_required(self):
+        response = await self.client.post('/async/allocate/', {'order_id': 'A5', 'quantity': 1, 'zip_code': '10000'},
+                                          content_type='application/json')
+        self.assertEqual(response.status_code, 401)
+        self.assertIn('WWW-Authenticate', response)
+        response = await self.post({'order_id': 'A5', 'quantity': 1, 'zip_code': '10000'}, **{'Api-Key': 'wrong'})
+        self.assertEqual(response.status_code, 401)
+        response = await self.client.get('/async/allocate/', headers=self.auth)
+        self.assertEqual(response.status_code, 405)
+
+    async def test_analytics_matches_sync_view(self):
+        sync_client = APIClient()
+        sync_client.force_authenticate(await User.objects.aget(username='async'))
+        expected = await sync_to_async(lambda: sync_client.get('/analytics/').json())()
+
+        response = await self.client.get('/async/analytics/', headers=self.auth)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json(), expected)
+        response = await self.client.get('/async/analytics/', headers={**self.auth, 'If-None-Match': response['ETag']})
+        self.assertEqual(response.status_code, 304)
+
+        page = (await self.client.get('/async/analytics/?limit=1', headers=self.auth)).json()
+        self.assertEqual([row['center_id'] for row in page['results']], ['C1'])
+        page = (await self.client.get(f'/async/analytics/?limit=1&cursor={page["next_cursor"]}', headers=self.auth)).json()
+        self.assertEqual([row['center_id'] for row in page['results']], ['C2'])
+        self.assertIsNone(page['next_cursor'])
+
+        response = await self.client.get('/async/analytics/?stream=1', headers=self.auth)
+        lines = [json.loads(line) async for line in response.streaming_content]
+        self.assertEqual(lines, expected)
+
+    async def test_failed_write_rolls_back_reservation(self):
+        from unittest import mock
+        from allocation import rollups
+        with mock.patch.object(rollups, 'record_allocation', side_effect=RuntimeError('rollup down')):
+            response = await self.post({'order_id': 'A7', 'quantity': 5, 'zip_code': '10003'})
+        self.assertEqual((response.status_code, response.json()), (400, {'error': 'rollup down'}))
+        center = await DistributionCenter.objects.aget(pk=self.center2.pk)
+        self.assertEqual(center.stock, 8)
+
+    async def test_value_error_is_a_bad_request_as_in_sync_view(self):
+        from unittest import mock
+        from allocation import async_views, inventory
+        snapshot = await sync_to_async(inventory.get_snapshot)()
+        with mock.patch.object(type(snapshot), 'nearest', side_effect=ValueError('bad zip')):
+            response = await self.post({'order_id': 'A8', 'quantity': 1, 'zip_code': '10003'})
+        self.assertEqual((response.status_code, response.json()), (400, {'error': 'Value error: bad zip'}))
+        with mock.patch.object(async_views, '_reserve_and_create', side_effect=ValueError('bad quantity')):
+            response = await self.post({'order_id': 'A8', 'quantity': 1, 'zip_code': '10003'})
+        self.assertEqual((response.status_code, response.json()), (400, {'error': 'Value error: bad quantity'}))
+        self.assertFalse(await Order.objects.filter(order_id='A8').aexists())
+        self.assertFalse(await Order.objects.filter(order_id='A7').aexists())
+
+    async def test_server_timing_on_async_path(self):
+        from django.test import AsyncClient
+        with self.settings(REQUEST_TIMING_ENABLED=True, SLOW_REQUEST_THRESHOLD_MS=10 ** 6):
+            self.client = AsyncClient()
+            response = await self.post({'order_id': 'A6', 'quantity': 1, 'zip_code': '10000'})
+        self.assertEqual(response.status_code, 200)
+        metrics = {item.split(';')[0].strip() for item in response['Server-Timing'].split(',')}
+        self.assertTrue({'auth', 'validate', 'locate', 'reserve', 'log', 'total'} <= metrics)
+
+
+class TestShardedStock(TestCase):
+    def setUp(self):
+        from allocation import sharding
+        self.sharding = sharding
+        self.center1 = DistributionCenter.objects.create(center_id='C1', stock=10, initial_stock=100, zip_code='10000')
+        self.center2 = DistributionCenter.objects.create(center_id='C2', stock=40, initial_stock=50, zip_code='10003')
+
+    def slots(self, center):
+        return list(center.stock_slots.order_by('slot').values_list('stock', flat=True))
+
+    def test_reshard_and_summed_reads(self):
+        from django.core.management import call_command
+        call_command('shard_stock', 'C1', '--slots', '4', stdout=open(os.devnull, 'w'))
+        center = DistributionCenter.objects.get(pk=self.center1.pk)
+        self.assertEqual((center.stock, center.slot_count), (0, 4))
+        self.assertEqual(self.slots(center), [3, 3, 2, 2])
+        self.assertEqual(center.total_stock, 10)
+        self.assertTrue(center.is_low_stock())
+        annotated = self.sharding.with_total_stock(DistributionCenter.objects).get(pk=center.pk)
+        with self.assertNumQueries(0):
+            self.assertEqual(annotated.total_stock, 10)
+
+        call_command('shard_stock', 'C1', '--slots', '0', stdout=open(os.devnull, 'w'))
+        center = DistributionCenter.objects.get(pk=self.center1.pk)
+        self.assertEqual((center.stock, center.slot_count, self.slots(center)), (10, 0, []))
+
+    def test_allocation_decrements_one_slot_and_rebalances(self):
+        from allocation import inventory
+        from allocation.views import allocate_order
+        self.sharding.reshard(self.center1.pk, 4)
+        self.assertEqual(inventory.get_snapshot().slot_count(self.center1.pk), 4)
+
+        # Only the slots holding 3 can cover it, whichever the random start
+        result = allocate_order({'order_id': 'S1', 'quantity': 3, 'zip_code': '10000'})
+        self.assertEqual(result['center_id'], 'C1')
+        self.assertEqual(sorted(self.slots(self.center1)), [0, 2, 2, 3])
+        # No single slot holds 5, but together they do
+        result = allocate_order({'order_id': 'S2', 'quantity': 5, 'zip_code': '10000'})
+        self.assertEqual(result['center_id'], 'C1')
+        self.assertEqual(self.slots(self.center1), [1, 1, 0, 0])
+        self.assertEqual(inventory.get_snapshot().stock(self.center1.pk), 2)
+        result = allocate_order({'order_id': 'S3', 'quantity': 4, 'zip_code': '10000'})
+        self.assertEqual(result['center_id'], 'C2')
+
+    def test_rollup_writes_spread_over_slots(self):
+        import random
+        from django.db.models import Sum
+        from allocation import forecast
+        from allocation.views import allocate_order
+
+        def hottest_share(center, slots):
+            # Share of the center's orders whose rollup increment hit its
+            # busiest row: the row every one of those writers queued on
+            DistributionCenter.objects.filter(pk=center.pk).update(stock=400, initial_stock=400)
+            self.sharding.reshard(center.pk, slots)
+            random.seed(7)
+            for i in range(200):
+                allocate_order({'order_id': f'{center.center_id}-{slots}-{i}', 'quantity': 1, 'zip_code': center.zip_code})
+            counts = list(center.rollups.values_list('order_count', flat=True))
+            self.assertEqual(sum(counts), 200)
+            center.rollups.all().delete()
+            return max(counts) / 200
+
+        shares = {slots: hottest_share(self.center1, slots) for slots in (0, 1, 4, 8)}
+        self.assertEqual((shares[0], shares[1]), (1.0, 1.0))
+        self.assertLess(shares[4], 0.4)
+        self.assertLess(shares[8], shares[4])
+
+        # Readers still see one total per center and day
+        for i in range(6):
+            allocate_order({'order_id': f'R{i}', 'quantity': 2, 'zip_code': '10000'})
+        self.assertGreater(self.center1.rollups.count(), 1)
+        totals = self.center1.rollups.aggregate(orders=Sum('order_count'), quantity=Sum('total_quantity'))
+        self.assertEqual((totals['orders'], totals['quantity']), (6, 12))
+        forecast.invalidate()
+        pks, rates = forecast.daily_rates(timezone.now() + timedelta(days=1))
+        self.assertGreater(rates[list(pks).index(self.center1.pk)], 0)
+
+    def test_batch_and_analytics_use_summed_stock(self):
+        from allocation.views import allocate_orders
+        self.sharding.reshard(self.center1.pk, 3)
+        results = allocate_orders([
+            {'order_id': 'B1', 'quantity': 4, 'zip_code': '10000'},
+            {'order_id': 'B2', 'quantity': 4, 'zip_code': '10000'},
+        ])
+        self.assertEqual([r['center_id'] for r in results], ['C1', 'C1'])
+        self.assertEqual(sum(self.slots(self.center1)), 2)
+        self.assertEqual(DistributionCenter.objects.get(pk=self.center1.pk).stock, 0)
+
+        client = logged_in_client('shards')
+        rows = {row['center_id']: row for row in client.get('/analytics/').data}
+        self.assertEqual(rows['C1']['stock'], 2)
+        self.assertEqual(rows['C1']['remaining_percentage'], 2.0)
+        self.assertTrue(rows['C1']['low_stock_alert'])
+        self.assertEqual((rows['C1']['total_orders'], rows['C1']['total_quantity']), (2, 8))
+        self.assertEqual(rows['C2']['stock'], 40)
+        self.assertIn('allocation_center_stock{center_id="C1"} 2', client.get('/metrics/').content.decode())
+
+    def test_batch_rejects_orders_when_slots_come_up_short(self):
+        from unittest import mock
+        from allocation.views import NO_STOCK_ERROR, allocate_orders
+        self.sharding.reshard(self.center1.pk, 2)
+        with mock.patch.object(self.sharding, 'take', return_value=False):
+            results = allocate_orders([
+                {'order_id': 'T1', 'quantity': 4, 'zip_code': '10000'},
+                {'order_id': 'T2', 'quantity': 30, 'zip_code': '10003'},
+            ])
+        self.assertEqual(results[0]['status'], 'rejected')
+        self.assertEqual(results[0]['error'], NO_STOCK_ERROR)
+        self.assertEqual(results[1]['center_id'], 'C2')
+        self.assertEqual(list(Order.objects.values_list('order_id', flat=True)), ['T2'])
+        self.assertEqual(sum(self.slots(self.center1)), 10)
+
+    def test_batch_ranks_on_locked_slot_totals(self):
+        from allocation.views import allocate_orders
+        self.sharding.reshard(self.center1.pk, 2)
+        centers = list(self.sharding.with_total_stock(DistributionCenter.objects.order_by('pk')))
+        self.center1.stock_slots.update(stock=1)
+        self.sharding.lock_slots(centers)
+        self.assertEqual([c.total_stock for c in centers], [2, 40])
+        results = allocate_orders([{'order_id': 'L1', 'quantity': 3, 'zip_code': '10000'}])
+        self.assertEqual(results[0]['center_id'], 'C2')
+
+
+class TestShardedConcurrentAllocation(TransactionTestCase):
+    def test_hot_center_never_oversells(self):
+        import threading
+        from django.db import connection
+        from allocation import sharding
+        from allocation.views import allocate_order
+        center = DistributionCenter.objects.create(center_id='HOT', stock=50, initial_stock=50, zip_code='10000')
+        sharding.reshard(center.pk, 4)
+        results = []
+        lock = threading.Lock()
+
+        def worker(n):
+            try:
+                for i in range(20):
+                    result = allocate_order({'order_id': f'H{n}-{i}', 'quantity': 1, 'zip_code': '10000'})
+                    with lock:
+                        results.append(result)
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=worker, args=(n,)) for n in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(sum('center_id' in r for r in results), 50)
+        self.assertEqual(DistributionCenter.objects.get(pk=center.pk).total_stock, 0)
+        self.assertEqual(Order.objects.filter(center=center).count(), 50)
+        self.assertEqual(sum(center.rollups.values_list('order_count', flat=True)), 50)
+
+
+class TestAlertEngine(TestCase):
+    def setUp(self):
+        from allocation import alerts
+        self.alerts = alerts
+        alerts.flush()
+        self.seen = len(sink_records('alerts'))
+        self.center = DistributionCenter.objects.create(center_id='C1', stock=100, initial_stock=100, zip_code='10000')
+
+    def restock(self, stock):
+        self.center.stock = stock
+        self.center.save()
+
+    def published(self):
+        return [(r['event'], r['level']) for r in sink_records('alerts')[self.seen:]]
+
+    def test_levels_use_hysteresis(self):
+        level_for = self.alerts.level_for
+        self.assertEqual(level_for(19, 100), 1)
+        self.assertEqual(level_for(4, 100), 2)
+        # Leaving a level needs the threshold plus ALERT_HYSTERESIS
+        self.assertEqual(level_for(22, 100, 1), 1)
+        self.assertEqual(level_for(25, 100, 1), 0)
+        self.assertEqual(level_for(7, 100, 2), 2)
+        self.assertEqual(level_for(12, 100, 2), 1)
+        self.assertEqual(level_for(40, 100, 2), 0)
+        self.assertEqual(level_for(0, 0), 0)
+
+    def test_alert_io_scales_with_state_changes(self):
+        from allocation.views import allocate_order
+        for i in range(30):
+            allocate_order({'order_id': f'A{i}', 'quantity': 3, 'zip_code': '10000'})
+        self.assertEqual(self.alerts.flush(), 1)
+        self.assertEqual(self.published(), [('raised', 'low')])
+        self.assertEqual(DistributionCenter.objects.get(pk=self.center.pk).alert_level, 1)
+
+    def test_escalation_and_recovery(self):
+        self.restock(15)
+        self.alerts.flush()
+        self.restock(3)
+        self.alerts.flush()
+        # Within the hysteresis band nothing changes
+        self.restock(8)
+        self.assertEqual(self.alerts.flush(), 0)
+        self.restock(60)
+        self.alerts.flush()
+        self.assertEqual(self.published(), [
+            ('raised', 'low'), ('escalated', 'critical'), ('resolved', 'ok')
+        ])
+
+    def test_round_trip_within_flush_interval_is_coalesced(self):
+        self.restock(10)
+        self.restock(3)
+        self.restock(90)
+        self.assertEqual(self.alerts.flush(), 0)
+        self.restock(10)
+        self.restock(3)
+        self.assertEqual(self.alerts.flush(), 1)
+        self.assertEqual(self.published(), [('raised', 'critical')])
+
+    def test_realert_interval(self):
+        from allocation.views import allocate_order
+        self.restock(15)
+        self.alerts.flush()
+        allocate_order({'order_id': 'R1', 'quantity': 1, 'zip_code': '10000'})
+        self.assertEqual(self.alerts.flush(), 0)
+        with self.settings(ALERT_REALERT_INTERVAL=0):
+            allocate_order({'order_id': 'R2', 'quantity': 1, 'zip_code': '10000'})
+        self.assertEqual(self.alerts.flush(), 1)
+        self.assertEqual(self.published(), [('raised', 'low'), ('reminder', 'low')])
+
+    def test_transition_claimed_once(self):
+        stale = DistributionCenter.objects.get(pk=self.center.pk)
+        DistributionCenter.objects.filter(pk=self.center.pk).update(stock=10)
+        fresh = DistributionCenter.objects.get(pk=self.center.pk)
+        stale.stock = 10
+        self.assertTrue(self.alerts.observe(fresh))
+        self.assertFalse(self.alerts.observe(stale))
+        self.assertEqual(self.alerts.flush(), 1)
+
+    def test_flusher_survives_a_failed_flush(self):
+        import threading
+        from unittest import mock
+        calls = threading.Semaphore(0)
+
+        def flush():
+            calls.release()
+            raise OSError('sink storage down')
+
+        with self.settings(ALERT_FLUSH_INTERVAL=0.01), \
+                mock.patch.object(self.alerts, 'flush', side_effect=flush), \
+                self.assertLogs('allocation.alerts', 'ERROR'):
+            self.alerts._start_flusher()
+            for _ in range(2):
+                self.assertTrue(calls.acquire(timeout=15))
+        self.assertTrue(self.alerts._flusher.is_alive())
+
+
+class TestApiKeyAuthentication(TestCase):
+    def setUp(self):
+        from allocation import authentication
+        from allocation.models import ApiKey
+        self.authentication = authentication
+        self.user = User.objects.create_user('client')
+        self.api_key, self.raw_key = ApiKey.issue(self.user, 'test')
+        DistributionCenter.objects.create(center_id='C1', stock=50, initial_stock=100, zip_code='10000')
+
+    def get(self, key):
+        return APIClient().get('/analytics/', HTTP_API_KEY=key)
+
+    def test_only_the_digest_is_stored(self):
+        from allocation.models import ApiKey
+        self.assertNotEqual(self.api_key.key_hash, self.raw_key)
+        self.assertEqual(len(self.api_key.key_hash), 64)
+        self.assertEqual(ApiKey.objects.get(key_hash=ApiKey.hash_key(self.raw_key)).user, self.user)
+
+    def test_issued_key_authenticates_as_its_user(self):
+        response = APIClient().post('/allocate/', {
+            'order_id': 'K1', 'quantity': 1, 'zip_code': '10000'
+        }, format='json', HTTP_API_KEY=self.raw_key)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.authentication.verify(self.raw_key)[0], self.user)
+        self.assertEqual(self.get('wrong').status_code, 401)
+        self.assertEqual(self.get('wrong').data['detail'], 'Invalid API key')
+
+    def key_lookups(self, call):
+        # api_keys queries made by call(); the shared version read is the
+        # only other query, and none at all with Redis or Memcached
+        from django.db import connection
+        from django.test.utils import CaptureQueriesContext
+        with CaptureQueriesContext(connection) as queries:
+            call()
+        return sum('api_keys' in query['sql'] for query in queries)
+
+    def test_verified_keys_are_cached(self):
+        self.assertEqual(self.get(self.raw_key).status_code, 200)
+        self.assertEqual(self.key_lookups(lambda: self.assertIsNotNone(self.authentication.verify(self.raw_key))), 0)
+
+    def test_version_bump_from_another_worker_drops_cached_keys(self):
+        from django.core.cache import caches
+        from django.utils import timezone
+        from allocation.models import ApiKey
+        self.assertIsNotNone(self.authentication.verify(self.raw_key))
+        # Revoked elsewhere: this process's LRU is untouched, only the shared
+        # version moves
+        ApiKey.objects.filter(pk=self.api_key.pk).update(revoked_at=timezone.now())
+        caches['shared'].incr(self.authentication.VERSION_KEY)
+        self.assertIsNone(self.authentication.verify(self.raw_key))
+
+    def test_cache_is_bounded(self):
+        from allocation.models import ApiKey
+        with self.settings(API_KEY_CACHE_SIZE=2):
+            keys = [ApiKey.issue(self.user)[1] for _ in range(3)]
+            for key in keys:
+                self.authentication.verify(key)
+            self.assertEqual(len(self.authentication._verified), 2)
+            self.assertEqual(self.key_lookups(lambda: self.authentication.verify(keys[0])), 1)
+
+    def test_revoked_and_rotated_keys_stop_working(self):
+        from django.core.management import call_command
+        self.assertEqual(self.get(self.raw_key).status_code, 200)
+        self.api_key.revoke()
+        self.assertEqual(self.get(self.raw_key).status_code, 401)
+
+        import io
+        call_command('issue_api_key', 'client', stdout=open(os.devnull, 'w'))
+        out = io.StringIO()
+        call_command('issue_api_key', 'client', '--rotate', stdout=out)
+        new_key = out.getvalue().strip().splitlines()[-1]
+        self.assertEqual(self.get(new_key).status_code, 200)
+        self.assertEqual(self.user.api_keys.filter(revoked_at__isnull=True).count(), 1)
+
+    def test_inactive_user_is_rejected(self):
+        self.assertEqual(self.get(self.raw_key).status_code, 200)
+        self.user.is_active = False
+        self.user.save()
+        self.assertEqual(self.get(self.raw_key).status_code, 401)
+
+    @override_settings(API_KEY='shared-key')
+    def test_no_password_hashing_per_request(self):
+        from unittest import mock
+        from django.contrib.auth.hashers import PBKDF2PasswordHasher
+        User.objects.create_user(settings.API_KEY_USER)
+        with mock.patch.object(PBKDF2PasswordHasher, 'verify') as hasher:
+            for _ in range(3):
+                self.assertEqual(self.get(self.raw_key).status_code, 200)
+                self.assertEqual(self.get(settings.API_KEY).status_code, 200)
+        hasher.assert_not_called()
+
+    def test_shared_key_is_off_unless_configured(self):
+        with self.settings(API_KEY=None):
+            self.assertEqual(self.get('shared-key').status_code, 401)
+        with self.settings(API_KEY='shared-key'):
+            # Its user is never created on the fly
+            self.assertEqual(self.get('shared-key').status_code, 401)
+            self.assertFalse(User.objects.filter(username=settings.API_KEY_USER).exists())
+            User.objects.create_user(settings.API_KEY_USER)
+            self.authentication.invalidate()
+            self.assertEqual(self.get('shared-key').status_code, 200)
+
+
+class TestOrderArchival(TestCase):
+    def setUp(self):
+        import tempfile
+        from datetime import datetime, timezone as dt_timezone
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        override = self.settings(ARCHIVE_DIR=directory.name)
+        override.enable()
+        self.addCleanup(override.disable)
+        self.directory = directory.name
+
+        self.center1 = DistributionCenter.objects.create(center_id='C1', stock=50, initial_stock=100, zip_code='10000')
+        self.center2 = DistributionCenter.objects.create(center_id='C2', stock=50, initial_stock=100, zip_code='10003')
+        self.old = [
+            ('A1', 2, self.center1, datetime(2025, 1, 10, 10, 15, tzinfo=dt_timezone.utc)),
+            ('A2', 3, self.center1, datetime(2025, 1, 10, 10, 45, tzinfo=dt_timezone.utc)),
+            ('A3', 4, self.center2, datetime(2025, 1, 10, 11, 30, tzinfo=dt_timezone.utc)),
+            ('A4', 5, self.center1, datetime(2025, 2, 2, 9, 0, tzinfo=dt_timezone.utc)),
+            ('A5', 6, None, datetime(2025, 2, 3, 9, 0, tzinfo=dt_timezone.utc)),
+        ]
+        for order_id, quantity, center, created_at in self.old:
+            self.add_order(order_id, quantity, center, created_at)
+        self.add_order('R1', 1, self.center1)
+        self.client = logged_in_client('archive')
+
+    def add_order(self, order_id, quantity, center, created_at=None):
+        order = Order.objects.create(order_id=order_id, quantity=quantity, zip_code='10000', center=center,
+                                     status='allocated')
+        if created_at:
+            Order.objects.filter(pk=order.pk).update(created_at=created_at)
+
+    def archive_orders(self):
+        from django.core.management import call_command
+        call_command('archive_orders', '--days', '30', stdout=open(os.devnull, 'w'))
+
+    def trends(self, **params):
+        response = self.client.get('/analytics/trends/', params)
+        self.assertEqual(response.status_code, 200)
+        return response.json()
+
+    def test_old_orders_move_to_monthly_segments(self):
+        from allocation import archive
+        self.archive_orders()
+        self.assertEqual(list(Order.objects.values_list('order_id', flat=True)), ['R1'])
+        with open(os.path.join(self.directory, 'manifest.json')) as f:
+            manifest = json.load(f)
+        self.assertEqual([(s['month'], s['rows']) for s in manifest['segments']], [('2025-01', 3), ('2025-02', 2)])
+        with archive.segments()[0].open() as data:
+            self.assertEqual(data['order_id'].tolist(), ['A1', 'A2', 'A3'])
+            self.assertEqual(data['quantity'].tolist(), [2, 3, 4])
+
+    def test_archived_order_ids_stay_taken(self):
+        from allocation import archive
+        from allocation.views import allocate_orders
+        self.archive_orders()
+        self.assertTrue(archive.contains('A2'))
+        self.assertFalse(archive.contains('R1'))
+        self.assertEqual(archive.existing(['A1', 'A5', 'new']), {'A1', 'A5'})
+
+        response = self.client.post('/allocate/', {'order_id': 'A1', 'quantity': 1, 'zip_code': '10000'}, format='json')
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('Order_id já existe', str(response.data))
+        results = allocate_orders([{'order_id': 'A4', 'quantity': 1, 'zip_code': '10000'}])
+        self.assertEqual(results[0]['error'], 'Order_id já existe.')
+
+    def test_trends_include_archived_orders(self):
+        ranges = [
+            {'from_date': '2025-01-10T10:30:00', 'to_date': '2025-02-28', 'interval': 'hour'},
+            {'from_date': '2025-01-01', 'to_date': '2025-03-01', 'interval': 'day'},
+            {'from_date': '2025-01-01', 'to_date': '2025-03-01', 'interval': 'week', 'center_id': 'C1'},
+            {'from_date': '2025-01-10T10:20:00', 'to_date': '2025-01-10T10:50:00', 'interval': 'hour'},
+        ]
+        expected = [self.trends(**params) for params in ranges]
+        self.archive_orders()
+        self.assertEqual([self.trends(**params) for params in ranges], expected)
+        self.assertEqual(expected[3], [
+            {'center_id': 'C1', 'bucket': '2025-01-10T10:00:00Z', 'total_orders': 1, 'total_quantity': 3}
+        ])
+
+    def test_rollup_rebuild_counts_archived_orders(self):
+        from allocation import rollups
+        rollups.rebuild()
+        expected = sorted(CenterDailyRollup.objects.values_list('center_id', 'day', 'order_count', 'total_quantity'))
+        self.archive_orders()
+        rollups.rebuild()
+        self.assertEqual(
+            sorted(CenterDailyRollup.objects.values_list('center_id', 'day', 'order_count', 'total_quantity')), expected
+        )
+
+    def test_interrupted_run_is_not_archived_twice(self):
+        from allocation import archive
+        self.archive_orders()
+        # As if the previous run died after writing the segment
+        self.add_order('A1', 2, self.center1, self.old[0][3])
+        self.archive_orders()
+        self.assertFalse(Order.objects.filter(order_id='A1').exists())
+        self.assertEqual(sum(segment.rows for segment in archive.segments()), 5)
+
+
+@override_settings(REPLICA_READS_ENABLED=True)
+class TestReadReplica(TransactionTestCase):
+    databases = {'default', 'replica'}
+
+    def setUp(self):
+        from allocation import replica
+        self.replica = replica
+        self.addCleanup(self.remove_stamp)
+        from django.core.cache import caches
+        caches['shared'].clear()
+        DistributionCenter.objects.create(center_id='C1', stock=50, initial_stock=100, zip_code='10000')
+        self.reader = logged_in_client('reader')
+        self.writer = logged_in_client('writer')
+
+    def remove_stamp(self):
+        path = self.replica.replica_path() + '.synced'
+        if os.path.exists(path):
+            os.remove(path)
+
+    def stock(self, client):
+        response = client.get('/analytics/')
+        self.assertEqual(response.status_code, 200)
+        return response.data[0]['stock']
+
+    def allocate(self, order_id):
+        response = self.writer.post('/allocate/', {'order_id': order_id, 'quantity': 5, 'zip_code': '10000'}, format='json')
+        self.assertEqual(response.status_code, 200)
+
+    def test_unsynced_replica_is_not_used(self):
+        self.allocate('R1')
+        self.assertEqual(self.stock(self.reader), 45)
+
+    def test_reads_go_to_replica_with_sticky_writer(self):
+        from django.core.management import call_command
+        call_command('sync_replica', stdout=open(os.devnull, 'w'))
+        self.assertEqual(DistributionCenter.objects.using('replica').count(), 1)
+        self.allocate('R1')
+        # Others see the replica until the next sync; the writer sees its write
+        self.assertEqual(self.stock(self.reader), 50)
+        self.assertEqual(self.stock(self.writer), 45)
+        call_command('sync_replica', stdout=open(os.devnull, 'w'))
+        self.assertEqual(self.stock(self.reader), 45)
+        with self.settings(REPLICA_READS_ENABLED=False):
+            self.allocate('R2')
+            self.assertEqual(self.stock(self.reader), 40)
+
+    def test_streamed_analytics_follow_the_routing(self):
+        self.replica.sync()
+        self.allocate('R1')
+        response = self.reader.get('/analytics/?stream=1')
+        rows = [json.loads(line) for line in b''.join(response.streaming_content).splitlines()]
+        self.assertEqual(rows[0]['stock'], 50)
+
+    def test_pin_is_kept_in_the_shared_cache(self):
+        from django.core.cache import caches
+        self.replica.sync()
+        writer = User.objects.get(username='writer')
+        # Not in the per-process default cache, which other workers can't see
+        self.allocate('R1')
+        self.assertTrue(caches['shared'].get(self.replica._pin_key(writer)))
+        self.assertIsNone(caches['default'].get(self.replica._pin_key(writer)))
+        self.assertIsNone(self.replica.read_alias(writer))
+        caches['shared'].clear()
+        self.assertEqual(self.replica.read_alias(writer), 'replica')
+
+    def test_writes_stay_on_primary(self):
+        router = self.replica.ReplicaRouter()
+        self.assertFalse(router.allow_migrate('replica', 'allocation'))
+        self.assertIsNone(router.allow_migrate('default', 'allocation'))
+        self.replica.sync()
+        with self.settings(REPLICA_STICKY_SECONDS=0):
+            self.allocate('R1')
+        self.assertEqual(Order.objects.using('default').count(), 1)
+        self.assertEqual(Order.objects.using('replica').count(), 0)
+
+
+class TestStockForecast(TestCase):
+    def setUp(self):
+        from django.core.cache import caches
+        caches['analytics'].clear()
+        self.client = logged_in_client('forecast')
+        self.center1 = DistributionCenter.objects.create(center_id='C1', stock=100, initial_stock=500, zip_code='10000')
+        self.center2 = DistributionCenter.objects.create(center_id='C2', stock=40, initial_stock=50, zip_code='10003')
+        self.center3 = DistributionCenter.objects.create(center_id='C3', stock=10, initial_stock=10, zip_code='10005')
+
+    def add_history(self, center, quantities):
+        # quantities[-1] is yesterday
+        from allocation.models import CenterDailyRollup
+        today = timezone.localdate()
+        for age, quantity in enumerate(reversed(quantities), start=1):
+            CenterDailyRollup.objects.create(
+                center=center, day=today - timedelta(days=age), order_count=1, total_quantity=quantity
+            )
+
+    def test_ewma_weights_recent_days(self):
+        import numpy as np
+        from allocation import forecast
+        quantities = np.array([[10.0] * 5, [0, 0, 0, 0, 10.0], [10.0, 0, 0, 0, 0]])
+        rates = forecast.ewma_rates(quantities, 0.5)
+        self.assertAlmostEqual(rates[0], 10.0)
+        self.assertGreater(rates[1], rates[2])
+        days = forecast.days_to_stockout([20, 0, 5], np.array([10.0, 10.0, 0.0]))
+        self.assertEqual(days.tolist(), [2.0, 0.0, float('inf')])
+
+    def test_forecast_endpoint_orders_by_stockout(self):
+        self.add_history(self.center1, [10] * 28)
+        self.add_history(self.center2, [20] * 28)
+        response = self.client.get('/analytics/forecast/')
+        self.assertEqual(response.status_code, 200)
+        rows = response.json()
+        self.assertEqual([r['center_id'] for r in rows], ['C2', 'C1', 'C3'])
+        self.assertEqual((rows[0]['daily_rate'], rows[0]['days_to_stockout'], rows[0]['replenish']), (20.0, 2.0, True))
+        self.assertEqual((rows[1]['days_to_stockout'], rows[1]['replenish']), (10.0, False))
+        self.assertEqual((rows[2]['days_to_stockout'], rows[2]['stockout_at'], rows[2]['replenish']), (None, None, False))
+
+        response = self.client.get('/analytics/forecast/', {'within_days': 5})
+        self.assertEqual([r['center_id'] for r in response.json()], ['C2'])
+        self.assertEqual(self.client.get('/analytics/forecast/', {'within_days': 'x'}).status_code, 400)
+
+    def test_rates_cached_until_rollup_tick_but_stock_is_live(self):
+        from allocation import forecast
+        from allocation.views import allocate_order
+        self.add_history(self.center2, [20] * 28)
+        forecast.forecast()
+        # Today's orders don't move the rate; the stock they took does
+        self.add_history(self.center1, [10] * 28)
+        allocate_order({'order_id': 'F1', 'quantity': 20, 'zip_code': '10003'})
+        rows = {r['center_id']: r for r in forecast.forecast()}
+        self.assertEqual((rows['C2']['daily_rate'], rows['C2']['days_to_stockout']), (20.0, 1.0))
+        self.assertEqual(rows['C1']['daily_rate'], 0.0)
+
+        # The next day (or a rollup rebuild) recomputes it
+        tomorrow = timezone.now() + timedelta(days=1)
+        rows = {r['center_id']: r for r in forecast.forecast(now=tomorrow)}
+        self.assertGreater(rows['C1']['daily_rate'], 0)
+
+    def test_vectorized_rates_scale_to_many_centers(self):
+        import time
+        import numpy as np
+        from allocation import forecast
+        quantities = np.random.default_rng(0).poisson(5, size=(50000, settings.FORECAST_WINDOW_DAYS)).astype(float)
+        started = time.perf_counter()
+        rates = forecast.ewma_rates(quantities, settings.FORECAST_EWMA_ALPHA)
+        forecast.days_to_stockout(np.full(50000, 100), rates)
+        self.assertLess(time.perf_counter() - started, 0.5)
+
+    def test_uncached_forecast_reads_rollups_in_fixed_queries(self):
+        # Timing lives in bench_forecast; here the uncached path must not
+        # grow queries with the number of centers or rollup rows
+        from django.core.cache import caches
+        from allocation import forecast
+        from allocation.models import CenterDailyRollup
+        centers = DistributionCenter.objects.bulk_create(
+            DistributionCenter(center_id=f'S{i:05d}', stock=100, initial_stock=100, zip_code='10000')
+            for i in range(300)
+        )
+        today = timezone.localdate()
+        CenterDailyRollup.objects.bulk_create(
+            CenterDailyRollup(center=center, day=today - timedelta(days=age), order_count=1, total_quantity=i % 7)
+            for i, center in enumerate(centers) for age in range(1, settings.FORECAST_WINDOW_DAYS + 1)
+        )
+        caches['analytics'].clear()
+        # Rollup rows, center pks, live stock
+        with self.assertNumQueries(3):
+            rows = forecast.forecast()
+        self.assertEqual(len(rows), 303)
+        # A constant series is its own rate
+        self.assertEqual({r['center_id']: r['daily_rate'] for r in rows}['S00006'], 6.0)
+        with self.assertNumQueries(1):
+            forecast.forecast()
+
+
+class TestOrderPayload(TestCase):
+    CASES = [
+        {}, None, [], 'str',
+        {'order_id': 'A', 'quantity': 1, 'zip_code': '10000'},
+        {'order_id': None, 'quantity': None, 'zip_code': None},
+        {'order_id': '', 'quantity': '', 'zip_code': ''},
+        {'order_id': '  ', 'quantity': ' 5 ', 'zip_code': ' 123 '},
+        {'order_id': 'x' * 51, 'quantity': 1, 'zip_code': '1' * 11},
+        {'order_id': 5, 'quantity': '5', 'zip_code': 12345},
+        {'order_id': True, 'quantity': True, 'zip_code': False},
+        {'order_id': [1], 'quantity': [1], 'zip_code': {'a': 1}},
+        {'order_id': 'A', 'quantity': 5.0, 'zip_code': '1'},
+        {'order_id': 'A', 'quantity': 5.5, 'zip_code': '1'},
+        {'order_id': 'A', 'quantity': '5.00 ', 'zip_code': '1'},
+        {'order_id': 'A', 'quantity': 0, 'zip_code': '1'},
+        {'order_id': 'A', 'quantity': -1, 'zip_code': 'abc'},
+        {'order_id': 'A', 'quantity': 1, 'zip_code': '\u00b2\u0663'},
+        {'order_id': 'A', 'quantity': '1e3', 'zip_code': '1'},
+        {'order_id': 'A', 'quantity': 'x' * 1001, 'zip_code': '1'},
+        {'order_id': 'A\x00' + 'x' * 50, 'quantity': 1, 'zip_code': '1'},
+        {'order_id': 'A\ud800', 'quantity': 1, 'zip_code': '1'},
+    ]
+
+    def setUp(self):
+        self.client = logged_in_client('payload')
+        self.center = DistributionCenter.objects.create(center_id='C1', stock=20, initial_stock=100, zip_code='10000')
+
+    def test_same_results_as_order_serializer(self):
+        from allocation.serializers import OrderPayload, OrderSerializer
+        for data in self.CASES:
+            with self.subTest(data=data):
+                serializer, payload = OrderSerializer(data=data), OrderPayload(data)
+                self.assertEqual(payload.is_valid(), serializer.is_valid())
+                self.assertEqual(json.dumps(payload.errors), json.dumps(serializer.errors))
+                if serializer.errors == {}:
+                    self.assertEqual(payload.validated_data, dict(serializer.validated_data))
+
+    def test_duplicate_detected_by_unique_constraint(self):
+        from django.db import connection
+        from allocation.serializers import OrderSerializer
+        from django.test.utils import CaptureQueriesContext
+        self.client.post('/allocate/', {'order_id': 'D1', 'quantity': 2, 'zip_code': '10000'}, format='json')
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.post('/allocate/', {'order_id': 'D1', 'quantity': 3, 'zip_code': '10000'}, format='json')
+        self.assertEqual(response.status_code, 400)
+        # Same body the OrderSerializer used to return
+        serializer = OrderSerializer(data={'order_id': 'D1', 'quantity': 3, 'zip_code': '10000'})
+        self.assertFalse(serializer.is_valid())
+        self.assertEqual(response.json(), json.loads(json.dumps(serializer.errors)))
+        self.assertEqual(response.json(), {'order_id': ['order with this order id already exists.']})
+        self.assertFalse(any('SELECT 1 AS "a"' in q['sql'] for q in queries.captured_queries))
+        # The failed insert gave the stock back
+        self.center.refresh_from_db()
+        self.assertEqual(self.center.stock, 18)
+        self.assertEqual(Order.objects.filter(order_id='D1').count(), 1)
+
+    def test_json_errors(self):
+        response = self.client.post('/allocate/', '{"order_id": ', content_type='application/json')
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('JSON parse error', response.json()['detail'])
+        response = self.client.post('/allocate/', {'order_id': 'F1', 'quantity': 1, 'zip_code': '10000'})
+        self.assertEqual(response.status_code, 200)
@@ -1,132 +1,523 @@
 from rest_framework.decorators import api_view, authentication_classes, permission_classes
 from rest_framework.response import Response
 from rest_framework import status
-from rest_framework.authentication import BasicAuthentication
 from rest_framework.permissions import IsAuthenticated
 from .models import DistributionCenter, Order
-from .serializers import OrderSerializer
+from . import alerts, archive, forecast, idempotency, inventory, metrics, microbatch, replica, rollups, sharding, sinks
+from .authentication import ApiKeyAuthentication
+from .caching import versioned_response
+from .instrumentation import TimedBasicAuthentication, stage
+from .serializers import DUPLICATE_ORDER_ERROR, BatchOrderItemSerializer, OrderPayload, duplicate_order_errors
 import json
-import os
-import boto3
+import time
+from base64 import b64decode, urlsafe_b64encode
 from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.http import HttpResponse, StreamingHttpResponse
+from django.db import IntegrityError, transaction
+from django.http.request import RawPostDataException
+from rest_framework.exceptions import ParseError
+from rest_framework.utils import json as strict_json
 from django.utils import timezone
-from datetime import timedelta
-from django.db.models import Count, Sum
-
-# Directory for mocks
-os.makedirs('alerts', exist_ok=True)
-
-# Function to log alerts (simulating AWS CloudWatch Logs)
-def log_low_stock_alert(center):
-    alert_message = {
-        "center_id": center.center_id,
-        "stock_remaining": center.stock,
-        "initial_stock": center.initial_stock,
-        "timestamp": timezone.now().isoformat(),
-        "message": "Low stock! Replenish immediately."
-    }
-    
-    # Mock: Save to local file
-    with open(f'alerts/{center.center_id}_alert.json', 'w') as f:
-        json.dump(alert_message, f)
-    
-    # For real AWS: Uncomment and configure credentials
-    # client = boto3.client('logs', region_name='us-east-1')
-    # client.put_log_events(
-    #     logGroupName='fanatics-alerts',
-    #     logStreamName='low-stock',
-    #     logEvents=[{'timestamp': int(timezone.now().timestamp() * 1000), 'message': json.dumps(alert_message)}]
-    # )
+from datetime import datetime, timedelta
+from django.db.models import BooleanField, Case, Count, ExpressionWrapper, F, FloatField, Q, Sum, Value, When
+from django.db.models.functions import Coalesce, Trunc
+
+NO_STOCK_ERROR = "No distribution center with sufficient stock"
+
+# Function to save allocation results (S3, or the local mock; see LOG_SINK_STORAGES)
+def log_order_result(result):
+    sinks.order_log().emit(result)
 
 def allocate_order(order_data):
     try:
         quantity = order_data['quantity']
         zip_code = order_data['zip_code']
 
-        centers = DistributionCenter.objects.filter(stock__gte=quantity)
-        if not centers.exists():
-            return {"error": "No distribution center with sufficient stock"}
+        # Nearest candidate comes from the in-process snapshot; the stock is
+        # then taken with a conditional UPDATE, so concurrent workers cannot
+        # oversell and a lost race falls back to the next-nearest center
+        with stage('locate'):
+            snapshot = inventory.get_snapshot()
+        best_center = None
+        while best_center is None:
+            with stage('locate'):
+                center_pk = snapshot.nearest(int(zip_code), quantity)
+            if center_pk is None:
+                return {"error": NO_STOCK_ERROR}
 
-        best_center = min(
-            centers,
-            key=lambda c: abs(int(c.zip_code) - int(zip_code))
-        )
+            with stage('reserve'), transaction.atomic():
+                slot = sharding.reserve(center_pk, quantity, snapshot.slot_count(center_pk))
+                if slot is not None:
+                    best_center = sharding.with_total_stock(DistributionCenter.objects).get(pk=center_pk)
+                    order = Order.objects.create(
+                        order_id=order_data['order_id'],
+                        quantity=quantity,
+                        zip_code=zip_code,
+                        center=best_center,
+                        status='allocated'
+                    )
+                    rollups.record_allocation(center_pk, quantity, slot=slot)
 
-        # Extra robustness: Prevent negative stock
-        if best_center.stock - quantity < 0:
-            return {"error": "Insufficient stock after verification"}
-
-        best_center.stock -= quantity
-        best_center.save()
-        
-        order = Order.objects.create(
-            order_id=order_data['order_id'],
-            quantity=quantity,
-            zip_code=zip_code,
-            center=best_center,
-            status='allocated'
-        )
+            if best_center is None:
+                level = sharding.stock_levels(DistributionCenter.objects.filter(pk=center_pk)).first()
+                if level is None or level[1] != snapshot.slot_count(center_pk):
+                    inventory.invalidate()
+                    snapshot = inventory.get_snapshot()
+                else:
+                    snapshot.set_stock(center_pk, level[0])
 
-        # Check and log alert if stock is low
-        if best_center.is_low_stock():
-            log_low_stock_alert(best_center)
+        inventory.record_stock(best_center.pk, best_center.total_stock)
 
         result = {
             "order_id": order.order_id,
             "center_id": best_center.center_id,
             "status": order.status
         }
-        
-        # Save the result to "S3" (mock, as before)
-        with open(f'logs/{order.order_id}.json', 'w') as f:
-            json.dump(result, f)
-        
+
+        with stage('log'):
+            # Low-stock alerts only on a level change (see allocation.alerts)
+            alerts.observe(best_center)
+
+            # Save the result to "S3" (mock, as before)
+            log_order_result(result)
+
         return result
 
+    except IntegrityError:
+        # The unique order_id constraint is the duplicate check; the atomic
+        # block has already handed the reserved stock back
+        return {"error": DUPLICATE_ORDER_ERROR}
     except ValueError as e:
         return {"error": f"Value error: {str(e)}"}
     except Exception as e:
         return {"error": str(e)}
 
+def _rejected(order_id, error):
+    return {"order_id": order_id, "status": "rejected", "error": error}
+
+def _allocate_pending(pending, results, joint):
+    # Allocates the already-validated, duplicate-free orders of a batch.
+    # Runs inside the caller's transaction; sets results[i] for every
+    # pending order and returns (touched centers, alert transitions).
+
+    # Single locked stock snapshot for the whole batch, indexed by zip
+    centers = {c.pk: c for c in sharding.with_total_stock(DistributionCenter.objects.select_for_update())}
+    sharding.lock_slots(centers.values())
+    snapshot = inventory.CenterSnapshot(centers.values())
+    touched = {}
+    slot_taken = {}
+    new_orders = {}
+
+    # An order whose zip can't be converted is rejected on its own rather
+    # than failing the batch
+    ranked = []
+    requests = []
+    for i, data in pending:
+        try:
+            requests.append((int(data['zip_code']), data['quantity']))
+        except (TypeError, ValueError) as e:
+            results[i] = _rejected(data['order_id'], f"Value error: {e}")
+            continue
+        ranked.append((i, data))
+
+    # Centers for the whole batch are ranked in one pass
+    picks = snapshot.reserve_jointly(requests) if joint else snapshot.reserve_many(requests)
+    for (i, data), center_pk in zip(ranked, picks):
+        quantity = data['quantity']
+        if center_pk is None:
+            results[i] = _rejected(data['order_id'], NO_STOCK_ERROR)
+            continue
+
+        best = centers[center_pk]
+        if best.slot_count:
+            best.slot_stock -= quantity
+            slot_taken[best.pk] = slot_taken.get(best.pk, 0) + quantity
+        else:
+            best.stock -= quantity
+        touched[best.pk] = best
+        new_orders[i] = Order(
+            order_id=data['order_id'],
+            quantity=quantity,
+            zip_code=data['zip_code'],
+            center=best,
+            status='allocated'
+        )
+        results[i] = {
+            "order_id": data['order_id'],
+            "center_id": best.center_id,
+            "status": 'allocated'
+        }
+
+    # The slots were locked before ranking, so take() can only come up short
+    # if they changed anyway; that center's orders are rejected rather than
+    # allocated against stock it doesn't have
+    for center_pk, quantity in slot_taken.items():
+        if sharding.take(center_pk, quantity):
+            continue
+        centers[center_pk].slot_stock += quantity
+        del touched[center_pk]
+        for i, order in list(new_orders.items()):
+            if order.center_id == center_pk:
+                del new_orders[i]
+                results[i] = _rejected(order.order_id, NO_STOCK_ERROR)
+
+    # Alert state changes ride along with the stock write; sharded centers
+    # only need their row written when their level moved
+    changed = alerts.transitions(touched.values())
+    moved = {center.pk for center, _ in changed}
+    DistributionCenter.objects.bulk_update(
+        [c for c in touched.values() if not c.slot_count or c.pk in moved],
+        ['stock', 'alert_level', 'alert_sent_at']
+    )
+    Order.objects.bulk_create(new_orders.values())
+
+    totals = {}
+    for order in new_orders.values():
+        orders, quantity = totals.get(order.center_id, (0, 0))
+        totals[order.center_id] = (orders + 1, quantity + order.quantity)
+    rollups.record_allocations(totals)
+    return touched, changed
+
+def allocate_orders(orders_data, joint=False):
+    # Allocates raw order payloads in one pass. Returns one result per input,
+    # in input order; rejected orders do not abort the rest of the batch.
+    # With joint=True centers are assigned to minimise the batch's total
+    # distance rather than order by order.
+    results = [None] * len(orders_data)
+    valid = []
+
+    with stage('validate'):
+        for i, data in enumerate(orders_data):
+            order_id = data.get('order_id') if isinstance(data, dict) else None
+            serializer = BatchOrderItemSerializer(data=data)
+            if serializer.is_valid():
+                valid.append((i, serializer.validated_data))
+            else:
+                results[i] = _rejected(order_id, serializer.errors)
+
+        # One lookup for every order_id in the batch instead of one per order
+        order_ids = [data['order_id'] for _, data in valid]
+        existing = set(Order.objects.filter(order_id__in=order_ids).values_list('order_id', flat=True))
+        existing |= archive.existing(order_ids)
+
+    pending = []
+    seen = set()
+    for i, data in valid:
+        if data['order_id'] in existing or data['order_id'] in seen:
+            results[i] = _rejected(data['order_id'], DUPLICATE_ORDER_ERROR)
+            continue
+        seen.add(data['order_id'])
+        pending.append((i, data))
+
+    touched, changed = {}, []
+    while pending:
+        try:
+            with stage('allocate'), transaction.atomic():
+                touched, changed = _allocate_pending(pending, results, joint)
+            break
+        except IntegrityError:
+            # A concurrent request inserted some of these order_ids after
+            # the check above. The whole batch was rolled back, so only the
+            # conflicting orders are rejected and the rest are retried.
+            taken = set(Order.objects.filter(
+                order_id__in=[data['order_id'] for _, data in pending]
+            ).values_list('order_id', flat=True))
+            if not taken:
+                raise
+            for i, data in pending:
+                if data['order_id'] in taken:
+                    results[i] = _rejected(data['order_id'], DUPLICATE_ORDER_ERROR)
+            pending = [(i, data) for i, data in pending if data['order_id'] not in taken]
+            touched, changed = {}, []
+
+    if touched:
+        with stage('log'):
+            for center in touched.values():
+                inventory.record_stock(center.pk, center.total_stock)
+            alerts.publish(changed)
+            for result in results:
+                if result and result['status'] == 'allocated':
+                    log_order_result(result)
+
+    return results
+
 @api_view(['POST'])
-@authentication_classes([BasicAuthentication])  # Adds basic authentication
+@authentication_classes([ApiKeyAuthentication])  # Api-Key header (see allocation.authentication)
 @permission_classes([IsAuthenticated])
 def allocate_order_view(request):
-    # For simple API Key: Verify header (demo; use real authentication in production)
-    api_key = request.headers.get('Api-Key')
-    if api_key != settings.API_KEY:
-        return Response({"error": "Invalid API key"}, status=status.HTTP_401_UNAUTHORIZED)
-
-    serializer = OrderSerializer(data=request.data)
-    if serializer.is_valid():
-        result = allocate_order(serializer.validated_data)
+    # This client's reads stay on the primary until the replica has caught up
+    replica.pin(request.user)
+    # Retries carrying the same Idempotency-Key get the original response back
+    key = request.headers.get('Idempotency-Key')
+    if key:
+        return idempotency.run(request, key, lambda: _allocate_single(request))
+    return _allocate_single(request)
+
+def request_payload(request):
+    # JSON bodies are decoded straight from request.body, skipping DRF's
+    # parser negotiation; other content types, and bodies DRF has already
+    # read (e.g. for an Idempotency-Key fingerprint), come from request.data
+    if request.META.get('CONTENT_TYPE', '').split(';')[0].strip() != 'application/json':
+        return request.data
+    try:
+        body = request.body
+    except RawPostDataException:
+        return request.data
+    if not body:
+        return {}
+    try:
+        return strict_json.loads(body)
+    except ValueError as e:
+        raise ParseError(f'JSON parse error - {e}')
+
+def _allocate_single(request):
+    started = time.perf_counter()
+    payload = OrderPayload(request_payload(request))
+    with stage('validate'):
+        valid = payload.is_valid()
+    if valid:
+        if settings.ALLOCATION_MICROBATCH_ENABLED:
+            result = microbatch.allocate(payload.validated_data)
+        else:
+            result = allocate_order(payload.validated_data)
+        if result.get("error") == DUPLICATE_ORDER_ERROR:
+            # Reported as OrderSerializer's unique validator did
+            metrics.observe_allocation('validation_error', time.perf_counter() - started)
+            return Response(duplicate_order_errors(), status=status.HTTP_400_BAD_REQUEST)
         if "error" in result:
+            outcome = 'no_stock' if result["error"] == NO_STOCK_ERROR else 'error'
+            metrics.observe_allocation(outcome, time.perf_counter() - started)
             return Response(result, status=status.HTTP_400_BAD_REQUEST)
+        metrics.observe_allocation('allocated', time.perf_counter() - started)
         return Response(result, status=status.HTTP_200_OK)
-    return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+    metrics.observe_allocation('validation_error', time.perf_counter() - started)
+    return Response(payload.errors, status=status.HTTP_400_BAD_REQUEST)
+
+@api_view(['POST'])
+@authentication_classes([ApiKeyAuthentication])
+@permission_classes([IsAuthenticated])
+def allocate_batch_view(request):
+    replica.pin(request.user)
+    key = request.headers.get('Idempotency-Key')
+    if key:
+        return idempotency.run(request, key, lambda: _allocate_batch(request))
+    return _allocate_batch(request)
+
+def _allocate_batch(request):
+    orders = request.data.get('orders') if isinstance(request.data, dict) else request.data
+    if not isinstance(orders, list) or not orders:
+        return Response({"error": "Expected a non-empty list of orders"}, status=status.HTTP_400_BAD_REQUEST)
+    if len(orders) > settings.ALLOCATION_BATCH_MAX_SIZE:
+        return Response(
+            {"error": f"Batch size exceeds the limit of {settings.ALLOCATION_BATCH_MAX_SIZE} orders"},
+            status=status.HTTP_400_BAD_REQUEST
+        )
+
+    results = allocate_orders(orders)
+    allocated = sum(1 for r in results if r['status'] == 'allocated')
+    return Response({
+        "allocated": allocated,
+        "rejected": len(results) - allocated,
+        "results": results
+    }, status=status.HTTP_200_OK)
+
+ANALYTICS_FIELDS = (
+    'center_id', 'stock', 'initial_stock', 'remaining_percentage', 'low_stock_alert', 'total_orders', 'total_quantity'
+)
+
+def analytics_queryset(since):
+    # Answered from the per-day rollups, so the cost depends on centers x days
+    # in the window rather than on the size of the order history. Rows go
+    # through analytics_row() before being returned.
+    in_window = Q(rollups__day__gte=since.date())
+    return DistributionCenter.objects.annotate(
+        available=F('stock') + sharding.slot_stock(),
+    ).annotate(
+        total_orders=Coalesce(Sum('rollups__order_count', filter=in_window), 0),
+        total_quantity=Sum('rollups__total_quantity', filter=in_window),
+        remaining_percentage=ExpressionWrapper(
+            Value(100.0) * F('available') / F('initial_stock'),
+            output_field=FloatField()
+        ),
+        low_stock_alert=Case(
+            When(available__lt=0.2 * F('initial_stock'), then=Value(True)),
+            default=Value(False),
+            output_field=BooleanField()
+        )
+    ).values(
+        'center_id', 'available', 'initial_stock', 'remaining_percentage', 'low_stock_alert', 'total_orders', 'total_quantity'
+    ).order_by('center_id')
+
+def analytics_row(row):
+    # Summed stock (row plus slots) is reported as 'stock'
+    return {field: row['available' if field == 'stock' else field] for field in ANALYTICS_FIELDS}
+
+def decode_cursor(cursor):
+    # Raises ValueError (or UnicodeDecodeError) for anything next_cursor
+    # could not have produced
+    return b64decode(cursor.encode(), altchars=b'-_', validate=True).decode()
+
+def encode_cursor(center_id):
+    return urlsafe_b64encode(center_id.encode()).decode()
+
+def page_limit(limit):
+    # Requested page size capped at ANALYTICS_PAGE_MAX_SIZE; None if invalid
+    try:
+        limit = min(int(limit or settings.ANALYTICS_PAGE_MAX_SIZE), settings.ANALYTICS_PAGE_MAX_SIZE)
+    except ValueError:
+        return None
+    return limit if limit > 0 else None
 
 @api_view(['GET'])
-@authentication_classes([BasicAuthentication])
+@authentication_classes([ApiKeyAuthentication, TimedBasicAuthentication])
 @permission_classes([IsAuthenticated])
+@replica.replica_reads
+@versioned_response()
 def center_analytics_view(request):
     one_month_ago = timezone.now() - timedelta(days=30)
+    from_date = request.query_params.get('from_date')
     if from_date:
         try:
             one_month_ago = datetime.fromisoformat(from_date)
         except ValueError:
             return Response({"error": "Invalid from_date format (use YYYY-MM-DD)"}, status=400)
-    analytics = DistributionCenter.objects.annotate(
-        total_orders=Count('orders', filter=models.Q(orders__status='allocated', orders__created_at__gte=one_month_ago)),
-        total_quantity=Sum('orders__quantity', filter=models.Q(orders__status='allocated', orders__created_at__gte=one_month_ago)),
-        remaining_percentage=models.ExpressionWrapper(
-            models.Value(100.0) * models.F('stock') / models.F('initial_stock'),
-            output_field=models.FloatField()
-        ),
-        low_stock_alert=models.Case(
-            models.When(stock__lt=0.2 * models.F('initial_stock'), then=models.Value(True)),
-            default=models.Value(False),
-            output_field=models.BooleanField()
+    analytics = analytics_queryset(one_month_ago)
+
+    # Keyset pagination on center_id: ?limit=N, then ?cursor=<next_cursor>
+    cursor = request.query_params.get('cursor')
+    if cursor:
+        try:
+            after = decode_cursor(cursor)
+        except (ValueError, UnicodeDecodeError):
+            return Response({"error": "Invalid cursor"}, status=400)
+        analytics = analytics.filter(center_id__gt=after)
+
+    # Streaming mode emits NDJSON rows straight off the DB cursor, so memory
+    # stays flat however many centers there are
+    if request.query_params.get('stream') in ('1', 'true'):
+        rows = analytics.iterator(chunk_size=settings.ANALYTICS_STREAM_CHUNK_SIZE)
+        return StreamingHttpResponse(
+            (json.dumps(analytics_row(row), cls=DjangoJSONEncoder) + '\n' for row in rows),
+            content_type='application/x-ndjson'
         )
-    ).values('center_id', 'stock', 'initial_stock', 'remaining_percentage', 'low_stock_alert', 'total_orders', 'total_quantity')
 
-    return Response(list(analytics))
\ No newline at end of file
+    limit = request.query_params.get('limit')
+    if limit is None and cursor is None:
+        return Response([analytics_row(row) for row in analytics])
+
+    limit = page_limit(limit)
+    if limit is None:
+        return Response({"error": "limit must be a positive integer"}, status=400)
+
+    page = [analytics_row(row) for row in analytics[:limit + 1]]
+    next_cursor = None
+    if len(page) > limit:
+        page = page[:limit]
+        next_cursor = encode_cursor(page[-1]['center_id'])
+    return Response({"results": page, "next_cursor": next_cursor})
+
+TREND_INTERVALS = ('hour', 'day', 'week')
+
+def _parse_datetime(value):
+    parsed = datetime.fromisoformat(value)
+    if timezone.is_naive(parsed):
+        parsed = timezone.make_aware(parsed)
+    return parsed
+
+def order_trends(start, end, interval='day', center_id=None):
+    # Allocated orders bucketed per center; the (status, created_at) and
+    # (center, created_at) indexes keep the range scan off the full table
+    orders = Order.objects.filter(status='allocated', created_at__gte=start, created_at__lt=end)
+    if center_id:
+        orders = orders.filter(center__center_id=center_id)
+    return (
+        orders.annotate(bucket=Trunc('created_at', interval))
+        .values('center__center_id', 'bucket')
+        .annotate(total_orders=Count('id'), total_quantity=Sum('quantity'))
+        .order_by('center__center_id', 'bucket')
+    )
+
+@api_view(['GET'])
+@authentication_classes([ApiKeyAuthentication, TimedBasicAuthentication])
+@permission_classes([IsAuthenticated])
+@replica.replica_reads
+@versioned_response()
+def order_trends_view(request):
+    interval = request.query_params.get('interval', 'day')
+    if interval not in TREND_INTERVALS:
+        return Response({"error": f"interval must be one of: {', '.join(TREND_INTERVALS)}"}, status=400)
+
+    end = timezone.now()
+    start = end - timedelta(days=7)
+    try:
+        if request.query_params.get('from_date'):
+            start = _parse_datetime(request.query_params['from_date'])
+        if request.query_params.get('to_date'):
+            end = _parse_datetime(request.query_params['to_date'])
+    except ValueError:
+        return Response({"error": "Invalid date format (use YYYY-MM-DD or ISO 8601)"}, status=400)
+    if start >= end:
+        return Response({"error": "from_date must be before to_date"}, status=400)
+
+    center_id = request.query_params.get('center_id')
+    rows = [
+        {
+            "center_id": row['center__center_id'],
+            "bucket": row['bucket'],
+            "total_orders": row['total_orders'],
+            "total_quantity": row['total_quantity'],
+        }
+        for row in order_trends(start, end, interval, center_id)
+    ]
+    return Response(with_archived_trends(rows, start, end, interval, center_id))
+
+def with_archived_trends(rows, start, end, interval, center_id=None):
+    # Adds archived orders (see allocation.archive) to order_trends rows. The
+    # manifest decides which segments overlap the range, so recent ranges
+    # never open the archive.
+    center_pk = None
+    if center_id:
+        center_pk = DistributionCenter.objects.filter(center_id=center_id).values_list('pk', flat=True).first()
+        if center_pk is None:
+            return rows
+    archived = archive.trends(start, end, interval, center_pk)
+    if not archived:
+        return rows
+    center_ids = dict(DistributionCenter.objects.filter(
+        pk__in={pk for pk, _ in archived if pk is not None}
+    ).values_list('pk', 'center_id'))
+    merged = {(row['center_id'], row['bucket']): row for row in rows}
+    for (pk, bucket), (orders, quantity) in archived.items():
+        row = merged.setdefault((center_ids.get(pk), bucket), {
+            "center_id": center_ids.get(pk), "bucket": bucket, "total_orders": 0, "total_quantity": 0,
+        })
+        row['total_orders'] += orders
+        row['total_quantity'] += quantity
+    return sorted(merged.values(), key=lambda row: (row['center_id'] is not None, row['center_id'] or '', row['bucket']))
+
+@api_view(['GET'])
+@authentication_classes([ApiKeyAuthentication, TimedBasicAuthentication])
+@permission_classes([IsAuthenticated])
+@replica.replica_reads
+@versioned_response()
+def stock_forecast_view(request):
+    # Projected stock-out per center, soonest first; ?within_days=N keeps
+    # only centers expected to run out within N days
+    within_days = request.query_params.get('within_days')
+    if within_days is not None:
+        try:
+            within_days = float(within_days)
+        except ValueError:
+            within_days = -1
+        if not within_days >= 0:
+            return Response({"error": "within_days must be a non-negative number"}, status=400)
+    return Response(forecast.forecast(within_days))
+
+@api_view(['GET'])
+@authentication_classes([ApiKeyAuthentication, TimedBasicAuthentication])
+@permission_classes([IsAuthenticated])
+@replica.replica_reads
+def metrics_view(request):
+    # Prometheus text exposition format
+    return HttpResponse(metrics.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
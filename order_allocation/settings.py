@@ -10,6 +10,7 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/4.2/ref/settings/
 """
 
+import os
 from pathlib import Path
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
@@ -44,6 +45,7 @@ INSTALLED_APPS = [
 
 
 MIDDLEWARE = [
+    'allocation.instrumentation.ServerTimingMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -81,9 +83,62 @@ DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
         'NAME': BASE_DIR / 'db.sqlite3',
-    }
+        # File-backed test DB: the default shared-cache in-memory DB fails
+        # concurrent writers immediately instead of waiting on the lock
+        'TEST': {
+            'NAME': BASE_DIR / 'test_db.sqlite3',
+        },
+    },
+    # Read replica for analytics (see allocation.replica). Locally a copy of
+    # db.sqlite3 refreshed by sync_replica.
+    'replica': {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': os.environ.get('DATABASE_REPLICA_PATH', BASE_DIR / 'db_replica.sqlite3'),
+        'TEST': {
+            'NAME': BASE_DIR / 'test_db_replica.sqlite3',
+        },
+    },
 }
 
+DATABASE_ROUTERS = ['allocation.replica.ReplicaRouter']
+
+
+# Cache
+# https://docs.djangoproject.com/en/4.2/topics/cache/
+# 'analytics' holds versioned /analytics/ responses: TIMEOUT is the TTL and
+# locmem evicts least-recently-used entries beyond MAX_ENTRIES
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    'analytics': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'analytics',
+        'TIMEOUT': 30,
+        'OPTIONS': {
+            'MAX_ENTRIES': 256,
+        },
+    },
+    # Completed responses replayed for Idempotency-Key retries
+    'idempotency': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'idempotency',
+        'TIMEOUT': 24 * 60 * 60,
+        'OPTIONS': {
+            'MAX_ENTRIES': 10000,
+        },
+    },
+    # State every worker process has to see: the replica read pins
+    # (required with REPLICA_READS_ENABLED) and the API key cache version.
+    # Defaults to a table in the primary database (python manage.py
+    # createcachetable); point SHARED_CACHE_BACKEND/SHARED_CACHE_LOCATION at
+    # Redis or Memcached in production.
+    'shared': {
+        'BACKEND': os.environ.get('SHARED_CACHE_BACKEND', 'django.core.cache.backends.db.DatabaseCache'),
+        'LOCATION': os.environ.get('SHARED_CACHE_LOCATION', 'allocation_shared_cache'),
+    },
+}
 
 # Password validation
 # https://docs.djangoproject.com/en/4.2/ref/settings/#auth-password-validators
@@ -125,3 +180,119 @@ STATIC_URL = 'static/'
 # https://docs.djangoproject.com/en/4.2/ref/settings/#default-auto-field
 
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
+
+# Allocation API
+# Shared key kept for clients not yet moved to issued keys (issue_api_key);
+# off unless set in the environment. It authenticates as API_KEY_USER, which
+# must already exist.
+API_KEY = os.environ.get('API_KEY')
+API_KEY_USER = 'api'
+# Verified Api-Key headers kept per process, and for how many seconds
+API_KEY_CACHE_SIZE = 1024
+API_KEY_CACHE_TTL = 60
+
+# Maximum number of orders accepted by /allocate/batch/
+ALLOCATION_BATCH_MAX_SIZE = 5000
+
+# Seconds an in-process distribution-center snapshot is trusted before it is
+# reloaded, even if no invalidation was seen (e.g. per-process cache backend)
+INVENTORY_SNAPSHOT_TTL = 5
+
+# Background NDJSON sinks for the mock S3 order logs and CloudWatch alerts
+LOG_SINK_QUEUE_SIZE = 10000
+LOG_SINK_BATCH_SIZE = 500
+LOG_SINK_FLUSH_INTERVAL = 1.0
+LOG_SINK_SEGMENT_MAX_BYTES = 64 * 1024 * 1024
+LOG_SINK_SEGMENT_MAX_AGE = 300
+LOG_SINK_COMPRESS = False
+# Seconds emit() waits for room in a full queue before dropping the record
+LOG_SINK_BLOCK_TIMEOUT = 0.05
+# Where each sink's segments go: BACKEND is 'local', 'memory', 's3',
+# 'cloudwatch' or a dotted class path (see allocation/storage.py). boto3 is
+# only imported by the AWS backends, on first write. For real AWS, e.g.
+#   'orders': {'BACKEND': 's3', 'OPTIONS': {'bucket': 'fanatics-orders', 'prefix': 'orders/'}}
+#   'alerts': {'BACKEND': 'cloudwatch', 'OPTIONS': {'log_group': 'fanatics-alerts', 'region_name': 'us-east-1'}}
+LOG_SINK_STORAGES = {
+    'orders': {'BACKEND': 'local', 'OPTIONS': {'directory': 'logs'}},
+    'alerts': {'BACKEND': 'local', 'OPTIONS': {'directory': 'alerts'}},
+}
+
+# /analytics/ keyset pagination and NDJSON streaming
+ANALYTICS_PAGE_MAX_SIZE = 1000
+ANALYTICS_STREAM_CHUNK_SIZE = 2000
+
+# /analytics/forecast/: daily demand is an EWMA (smoothing FORECAST_EWMA_ALPHA)
+# over the last FORECAST_WINDOW_DAYS closed days of rollups; centers expected
+# to run out within FORECAST_LEAD_TIME_DAYS are flagged for replenishment
+FORECAST_WINDOW_DAYS = 28
+FORECAST_EWMA_ALPHA = 0.3
+FORECAST_LEAD_TIME_DAYS = 7
+
+# Per-request Server-Timing header (auth, validate, locate, reserve, log, db,
+# total). When disabled the middleware is dropped and probes are no-ops.
+REQUEST_TIMING_ENABLED = os.environ.get('REQUEST_TIMING_ENABLED', '') == '1'
+# Requests slower than this are sampled to the allocation.slow_requests logger
+SLOW_REQUEST_THRESHOLD_MS = 500
+SLOW_REQUEST_SAMPLE_RATE = 1.0
+
+# Prometheus metrics. With METRICS_DIR set, each worker publishes its totals
+# there every METRICS_FLUSH_INTERVAL seconds and /metrics/ serves the merge.
+METRICS_DIR = os.environ.get('METRICS_DIR') or None
+METRICS_FLUSH_INTERVAL = 5
+
+# Idempotency-Key handling for /allocate/ and /allocate/batch/
+IDEMPOTENCY_KEY_MAX_LENGTH = 255
+IDEMPOTENCY_LOCK_TIMEOUT = 30
+IDEMPOTENCY_WAIT_TIMEOUT = 10
+IDEMPOTENCY_POLL_INTERVAL = 0.05
+
+# Zip-code -> (lat, lon) centroid table built by build_zip_centroids. When the
+# file exists, centers are ranked by great-circle distance; otherwise by
+# numeric zip-code distance.
+ZIP_CENTROIDS_PATH = os.environ.get('ZIP_CENTROIDS_PATH') or str(BASE_DIR / 'data' / 'zip_centroids.npy')
+# Cap on (orders x centers) distance-matrix cells computed at once for batches
+GEO_RANK_BLOCK_ELEMENTS = 1000000
+
+# Micro-batching for /allocate/: requests arriving within the window are
+# assigned jointly (minimum total distance) and committed in one transaction
+ALLOCATION_MICROBATCH_ENABLED = os.environ.get('ALLOCATION_MICROBATCH_ENABLED', '') == '1'
+ALLOCATION_MICROBATCH_WINDOW_MS = 5
+ALLOCATION_MICROBATCH_MAX_SIZE = 64
+# Nearest centers considered per order when solving a window
+ALLOCATION_MICROBATCH_CANDIDATES = 16
+
+# Default slot count for shard_stock: a sharded center's stock is spread over
+# this many rows so concurrent allocations do not queue on one row lock
+INVENTORY_STOCK_SLOTS = 8
+
+# Low-stock alerts: (name, ratio of initial_stock) levels, entered below the
+# ratio and left only at ratio + ALERT_HYSTERESIS. A center that stays in a
+# level is re-alerted at most every ALERT_REALERT_INTERVAL seconds; alerts
+# are published in one batch every ALERT_FLUSH_INTERVAL seconds.
+ALERT_LEVELS = (('low', 0.20), ('critical', 0.05))
+ALERT_HYSTERESIS = 0.05
+ALERT_REALERT_INTERVAL = 15 * 60
+ALERT_FLUSH_INTERVAL = 1.0
+
+# Order archival (archive_orders): allocated orders older than
+# ORDER_RETENTION_DAYS move to per-month segment files in ARCHIVE_DIR, at most
+# ARCHIVE_SEGMENT_MAX_ROWS per file, each with an order_id bloom filter
+ARCHIVE_DIR = os.environ.get('ARCHIVE_DIR', str(BASE_DIR / 'archive'))
+ORDER_RETENTION_DAYS = 90
+ARCHIVE_SEGMENT_MAX_ROWS = 500000
+ARCHIVE_BLOOM_FP_RATE = 0.01
+
+# Read-only endpoints (analytics, trends, metrics) query REPLICA_DATABASE
+# when enabled and synced. A client that allocated in the last
+# REPLICA_STICKY_SECONDS reads from the primary; keep it above the replica's
+# lag (sync_replica --interval REPLICA_SYNC_INTERVAL locally). The pins live
+# in the 'shared' cache so every worker honours them.
+REPLICA_DATABASE = 'replica'
+REPLICA_READS_ENABLED = os.environ.get('REPLICA_READS_ENABLED') == '1'
+REPLICA_SYNC_INTERVAL = 5
+REPLICA_STICKY_SECONDS = 15
+
+# OpenAPI schema for /schema/ and /docs/
+REST_FRAMEWORK = {
+    'DEFAULT_SCHEMA_CLASS': 'drf_spectacular.openapi.AutoSchema',
+}
@@ -1,12 +1,20 @@
 from django.contrib import admin
 from django.urls import path
-from allocation.views import allocate_order_view, center_analytics_view
+from allocation.views import allocate_order_view, allocate_batch_view, center_analytics_view, order_trends_view, stock_forecast_view, metrics_view
+from allocation.async_views import allocate_order_async_view, center_analytics_async_view
 from drf_spectacular.views import SpectacularAPIView, SpectacularSwaggerView
 
 urlpatterns = [
     path('admin/', admin.site.urls),
     path('allocate/', allocate_order_view, name='allocate_order'),
+    path('allocate/batch/', allocate_batch_view, name='allocate_batch'),
     path('analytics/', center_analytics_view, name='center_analytics'),
+    path('analytics/trends/', order_trends_view, name='order_trends'),
+    path('analytics/forecast/', stock_forecast_view, name='stock_forecast'),
+    path('metrics/', metrics_view, name='metrics'),
+    # Async-native variants for ASGI deployments
+    path('async/allocate/', allocate_order_async_view, name='allocate_order_async'),
+    path('async/analytics/', center_analytics_async_view, name='center_analytics_async'),
     path('schema/', SpectacularAPIView.as_view(), name='schema'),
     path('docs/', SpectacularSwaggerView.as_view(url_name='schema'), name='swagger-ui'),
 ]
\ No newline at end of file